@@ -36,6 +36,11 @@ fi
 
 $DOCKER_COMPOSE_EXEC --user ${UID} ${web} ./manage.py makemigrations -v1
 $DOCKER_COMPOSE_EXEC --user ${UID} ${web} ./manage.py migrate -v1
+$DOCKER_COMPOSE_EXEC --user ${UID} ${web} ./manage.py build_document_text_links
+$DOCKER_COMPOSE_EXEC --user ${UID} ${web} ./manage.py backfill_document_text_pages
+$DOCKER_COMPOSE_EXEC --user ${UID} ${web} ./manage.py backfill_transcript_extraction
+$DOCKER_COMPOSE_EXEC --user ${UID} ${web} ./manage.py backfill_transcript_joins
+$DOCKER_COMPOSE_EXEC --user ${UID} ${web} ./manage.py build_transcript_code_references
 
 
 # the solr image used for deployments & CI already carries its data
@@ -56,7 +61,7 @@ then
 	$DOCKER_COMPOSE_EXEC ${solr} solr create_core -c $SOLR_CORE -d solr_conf || echo 'Solr core already exists'
 
 	echo "Rebuilding Solr index (SLOW)"
-	time $DOCKER_COMPOSE_EXEC ${web} python manage.py rebuild_index -b500 -k4 --noinput || exit 1
+	time $DOCKER_COMPOSE_EXEC ${web} python manage.py solr_bulk_index --clear --workers 4 || exit 1
 fi
 
 # this is used by the regen-solr-image just(1) target
@@ -4,3 +4,27 @@ import pytest
 @pytest.fixture()
 def django_db_setup(settings):
     return
+
+
+@pytest.fixture(autouse=True)
+def clear_author_metadata_cache():
+    # The cache is process-wide, but each test may bake its own authors
+    from nuremberg.documents.models import author_metadata_cache
+
+    author_metadata_cache.clear()
+
+
+@pytest.fixture(autouse=True)
+def clear_transcript_navigations():
+    # Loaded once per process, but each test may bake or change pages
+    from nuremberg.transcripts.navigation import clear_navigations
+
+    clear_navigations()
+
+
+@pytest.fixture(autouse=True)
+def clear_document_text_links_built():
+    # Remembered once per process, but each test may build the links or not
+    from nuremberg.documents.models import DocumentTextLink
+
+    DocumentTextLink.built = False
@@ -22,7 +22,7 @@ class Command(BaseCommand):
         pages = transcript.pages.filter(
             seq_number__gte=options['from_seq'],
             seq_number__lte=options['to_seq'],
-        )
+        ).with_xml()
         joiner = TranscriptPageJoiner(pages)
         joiner.audit = True
 
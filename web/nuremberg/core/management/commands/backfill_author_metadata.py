@@ -4,6 +4,7 @@ from django.core.management.base import BaseCommand
 from nuremberg.documents.models import (
     DocumentAuthorExtra,
     DocumentPersonalAuthor,
+    author_metadata_cache,
 )
 
 
@@ -91,6 +92,8 @@ class Command(BaseCommand):
                 f'{model_name}(s).'
             )
         else:
+            # Other processes will notice the new extra versions on their own
+            author_metadata_cache.clear()
             self.stdout.write(
                 f'Created {created} and updated {updated} {model_name}(s).'
             )
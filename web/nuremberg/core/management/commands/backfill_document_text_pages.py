@@ -0,0 +1,77 @@
+from django.db import transaction
+from django.db.models import F, Q
+from django.core.management.base import BaseCommand
+
+from nuremberg.documents.models import DocumentText, DocumentTextExtra
+
+
+class DryRunRequested(Exception):
+    """Do not make changes to the db when --dry-run was requested."""
+
+    def __init__(self, created, updated, *args, **kwargs):
+        self.created = created
+        self.updated = updated
+        super().__init__(*args, **kwargs)
+
+
+class Command(BaseCommand):
+    help = 'Backfill the page count and page offsets of DocumentTexts'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ids',
+            nargs='+',
+            type=int,
+            default=None,
+            help='DocumentText IDs to process (default is all)',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Re-compute the pages even if they are up to date',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help=(
+                'Calculate how many texts would be back filled but make no '
+                'actual changes'
+            ),
+        )
+
+    @transaction.atomic
+    def backfill(self, qs, dry_run=False):
+        outdated = DocumentTextExtra.objects.filter(text__in=qs)
+        updated = outdated.count()
+        outdated.delete()
+        created = len(DocumentTextExtra.objects.bulk_create_from_text_qs(qs))
+
+        if dry_run:
+            raise DryRunRequested(created=created - updated, updated=updated)
+
+        return created - updated, updated
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Starting backfill for text pages ({options=})')
+
+        qs = DocumentText.objects.with_text()
+        model_name = DocumentTextExtra.__name__
+        if options['ids']:
+            qs = qs.filter(id__in=options['ids'])
+        if not options['force']:
+            qs = qs.filter(
+                Q(extra__isnull=True)
+                | ~Q(extra__load_timestamp=F('load_timestamp'))
+            )
+
+        try:
+            created, updated = self.backfill(qs, dry_run=options['dry_run'])
+        except DryRunRequested as e:
+            self.stdout.write(
+                f'Would have created {e.created} and updated {e.updated} '
+                f'{model_name}(s).'
+            )
+        else:
+            self.stdout.write(
+                f'Created {created} and updated {updated} {model_name}(s).'
+            )
@@ -0,0 +1,86 @@
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from nuremberg.documents.models import DocumentImage
+
+
+class Command(BaseCommand):
+    help = (
+        'Backfill width, height and size of DocumentImages by reading only '
+        'the image headers from the bucket'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ids',
+            nargs='+',
+            type=int,
+            default=None,
+            help='Document IDs to be processed (default is all)',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Re-read the dimensions even if already stored',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=16,
+            help='Number of concurrent header requests (default is 16)',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of images saved per DB update (default is 1000)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Read the dimensions but make no actual changes',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f'Starting backfill for image dimensions ({options=})'
+        )
+
+        qs = DocumentImage.objects.exclude(image='').exclude(image=None)
+        if options['ids']:
+            qs = qs.filter(document_id__in=options['ids'])
+        if not options['force']:
+            qs = qs.filter(image_width__isnull=True)
+        images = list(qs.order_by('document_id', 'page_number'))
+        model_name = DocumentImage.__name__
+        self.stdout.write(f'Reading headers of {len(images)} {model_name}(s).')
+
+        def read(image):
+            return image, image.read_dimensions(save=False)
+
+        batch = []
+        updated = failed = 0
+        with ThreadPoolExecutor(max_workers=options['workers']) as executor:
+            for image, ok in executor.map(read, images):
+                if not ok:
+                    failed += 1
+                    self.stderr.write(f'Could not read dimensions of {image}')
+                    continue
+                batch.append(image)
+                if len(batch) >= options['batch_size']:
+                    updated += self.save(batch, options['dry_run'])
+                    batch = []
+        updated += self.save(batch, options['dry_run'])
+
+        prefix = 'Would have updated' if options['dry_run'] else 'Updated'
+        self.stdout.write(
+            f'{prefix} {updated} {model_name}(s), {failed} failed.'
+        )
+
+    def save(self, images, dry_run=False):
+        if dry_run or not images:
+            return len(images)
+        return DocumentImage.objects.bulk_update(
+            images, fields=['image_width', 'image_height', 'image_size']
+        )
@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand
+
+from nuremberg.transcripts.models import TranscriptPage
+
+
+class Command(BaseCommand):
+    help = (
+        'Backfill the text, evidence codes, exhibit codes and speakers '
+        'extracted from the XML of TranscriptPages'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ids',
+            nargs='+',
+            type=int,
+            default=None,
+            help='Transcript IDs to be processed (default is all)',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Re-extract the values even if already stored',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of pages saved per DB update (default is 1000)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Parse the pages but make no actual changes',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f'Starting backfill for transcript extraction ({options=})'
+        )
+
+        qs = TranscriptPage.objects.with_xml()
+        if options['ids']:
+            qs = qs.filter(transcript_id__in=options['ids'])
+        if not options['force']:
+            qs = qs.filter(extracted_text__isnull=True)
+        model_name = TranscriptPage.__name__
+
+        batch = []
+        updated = 0
+        for page in qs.order_by('id').iterator(options['batch_size']):
+            page.populate_from_xml()
+            batch.append(page)
+            if len(batch) >= options['batch_size']:
+                updated += self.save(batch, options['dry_run'])
+                batch = []
+        updated += self.save(batch, options['dry_run'])
+
+        prefix = 'Would have updated' if options['dry_run'] else 'Updated'
+        self.stdout.write(f'{prefix} {updated} {model_name}(s).')
+
+    def save(self, pages, dry_run=False):
+        if dry_run or not pages:
+            return len(pages)
+        return TranscriptPage.objects.bulk_update(
+            pages, fields=TranscriptPage.EXTRACTED_FIELDS
+        )
@@ -0,0 +1,81 @@
+from django.core.management.base import BaseCommand
+
+from nuremberg.transcripts.models import Transcript, TranscriptPage
+from nuremberg.transcripts.xml import TranscriptPageJoiner
+
+
+class Command(BaseCommand):
+    help = (
+        'Join every page of the transcripts and store, for each page, the '
+        'join state used to render any page range from its own pages'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ids',
+            nargs='+',
+            type=int,
+            default=None,
+            help='Transcript IDs to be processed (default is all)',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Measure the joins again even if already stored',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of pages saved per DB update (default is 1000)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Join the pages but make no actual changes',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f'Starting backfill for transcript joins ({options=})'
+        )
+
+        qs = Transcript.objects.order_by('id')
+        if options['ids']:
+            qs = qs.filter(id__in=options['ids'])
+        if not options['force']:
+            qs = qs.filter(pages__joins_previous__isnull=True).distinct()
+        model_name = TranscriptPage.__name__
+
+        updated = 0
+        for transcript in qs:
+            pages = (
+                transcript.pages.with_xml()
+                .order_by('seq_number')
+                .iterator(options['batch_size'])
+            )
+            joiner = TranscriptPageJoiner([])
+            batch = []
+            for page, joins_previous, carry_out_html in joiner.measure_joins(
+                pages
+            ):
+                page.joins_previous = joins_previous
+                page.carry_out_html = carry_out_html
+                batch.append(page)
+                if len(batch) >= options['batch_size']:
+                    updated += self.save(batch, options['dry_run'])
+                    batch = []
+            updated += self.save(batch, options['dry_run'])
+            if not options['dry_run']:
+                # drop the joins cached with the previous join state
+                transcript.save(update_fields=['updated_at'])
+
+        prefix = 'Would have updated' if options['dry_run'] else 'Updated'
+        self.stdout.write(f'{prefix} {updated} {model_name}(s).')
+
+    def save(self, pages, dry_run=False):
+        if dry_run or not pages:
+            return len(pages)
+        return TranscriptPage.objects.bulk_update(
+            pages, fields=TranscriptPage.JOIN_FIELDS
+        )
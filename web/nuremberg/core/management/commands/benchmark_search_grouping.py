@@ -0,0 +1,83 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from nuremberg.search.forms import DocumentSearchForm
+from nuremberg.search.lib.solr_grouping_backend import COLLAPSE, GROUP
+from nuremberg.search.views import Search
+
+DEFAULT_QUERIES = (
+    '*',
+    'Brandt',
+    'euthanasia experiments',
+    'author:Himmler',
+    'type:transcripts sterilization',
+)
+
+
+class Command(BaseCommand):
+    help = (
+        'Compare the latency of the main search in Solr with results '
+        'grouped by result grouping and by the collapse query parser '
+        '(bypassing the search result cache)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--query',
+            dest='queries',
+            action='append',
+            default=None,
+            help='Search query to run, can be repeated (default is a few)',
+        )
+        parser.add_argument(
+            '--repeat',
+            type=int,
+            default=10,
+            help='Number of timed runs per query and mode (default is 10)',
+        )
+
+    def build_query(self, q):
+        """Build the search query of the first results page as `Search`."""
+        form = DocumentSearchForm(
+            {'q': q},
+            searchqueryset=Search().get_queryset(),
+            sort_results=Search.default_sort,
+            selected_facets=[],
+            facet_to_label=Search.facet_to_label,
+        )
+        sqs = form.search()
+        sqs.query.set_limits(0, Search.paginate_by)
+        return sqs.query
+
+    def time_search(self, query, mode, repeat):
+        """Return the hits and run times in ms of `query` in `mode`."""
+        query_string = query.build_query()
+        kwargs = query.build_params()
+        kwargs['grouping_mode'] = mode
+        times = []
+        # the first run warms the Solr caches and is not timed
+        for i in range(repeat + 1):
+            start = time.perf_counter()
+            results, succeeded = query.backend.run_search(
+                query_string, **kwargs
+            )
+            if not succeeded:
+                raise CommandError(f'Failed to search {query_string!r}')
+            if i:
+                times.append((time.perf_counter() - start) * 1000)
+        return results['hits'], times
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Starting search grouping benchmark ({options=})')
+
+        for q in options['queries'] or DEFAULT_QUERIES:
+            query = self.build_query(q)
+            for mode in (GROUP, COLLAPSE):
+                hits, times = self.time_search(query, mode, options['repeat'])
+                self.stdout.write(
+                    f'{q!r} {mode}: {hits} hits, median '
+                    f'{statistics.median(times):.1f} ms (min {min(times):.1f}'
+                    f', max {max(times):.1f})'
+                )
@@ -0,0 +1,133 @@
+from collections import defaultdict
+
+from django.db import transaction
+from django.core.management.base import BaseCommand
+
+from nuremberg.documents.models import (
+    Document,
+    DocumentEvidenceCode,
+    DocumentText,
+    DocumentTextLink,
+)
+
+
+class DryRunRequested(Exception):
+    """Do not make changes to the db when --dry-run was requested."""
+
+    def __init__(self, created, deleted, *args, **kwargs):
+        self.created = created
+        self.deleted = deleted
+        super().__init__(*args, **kwargs)
+
+
+class Command(BaseCommand):
+    help = (
+        'Build the DocumentTextLink table relating full texts and documents '
+        '(needs to be re-run after loading a new dump)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help=(
+                'Calculate how many links would be built but make no actual '
+                'changes'
+            ),
+        )
+
+    def full_text_ranks(self, document_ids):
+        """Rank texts per document as `Document._derive_full_texts` does."""
+        direct = defaultdict(list)
+        by_code = defaultdict(list)
+        texts = DocumentText.objects.order_by('id').values_list(
+            'id', 'hlsl_doc_id', 'evidence_code_series', 'evidence_code_num'
+        )
+        for text_id, hlsl_doc_id, series, number in texts:
+            if hlsl_doc_id is not None:
+                direct[hlsl_doc_id].append(text_id)
+            # Matches the SQL `Concat` used when deriving, where NULL is ''
+            by_code[f'{series or ""}-{number or ""}'].append(text_id)
+
+        codes = defaultdict(set)
+        evidence_codes = DocumentEvidenceCode.objects.values_list(
+            'document_id', 'prefix__code', 'number'
+        )
+        for document_id, prefix_code, number in evidence_codes:
+            codes[document_id].add(f'{prefix_code}-{number}')
+
+        ranks = {}
+        for document_id in document_ids:
+            if direct[document_id]:
+                text_ids = direct[document_id]
+            else:
+                text_ids = sorted(
+                    {t for code in codes[document_id] for t in by_code[code]}
+                )
+            for rank, text_id in enumerate(text_ids):
+                ranks[(text_id, document_id)] = rank
+        return ranks
+
+    def document_ranks(self, document_ids):
+        """Rank documents per text as `DocumentText._derive_documents` does."""
+        ranks = {}
+        texts = DocumentText.objects.only(
+            'id',
+            'hlsl_doc_id',
+            'evidence_code_tag',
+            'evidence_code_series',
+            'evidence_code_num',
+        ).order_by('id')
+        for text in texts:
+            if text.hlsl_doc_id in document_ids:
+                ranks[(text.id, text.hlsl_doc_id)] = 0
+                continue
+            # The ranked query may yield a document more than once, keep the
+            # first (best ranked) occurrence
+            matches = text._derive_documents().values_list('id', flat=True)
+            for rank, document_id in enumerate(dict.fromkeys(matches)):
+                ranks[(text.id, document_id)] = rank
+        return ranks
+
+    @transaction.atomic
+    def build(self, dry_run=False):
+        document_ids = set(Document.objects.values_list('id', flat=True))
+        text_ranks = self.full_text_ranks(document_ids)
+        document_ranks = self.document_ranks(document_ids)
+
+        links = [
+            DocumentTextLink(
+                text_id=text_id,
+                document_id=document_id,
+                text_rank=text_ranks.get((text_id, document_id)),
+                document_rank=document_ranks.get((text_id, document_id)),
+            )
+            for text_id, document_id in sorted(
+                text_ranks.keys() | document_ranks.keys()
+            )
+        ]
+        deleted, _ = DocumentTextLink.objects.all().delete()
+        created = len(DocumentTextLink.objects.bulk_create(links, 1000))
+
+        if dry_run:
+            raise DryRunRequested(created=created, deleted=deleted)
+
+        return created, deleted
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f'Starting build of document text links ({options=})'
+        )
+
+        model_name = DocumentTextLink.__name__
+        try:
+            created, deleted = self.build(dry_run=options['dry_run'])
+        except DryRunRequested as e:
+            self.stdout.write(
+                f'Would have deleted {e.deleted} and created {e.created} '
+                f'{model_name}(s).'
+            )
+        else:
+            self.stdout.write(
+                f'Deleted {deleted} and created {created} {model_name}(s).'
+            )
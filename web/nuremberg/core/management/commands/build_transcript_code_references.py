@@ -0,0 +1,143 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from nuremberg.documents.models import (
+    DocumentEvidenceCode,
+    DocumentExhibitCode,
+)
+from nuremberg.transcripts.models import (
+    TranscriptCodeReference,
+    TranscriptPage,
+)
+
+
+class DryRunRequested(Exception):
+    """Do not make changes to the db when --dry-run was requested."""
+
+    def __init__(self, created, deleted, *args, **kwargs):
+        self.created = created
+        self.deleted = deleted
+        super().__init__(*args, **kwargs)
+
+
+class Command(BaseCommand):
+    help = (
+        'Build the TranscriptCodeReference table relating the evidence and '
+        'exhibit codes cited by transcript pages to documents (needs to be '
+        're-run after loading a new dump or ingesting transcripts)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Number of rows read and created at once (default is 1000)',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help=(
+                'Calculate how many references would be built but make no '
+                'actual changes'
+            ),
+        )
+
+    def page_references(self, batch_size):
+        """Yield the references of the codes extracted from every page."""
+        normalize = TranscriptCodeReference.normalize_code
+        pages = TranscriptPage.objects.only(
+            'id',
+            'transcript_id',
+            'seq_number',
+            'evidence_codes',
+            'exhibit_codes',
+        ).order_by('id')
+        for page in pages.iterator(batch_size):
+            for kind, codes in (
+                (
+                    TranscriptCodeReference.EVIDENCE,
+                    page.extract_evidence_codes(),
+                ),
+                (
+                    TranscriptCodeReference.EXHIBIT,
+                    page.extract_exhibit_codes(),
+                ),
+            ):
+                for code in dict.fromkeys(filter(None, map(normalize, codes))):
+                    yield TranscriptCodeReference(
+                        kind=kind,
+                        code=code,
+                        page_id=page.id,
+                        transcript_id=page.transcript_id,
+                        seq_number=page.seq_number,
+                    )
+
+    def document_references(self, batch_size):
+        """Yield the references of the codes of every document, as they are
+        indexed in Solr."""
+        normalize = TranscriptCodeReference.normalize_code
+        seen = set()
+        for kind, codes in (
+            (
+                TranscriptCodeReference.EVIDENCE,
+                DocumentEvidenceCode.objects.select_related('prefix'),
+            ),
+            (
+                TranscriptCodeReference.EXHIBIT,
+                DocumentExhibitCode.objects.select_related('defense_name'),
+            ),
+        ):
+            for code in codes.order_by('id').iterator(batch_size):
+                value = normalize(str(code))
+                # Skip codes with broken foreign keys, see `DocumentIndex`
+                if not value or value.startswith('NO_PREFIX'):
+                    continue
+                if (kind, value, code.document_id) not in seen:
+                    seen.add((kind, value, code.document_id))
+                    yield TranscriptCodeReference(
+                        kind=kind, code=value, document_id=code.document_id
+                    )
+
+    @transaction.atomic
+    def build(self, batch_size, dry_run=False):
+        deleted, _ = TranscriptCodeReference.objects.all().delete()
+        created = 0
+        batch = []
+        for references in (
+            self.page_references(batch_size),
+            self.document_references(batch_size),
+        ):
+            for reference in references:
+                batch.append(reference)
+                if len(batch) >= batch_size:
+                    created += len(
+                        TranscriptCodeReference.objects.bulk_create(batch)
+                    )
+                    batch = []
+        created += len(TranscriptCodeReference.objects.bulk_create(batch))
+
+        if dry_run:
+            raise DryRunRequested(created=created, deleted=deleted)
+
+        return created, deleted
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f'Starting build of transcript code references ({options=})'
+        )
+
+        model_name = TranscriptCodeReference.__name__
+        try:
+            created, deleted = self.build(
+                options['batch_size'], dry_run=options['dry_run']
+            )
+        except DryRunRequested as e:
+            self.stdout.write(
+                f'Would have deleted {e.deleted} and created {e.created} '
+                f'{model_name}(s).'
+            )
+        else:
+            self.stdout.write(
+                f'Deleted {deleted} and created {created} {model_name}(s).'
+            )
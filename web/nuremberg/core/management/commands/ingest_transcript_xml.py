@@ -1,19 +1,64 @@
+import multiprocessing
+import os
 import re
+from bisect import bisect_right
+from concurrent.futures import ProcessPoolExecutor
 from os import path, listdir
 
+from django.core.management import call_command
 from django.core.management.base import BaseCommand
+from django.db import IntegrityError, connections, transaction
+from django.utils import timezone
 from nuremberg.documents.models import DocumentCase
 from nuremberg.transcripts.models import Transcript, TranscriptPage
 
+FILENAME_RE = re.compile(
+    r"^NRMB-(?P<case_label>[A-Z]+)(?P<case_number>\d{2})?-(?P<volume>\d{2})_(?P<vol_seq>\d{5})(_[01])?\.xml$"
+)
+
+# Fields written for pages updated in bulk
+BULK_UPDATE_FIELDS = (
+    "seq_number",
+    "date",
+    "page_number",
+    "page_label",
+    "xml",
+    "xml_hash",
+    "image",
+    "updated_at",
+    *TranscriptPage.EXTRACTED_FIELDS,
+    *TranscriptPage.JOIN_FIELDS,
+)
+
+
+def parse_filename(filename):
+    """Return the case id, volume number and volume seq number of a page file."""
+    m = FILENAME_RE.match(filename)
+    if not m:
+        raise ValueError(f"Invalid filename: {filename}")
+
+    # sketchily get case ID
+    if m.group("case_label") == "NMT":
+        case_id = int(m.group("case_number")) + 1
+    elif m.group("case_label") == "IMT":
+        case_id = 1
+    else:
+        raise ValueError(f"Invalid case name: {m.group('case_label')}")
+
+    return case_id, int(m.group("volume")), int(m.group("vol_seq"))
+
+
+def parse_page_xml(xml):
+    """Return the values parsed from a page XML, in a bulk mode worker."""
+    return TranscriptPage(xml=xml).parse_xml()
+
 
 class Command(BaseCommand):
     help = (
         "Parses a transcript page XML file or files and creates the appropriate models"
     )
 
-    filename_re = re.compile(
-        r"^NRMB-(?P<case_label>[A-Z]+)(?P<case_number>\d{2})?-(?P<volume>\d{2})_(?P<vol_seq>\d{5})(_[01])?\.xml$"
-    )
+    filename_re = FILENAME_RE
 
     def add_arguments(self, parser):
         parser.add_argument("paths", nargs="+", type=str, help="XML files to ingest")
@@ -26,9 +71,52 @@ class Command(BaseCommand):
         parser.add_argument(
             "-s", default=None, type=int, help="Skip N files before ingesting."
         )
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Save the pages even if their XML is unchanged",
+        )
+        parser.add_argument(
+            "--changed-ids",
+            metavar="PATH",
+            default=None,
+            help=(
+                "Write the IDs of the added and changed pages to PATH, one per "
+                "line, for a targeted reindex"
+            ),
+        )
+        parser.add_argument(
+            "--bulk",
+            action="store_true",
+            help=(
+                "Parse the files in worker processes and save the pages in bulk, "
+                "one transaction per batch"
+            ),
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=4,
+            help="Number of worker processes in bulk mode, 0 to parse in-process "
+            "(default 4)",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of pages saved per transaction in bulk mode (default 1000)",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            metavar="PATH",
+            default=None,
+            help=(
+                "In bulk mode, record the last file saved in PATH and resume after "
+                "it when PATH exists (it is removed once every file is ingested)"
+            ),
+        )
 
     def handle(self, *args, **options):
-        count = 0
         if options["d"]:
             paths = []
             for dirname in options["paths"]:
@@ -39,27 +127,134 @@ class Command(BaseCommand):
             self.stdout.write(f"Skipping {options['s']} files.")
             paths = paths[options["s"] :]
 
+        self.force = options["force"]
+        self.transcripts = {}
+        self.volumes = {}
+        self.existing_pages = {}
+        self.transcript_ids = set()
+        self.added = self.changed = self.unchanged = 0
+
+        self.changed_ids = None
+        if options["changed_ids"]:
+            # a resumed bulk ingest adds to the IDs of the interrupted one
+            resuming = options["checkpoint"] and path.exists(options["checkpoint"])
+            self.changed_ids = open(options["changed_ids"], "a" if resuming else "w")
+        try:
+            if options["bulk"]:
+                self.ingest_bulk(paths, options)
+            else:
+                self.ingest(paths)
+        finally:
+            if self.changed_ids is not None:
+                self.changed_ids.close()
+
+        # any join across the new pages is measured again (which also drops
+        # the joins cached for the transcripts), so the pages keep rendering
+        # from their stored joins
+        if self.transcript_ids:
+            call_command(
+                "backfill_transcript_joins",
+                ids=sorted(self.transcript_ids),
+                force=True,
+                verbosity=options["verbosity"],
+                stdout=self.stdout,
+            )
+
+        self.stdout.write(
+            f"Added {self.added}, changed {self.changed} and skipped "
+            f"{self.unchanged} unchanged page(s)."
+        )
+
+    def read_file(self, file_path):
+        """Return the case id, volume number, volume seq number and XML of a
+        page file, or None after reporting why it can't be ingested."""
+        if not path.exists(file_path):
+            self.stderr.write(f"No such file: {file_path}")
+            return None
+
+        try:
+            location = parse_filename(path.basename(file_path))
+        except ValueError as e:
+            self.stderr.write(str(e))
+            return None
+
+        with open(file_path, "r") as file:
+            return (*location, file.read())
+
+    def is_unchanged(self, page, xml):
+        """Set the hash of `xml` on `page` and tell whether it can be skipped."""
+        xml_hash = TranscriptPage.hash_xml(xml)
+        unchanged = page.pk is not None and page.xml_hash == xml_hash
+        page.xml_hash = xml_hash
+        if unchanged and not self.force:
+            self.unchanged += 1
+            return True
+        return False
+
+    def record(self, page, created):
+        if created:
+            self.added += 1
+        else:
+            self.changed += 1
+        self.transcript_ids.add(page.transcript_id)
+        if self.changed_ids is not None:
+            self.changed_ids.write(f"{page.pk}\n")
+
+    def ingest(self, paths):
+        count = 0
         self.stdout.write(f"Ingesting {len(paths)} files.")
         for file_path in paths:
-            if not path.exists(file_path):
-                self.stderr.write(f"No such file: {file_path}")
+            read = self.read_file(file_path)
+            if read is None:
                 continue
+            case_id, volume_number, volume_seq_number, xml = read
 
-            filename = path.basename(file_path)
-            m = self.filename_re.match(filename)
-            if not m:
-                self.stderr.write(f"Invalid filename: {filename}")
-                continue
+            transcript = self.get_transcript(case_id)
+            volume = self.get_volume(transcript, volume_number)
 
-            # sketchily get case ID
-            if m.group("case_label") == "NMT":
-                case_id = int(m.group("case_number")) + 1
-            elif m.group("case_label") == "IMT":
-                case_id = 1
-            else:
-                self.stderr.write(f"Invalid case name: {m.group('case_label')}")
+            page = volume.pages.filter(volume_seq_number=volume_seq_number).first()
+            if not page:
+                page = TranscriptPage(
+                    transcript=transcript,
+                    volume=volume,
+                    volume_seq_number=volume_seq_number,
+                )
+            if self.is_unchanged(page, xml):
                 continue
+            created = page.pk is None
+            page.xml = xml
+            page.image = path.basename(file_path).replace(".xml", ".jpg")
+            try:
+                page.populate_from_xml()
+            except Exception as e:
+                self.stderr.write(f"Error populating page from {file_path}")
+                raise e
+
+            if self.save_page(page, file_path):
+                self.record(page, created)
 
+            count += 1
+            if count % 100 == 0:
+                self.stdout.write(f"Created {count} pages.")
+
+    def save_page(self, page, file_path):
+        try:
+            page.save()
+        except Exception as e:
+            self.stderr.write(
+                f"ERROR: Unable to save page {page.pk} "
+                f"Volume: {page.volume.volume_number} "
+                f"Vol Seq: {page.volume_seq_number} "
+                f"File: {file_path}"
+            )
+            self.stderr.write(f"Error: {type(e).__name__}: {str(e)}")
+            # Continue processing other pages
+            return False
+        return True
+
+    def get_transcript(self, case_id):
+        transcript = self.transcripts.get(case_id)
+        if transcript is None:
             case = DocumentCase.objects.get(pk=case_id)
             try:
                 transcript = case.transcript
@@ -69,9 +264,13 @@ class Command(BaseCommand):
                     title=f"Transcript for {case.short_name()}",
                 )
                 self.stdout.write(f"Created transcript {transcript.title}")
+            self.transcripts[case_id] = transcript
+        return transcript
 
-            volume_number = int(m.group("volume"))
-
+    def get_volume(self, transcript, volume_number):
+        key = (transcript.id, volume_number)
+        volume = self.volumes.get(key)
+        if volume is None:
             volume = transcript.volumes.filter(volume_number=volume_number).first()
             if not volume:
                 volume = transcript.volumes.create(volume_number=volume_number)
@@ -79,36 +278,128 @@ class Command(BaseCommand):
                     f"Created transcript volume {transcript.title} "
                     f"{volume.volume_number}"
                 )
+            self.volumes[key] = volume
+        return volume
 
-            volume_seq_number = int(m.group("vol_seq"))
-            page = volume.pages.filter(volume_seq_number=volume_seq_number).first()
-            with open(file_path, "r") as file:
-                xml = file.read()
-            if not page:
-                page = TranscriptPage(
-                    transcript=transcript,
-                    volume=volume,
-                    volume_seq_number=volume_seq_number,
+    def ingest_bulk(self, paths, options):
+        # sorted, so files are grouped by volume and the checkpoint is an order
+        paths = sorted(paths)
+        checkpoint = options["checkpoint"]
+        if checkpoint and path.exists(checkpoint):
+            with open(checkpoint, "r") as file:
+                last_path = file.read().strip()
+            skipped = bisect_right(paths, last_path)
+            self.stdout.write(f"Resuming after {last_path} ({skipped} files skipped).")
+            paths = paths[skipped:]
+
+        self.stdout.write(f"Ingesting {len(paths)} files in bulk.")
+        executor = None
+        if options["workers"] > 0:
+            # Children must not share the DB connections
+            connections.close_all()
+            executor = ProcessPoolExecutor(
+                max_workers=options["workers"],
+                mp_context=multiprocessing.get_context("fork"),
+            )
+
+        batch_size = options["batch_size"]
+        try:
+            for start in range(0, len(paths), batch_size):
+                chunk = paths[start : start + batch_size]
+                # files are read and hashed here, only the changed ones are parsed
+                batch = []
+                for file_path in chunk:
+                    read = self.read_file(file_path)
+                    if read is None:
+                        continue
+                    page = self.build_page(*read)
+                    if not self.is_unchanged(page, page.xml):
+                        page.image = path.basename(file_path).replace(".xml", ".jpg")
+                        batch.append((page, file_path))
+                self.parse_batch(batch, executor)
+                self.save_batch(batch)
+
+                if checkpoint:
+                    with open(f"{checkpoint}.tmp", "w") as file:
+                        file.write(chunk[-1])
+                    os.replace(f"{checkpoint}.tmp", checkpoint)
+                if self.changed_ids is not None:
+                    self.changed_ids.flush()
+        finally:
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+        if checkpoint and path.exists(checkpoint):
+            os.remove(checkpoint)
+
+    def build_page(self, case_id, volume_number, volume_seq_number, xml):
+        transcript = self.get_transcript(case_id)
+        volume = self.get_volume(transcript, volume_number)
+        if volume.id not in self.existing_pages:
+            # values kept for an existing page when missing from its XML
+            self.existing_pages[volume.id] = {
+                row.pop("volume_seq_number"): row
+                for row in volume.pages.values(
+                    "id",
+                    "volume_seq_number",
+                    "seq_number",
+                    "date",
+                    "page_number",
+                    "page_label",
+                    "xml_hash",
                 )
-            page.xml = xml
-            page.image = filename.replace(".xml", ".jpg")
+            }
+        return TranscriptPage(
+            transcript=transcript,
+            volume=volume,
+            volume_seq_number=volume_seq_number,
+            xml=xml,
+            **self.existing_pages[volume.id].get(volume_seq_number, {}),
+        )
+
+    def parse_batch(self, batch, executor):
+        if executor is None:
+            results = [parse_page_xml(page.xml) for page, _ in batch]
+        else:
+            futures = [executor.submit(parse_page_xml, page.xml) for page, _ in batch]
+        for i, (page, file_path) in enumerate(batch):
             try:
-                page.populate_from_xml()
+                values = results[i] if executor is None else futures[i].result()
             except Exception as e:
                 self.stderr.write(f"Error populating page from {file_path}")
                 raise e
+            for name, value in values.items():
+                setattr(page, name, value)
+            page.joins_previous = page.carry_out_html = None
 
-            try:
-                page.save()
-            except Exception as e:
-                self.stderr.write(
-                    f"ERROR: Unable to save page {page.pk} "
-                    f"Volume: {volume_number} Vol Seq: {volume_seq_number} "
-                    f"File: {file_path}"
-                )
-                self.stderr.write(f"Error: {type(e).__name__}: {str(e)}")
-                # Continue processing other pages
+    def save_batch(self, batch):
+        if not batch:
+            return
+        pages = [page for page, _ in batch]
+        created = [page for page in pages if page.pk is None]
+        updated = [page for page in pages if page.pk is not None]
+        now = timezone.now()
+        for page in updated:
+            page.updated_at = now
+        try:
+            with transaction.atomic():
+                TranscriptPage.objects.bulk_create(created)
+                TranscriptPage.objects.bulk_update(updated, fields=BULK_UPDATE_FIELDS)
+        except IntegrityError:
+            # save them one by one to report the pages that fail
+            for page in created:
+                page.pk = None
+            for page, file_path in batch:
+                created_page = page.pk is None
+                if self.save_page(page, file_path):
+                    self.record(page, created_page)
+        else:
+            for page in created:
+                self.record(page, True)
+            for page in updated:
+                self.record(page, False)
 
-            count += 1
-            if count % 100 == 0:
-                self.stdout.write(f"Created {count} pages.")
+        self.stdout.write(
+            f"Saved {len(pages)} pages ({len(created)} created, "
+            f"{len(updated)} updated)."
+        )
@@ -0,0 +1,256 @@
+import json
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+import requests
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from haystack import connections as haystack_connections
+
+from nuremberg.search.lib import result_cache
+
+
+def to_solr(value):
+    """Convert `value` as pysolr does for the values haystack sends."""
+    if hasattr(value, 'strftime'):
+        if hasattr(value, 'hour'):
+            offset = value.utcoffset()
+            if offset:
+                value = value - offset
+            return value.replace(tzinfo=None).isoformat() + 'Z'
+        return f'{value.isoformat()}T00:00:00Z'
+    if isinstance(value, (set, tuple)):
+        return list(value)
+    return str(value)
+
+
+def get_index(using, label):
+    unified_index = haystack_connections[using].get_unified_index()
+    for model, index in unified_index.get_indexes().items():
+        if model._meta.label_lower == label:
+            return index
+    raise CommandError(f'No search index for {label}')
+
+
+def prepare_range(using, label, first, last):
+    """Return one JSON line per object of `label` with pk in [first, last]."""
+    index = get_index(using, label)
+    qs = index.index_queryset(using=using).filter(pk__gte=first, pk__lte=last)
+    lines = []
+    for obj in qs.order_by('pk'):
+        doc = {
+            key: value
+            for key, value in index.full_prepare(obj).items()
+            if value is not None
+        }
+        lines.append(
+            json.dumps(
+                doc, default=to_solr, ensure_ascii=False, separators=(',', ':')
+            )
+        )
+    return lines
+
+
+def post_lines(url, lines, timeout, **params):
+    """Send the JSON lines to Solr as a single JSON array of documents."""
+    response = requests.post(
+        f'{url}/update',
+        params=params,
+        data=f'[{",".join(lines)}]'.encode('utf-8'),
+        headers={'Content-Type': 'application/json'},
+        timeout=timeout,
+    )
+    response.raise_for_status()
+
+
+def index_range(using, label, first, last, url, timeout):
+    """Prepare a pk range and send it to Solr, or return it when dumping."""
+    lines = prepare_range(using, label, first, last)
+    if url is None:
+        return lines
+    if lines:
+        post_lines(url, lines, timeout)
+    return len(lines)
+
+
+def map_bounded(executor, func, tasks, window):
+    """Yield `func(*task)` for each task run by `executor`, in order.
+
+    At most `window` tasks are submitted and not yet consumed at once, so the
+    results (whole pk ranges when dumping) do not pile up in memory when
+    writing them is slower than preparing them.
+
+    """
+    pending = deque()
+    for task in tasks:
+        if len(pending) >= window:
+            yield pending.popleft().result()
+        pending.append(executor.submit(func, *task))
+    while pending:
+        yield pending.popleft().result()
+
+
+class Command(BaseCommand):
+    help = (
+        'Index every search index straight into Solr as JSON, committing '
+        'once at the end (or dump the documents to a JSON Lines file)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'labels',
+            nargs='*',
+            help=(
+                'Models to index, like documents.document (default is every '
+                'model with a search index)'
+            ),
+        )
+        parser.add_argument(
+            '--using',
+            default='default',
+            help='Haystack connection to use (default is "default")',
+        )
+        parser.add_argument(
+            '--workers',
+            type=int,
+            default=4,
+            help='Number of worker processes, 0 to run in-process (default 4)',
+        )
+        parser.add_argument(
+            '--chunk-size',
+            type=int,
+            default=2000,
+            help='Number of documents per pk range and request (default 2000)',
+        )
+        parser.add_argument(
+            '--clear',
+            action='store_true',
+            help='Delete every document in Solr before indexing',
+        )
+        parser.add_argument(
+            '--dump',
+            metavar='PATH',
+            default=None,
+            help='Write the documents to PATH as JSON Lines instead of Solr',
+        )
+        parser.add_argument(
+            '--load',
+            metavar='PATH',
+            default=None,
+            help='Send the documents from a --dump file to Solr (no DB used)',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Starting bulk Solr indexing ({options=})')
+
+        using = options['using']
+        connection = settings.HAYSTACK_CONNECTIONS[using]
+        self.url = connection['URL'].rstrip('/')
+        self.timeout = connection.get('TIMEOUT', 60)
+        if options['dump'] and options['load']:
+            raise CommandError('Use only one of --dump and --load')
+
+        if options['clear'] and not options['dump']:
+            self.solr_update({'delete': {'query': '*:*'}})
+            self.stdout.write('Deleted every document in Solr.')
+
+        if options['load']:
+            total = self.load(options['load'], options['chunk_size'])
+        else:
+            total = self.index(using, options)
+
+        if options['dump']:
+            self.stdout.write(f'Dumped {total} document(s).')
+        else:
+            self.solr_update({'commit': {}})
+            result_cache.bump_generation()
+            self.stdout.write(f'Indexed and committed {total} document(s).')
+
+    def solr_update(self, command):
+        response = requests.post(
+            f'{self.url}/update',
+            json=command,
+            timeout=self.timeout,
+        )
+        response.raise_for_status()
+
+    def pk_ranges(self, using, label, chunk_size):
+        """Split the objects of `label` in ranges of `chunk_size` pks."""
+        qs = get_index(using, label).index_queryset(using=using)
+        pks = list(
+            qs.prefetch_related(None)
+            .order_by('pk')
+            .values_list('pk', flat=True)
+        )
+        for start in range(0, len(pks), chunk_size):
+            chunk = pks[start : start + chunk_size]
+            yield chunk[0], chunk[-1]
+
+    def index(self, using, options):
+        labels = options['labels'] or sorted(
+            model._meta.label_lower
+            for model in haystack_connections[using]
+            .get_unified_index()
+            .get_indexed_models()
+        )
+        url = None if options['dump'] else self.url
+        tasks = [
+            (using, label, first, last, url, self.timeout)
+            for label in labels
+            for first, last in self.pk_ranges(
+                using, label, options['chunk_size']
+            )
+        ]
+
+        executor = None
+        if options['workers'] > 0:
+            # Children get their own DB connections, as in haystack's
+            # `update_index`.
+            connections.close_all()
+            executor = ProcessPoolExecutor(
+                max_workers=options['workers'],
+                mp_context=multiprocessing.get_context('fork'),
+            )
+            results = map_bounded(
+                executor, index_range, tasks, options['workers'] * 2
+            )
+        else:
+            results = (index_range(*task) for task in tasks)
+
+        total = 0
+        dump = (
+            open(options['dump'], 'w', encoding='utf-8')
+            if options['dump']
+            else None
+        )
+        try:
+            for task, result in zip(tasks, results):
+                if dump is not None:
+                    dump.writelines(f'{line}\n' for line in result)
+                    result = len(result)
+                total += result
+                if options['verbosity'] > 1:
+                    _, label, first, last, _, _ = task
+                    self.stdout.write(
+                        f'Prepared {result} {label} document(s) with pk '
+                        f'between {first} and {last}.'
+                    )
+        finally:
+            if dump is not None:
+                dump.close()
+            if executor is not None:
+                executor.shutdown(cancel_futures=True)
+
+        return total
+
+    def load(self, path, chunk_size):
+        total = 0
+        with open(path, encoding='utf-8') as dump:
+            lines = (line.rstrip('\n') for line in dump if line.strip())
+            while chunk := list(islice(lines, chunk_size)):
+                post_lines(self.url, chunk, self.timeout)
+                total += len(chunk)
+        return total
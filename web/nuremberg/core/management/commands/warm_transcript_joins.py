@@ -0,0 +1,65 @@
+from django.core.management.base import BaseCommand
+
+from nuremberg.transcripts.joins import (
+    build_joined_pages,
+    cache_key,
+    get_cache,
+)
+from nuremberg.transcripts.models import Transcript
+from nuremberg.transcripts.views import Show
+
+
+class Command(BaseCommand):
+    help = (
+        'Join the pages of every page range requested when viewing '
+        'transcripts and store them in the "transcripts" cache'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--ids',
+            nargs='+',
+            type=int,
+            default=None,
+            help='Transcript IDs to be processed (default is all)',
+        )
+        parser.add_argument(
+            '--force',
+            action='store_true',
+            help='Join the pages again even if already cached',
+        )
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Count the page ranges but make no actual changes',
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Starting warm-up of transcript joins ({options=})')
+
+        cache = get_cache()
+        qs = Transcript.objects.order_by('id')
+        if options['ids']:
+            qs = qs.filter(id__in=options['ids'])
+
+        cached = 0
+        for transcript in qs:
+            count = 0
+            for from_seq, to_seq in Show.cacheable_seq_ranges(transcript):
+                key = cache_key(transcript, from_seq, to_seq)
+                if not options['force'] and cache.has_key(key):
+                    continue
+                if not options['dry_run']:
+                    cache.set(
+                        key, build_joined_pages(transcript, from_seq, to_seq)
+                    )
+                count += 1
+            if options['verbosity'] > 1:
+                self.stdout.write(
+                    f'Joined {count} page range(s) of transcript '
+                    f'{transcript.id}.'
+                )
+            cached += count
+
+        prefix = 'Would have cached' if options['dry_run'] else 'Cached'
+        self.stdout.write(f'{prefix} {cached} page range(s).')
@@ -3,7 +3,7 @@ import logging
 from io import BytesIO
 
 import requests
-
+from PIL import ImageFile
 
 logger = logging.getLogger(__name__)
 
@@ -49,6 +49,50 @@ def download_and_store_image(
         logger.info(f'Saved {image_path=} in {bucket_name=}')
 
 
+def read_image_header(image_url, max_bytes=64 * 1024, chunk_size=8192):
+    """Return the `(width, height, size)` of the image at `image_url`.
+
+    Only the first `max_bytes` are requested (using a `Range` header) and they
+    are fed to PIL until it can tell the image dimensions, so the whole image
+    is never downloaded. Any value that could not be determined is `None`.
+
+    """
+    headers = {
+        'User-Agent': 'Ubuntu; Linux x86_64',
+        'Range': f'bytes=0-{max_bytes - 1}',
+    }
+    try:
+        response = do_request(image_url, headers=headers, stream=True)
+    except requests.RequestException as e:
+        logger.error(f'Could not request image header for {image_url=}: {e}')
+        return None, None, None
+    if not response.ok:
+        return None, None, None
+
+    # For partial responses the total size follows the range, as in
+    # `Content-Range: bytes 0-65535/1234567`
+    size = response.headers.get('content-range', '').rpartition('/')[-1]
+    if not size.isdigit():
+        size = response.headers.get('content-length', '')
+    size = int(size) if size.isdigit() else None
+
+    parser = ImageFile.Parser()
+    try:
+        for chunk in response.iter_content(chunk_size):
+            parser.feed(chunk)
+            if parser.image is not None:
+                break
+    except Exception as e:
+        logger.error(f'Could not parse image header for {image_url=}: {e}')
+    finally:
+        response.close()
+
+    if parser.image is None:
+        return None, None, size
+    width, height = parser.image.size
+    return width, height, size
+
+
 def build_image_path(image_url, image_name):
     image_headers = do_request(image_url, method='HEAD').headers
     content_type = image_headers.get('content-type')
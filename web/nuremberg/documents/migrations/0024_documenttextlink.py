@@ -0,0 +1,36 @@
+# Generated by Django 4.1.7 on 2026-10-18 17:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0023_restore_processing_notes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentTextLink',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('text_rank', models.PositiveIntegerField(blank=True, null=True)),
+                ('document_rank', models.PositiveIntegerField(blank=True, null=True)),
+                ('document', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='full_text_links', to='documents.document')),
+                ('text', models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='document_links', to='documents.documenttext')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='documenttextlink',
+            index=models.Index(fields=['document', 'text_rank'], name='documents_d_documen_b3ea42_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='documenttextlink',
+            index=models.Index(fields=['text', 'document_rank'], name='documents_d_text_id_166a03_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='documenttextlink',
+            unique_together={('text', 'document')},
+        ),
+    ]
@@ -0,0 +1,24 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:06
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0025_documentimage_dimensions'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentTextExtra',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('load_timestamp', models.DateTimeField()),
+                ('total_pages', models.PositiveIntegerField()),
+                ('page_offsets', models.JSONField(default=list)),
+                ('text', models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.DO_NOTHING, related_name='extra', to='documents.documenttext')),
+            ],
+        ),
+    ]
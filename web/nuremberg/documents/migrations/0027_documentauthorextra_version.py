@@ -0,0 +1,18 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0026_documenttextextra'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='documentauthorextra',
+            name='version',
+            field=models.PositiveIntegerField(default=1),
+        ),
+    ]
@@ -1,11 +1,14 @@
 import logging
 import operator
 import re
-from collections import defaultdict
+import threading
+import time
+from collections import defaultdict, namedtuple
 from urllib.parse import urlencode
 
+from django.conf import settings
 from django.db import models
-from django.db.models import Case, Count, Subquery, Value, When
+from django.db.models import Case, Count, Subquery, Sum, Value, When
 from django.db.models.functions import Concat
 from django.urls import reverse
 from django.utils.functional import cached_property
@@ -15,12 +18,42 @@ from nuremberg.documents.helpers import (
     build_image_path,
     download_and_store_image,
     parse_date,
+    read_image_header,
 )
 
 EVIDENCE_CODE_RE = re.compile(r"^([A-Z]+)-([0-9]+)([a-z]{0,1})$")
 EXHIBIT_CODE_RE = re.compile(r"^([A-Za-z\,\./\s]+) ([0-9\s]+)$")
 logger = logging.getLogger(__name__)
 
+PrimaryDate = namedtuple("PrimaryDate", ["date", "text", "year", "sort"])
+
+
+class DocumentQuerySet(models.QuerySet):
+    def with_full_texts(self):
+        """Resolve the ranked `full_texts` of every document in bulk.
+
+        The result is available as `linked_full_texts` (and `full_text`) on
+        each instance, without any further queries. It needs the
+        `DocumentTextLink` table to be built, otherwise each instance falls
+        back to calling `full_texts` on access.
+
+        """
+        if not DocumentTextLink.is_built():
+            return self
+        links = (
+            DocumentTextLink.objects.filter(text_rank__isnull=False)
+            .select_related("text")
+            .defer("text__text")  # deferred as in `DocumentText.objects`
+            .order_by("text_rank")
+        )
+        return self.prefetch_related(
+            models.Prefetch(
+                "full_text_links",
+                queryset=links,
+                to_attr="ranked_full_text_links",
+            )
+        )
+
 
 class Document(models.Model):
     id = models.AutoField(primary_key=True, db_column="DocID")
@@ -42,6 +75,8 @@ class Document(models.Model):
         blank=True,
     )
 
+    objects = DocumentQuerySet.as_manager()
+
     class Meta:
         managed = False
         db_table = "tblDoc"
@@ -68,7 +103,17 @@ class Document(models.Model):
 
     @cached_property
     def full_text(self):
-        return self.full_texts().first()
+        if hasattr(self, "ranked_full_text_links"):
+            return next(iter(self.linked_full_texts), None)
+        return self.full_texts().with_text().first()
+
+    @cached_property
+    def linked_full_texts(self):
+        """The `full_texts` of this instance, as resolved by `with_full_texts`
+        if that was used to fetch it."""
+        if hasattr(self, "ranked_full_text_links"):
+            return [link.text for link in self.ranked_full_text_links]
+        return list(self.full_texts())
 
     @cached_property
     def language_name(self):
@@ -89,21 +134,57 @@ class Document(models.Model):
     def page_range(self):
         return range(1, (self.image_count or 0) + 1)
 
+    @cached_property
+    def image_list(self):
+        return list(self.images.all())
+
+    @cached_property
+    def image_index(self):
+        """Map each `(page_number, scale)` to its DocumentImage.
+
+        Built from a single query (or the prefetched `images`) so looking up
+        the image of a given page and scale is O(1), see `find_url`.
+
+        """
+        result = {}
+        for image in self.image_list:
+            result.setdefault((image.page_number, image.scale), image)
+        return result
+
     def images_screen(self):
-        test_empty = self.images.all()
-        test_empty = len(test_empty)
-        if test_empty:
-            return (
+        if self.image_list:
+            return [
                 image
-                for image in self.images.all()
+                for image in self.image_list
                 if image.scale == DocumentImage.SCREEN
-            )
+            ]
         else:
             return "no images"
 
     def date(self):
         return self.dates.first()
 
+    @cached_property
+    def primary_date(self):
+        """The same date as `date()`, along with its string, year and sort
+        values, as a `PrimaryDate` (or None if this instance has no dates).
+
+        Uses the prefetched `dates` if available, so it does not need any
+        query when indexing.
+
+        """
+        date = min(
+            self.dates.all(), key=operator.attrgetter("pk"), default=None
+        )
+        if date is None:
+            return None
+        return PrimaryDate(
+            date=date,
+            text=date.as_str_flexible(),
+            year=date.year,
+            sort=date.as_date(),
+        )
+
     def slug(self):  # pragma: no cover
         # Try to extract the "genre term" from the descriptive title
         try:
@@ -144,6 +225,20 @@ class Document(models.Model):
         The four versions all bear the same document code (also known as
         "Evidence File code" or "EF code", e.g., PS-398 or NOKW-222).
 
+        """
+        if DocumentTextLink.is_built():
+            return DocumentText.objects.filter(
+                document_links__document=self,
+                document_links__text_rank__isnull=False,
+            ).order_by("document_links__text_rank")
+        return self._derive_full_texts()
+
+    def _derive_full_texts(self):
+        """Compute the `full_texts` result for this instance from scratch.
+
+        This is used when the `DocumentTextLink` table was not built yet, and
+        to build that table in the `build_document_text_links` command.
+
         """
         # NEW APPROACH: Check for direct DocID linking via HLSLDocID
         # This is used for newer full-text documents (DocID >= 600000 typically)
@@ -233,6 +328,16 @@ class DocumentImage(models.Model):
         "DocumentImageType", on_delete=models.PROTECT, null=True
     )
     image = models.ImageField(null=True, blank=True, storage=DocumentStorage())
+    # Stored so rendering never needs to open the image from the bucket
+    image_width = models.PositiveIntegerField(null=True, blank=True)
+    image_height = models.PositiveIntegerField(null=True, blank=True)
+    image_size = models.PositiveIntegerField(null=True, blank=True)
+
+    DEFAULT_WIDTH = 700
+    DEFAULT_HEIGHT = 1000
+
+    # Set once the missing dimensions were read, even if that failed
+    _dimensions_read = False
 
     class Meta:
         ordering = ["page_number"]
@@ -252,13 +357,44 @@ class DocumentImage(models.Model):
             result = default
         return result
 
+    def read_dimensions(self, save=True):
+        """Read width, height and size from the image header in the bucket.
+
+        Return whether the dimensions could be read.
+
+        """
+        if not self.url:
+            return False
+        width, height, size = read_image_header(self.url)
+        if width is None or height is None:
+            return False
+        self.image_width = width
+        self.image_height = height
+        self.image_size = size
+        if save:
+            self.save(
+                update_fields=["image_width", "image_height", "image_size"]
+            )
+        return True
+
+    def _dimension(self, attr, default):
+        if (
+            getattr(self, attr) is None
+            and settings.DOCUMENT_IMAGE_DIMENSIONS_ON_MISS
+            and not self._dimensions_read
+        ):
+            self._dimensions_read = True
+            self.read_dimensions()
+        result = getattr(self, attr)
+        return default if result is None else result
+
     @cached_property
     def width(self):
-        return self._image_attr("width", default=700)
+        return self._dimension("image_width", default=self.DEFAULT_WIDTH)
 
     @cached_property
     def height(self):
-        return self._image_attr("height", default=1000)
+        return self._dimension("image_height", default=self.DEFAULT_HEIGHT)
 
     @cached_property
     def url(self):
@@ -268,14 +404,7 @@ class DocumentImage(models.Model):
         if self.scale == scale:
             return self.url
         else:
-            images = self.document.images.all()
-            filter = (
-                image
-                for image in images
-                if image.page_number == self.page_number
-                and image.scale == scale
-            )
-            scaled = next(filter, None)
+            scaled = self.document.image_index.get((self.page_number, scale))
             if scaled:
                 return scaled.url
             else:
@@ -882,7 +1011,14 @@ class DocumentAuthorExtraManager(models.Manager):
 
         return self.bulk_update(
             items,
-            fields=["name", "description", "image", "image_alt", "properties"],
+            fields=[
+                "name",
+                "description",
+                "image",
+                "image_alt",
+                "properties",
+                "version",
+            ],
         )
 
 
@@ -895,6 +1031,8 @@ class DocumentAuthorExtra(models.Model):
     image = models.ImageField(null=True, blank=True, storage=AuthorStorage())
     image_alt = models.CharField(max_length=1024)
     properties = models.JSONField()
+    # Increased on every update, used to invalidate `author_metadata_cache`
+    version = models.PositiveIntegerField(default=1)
 
     objects = DocumentAuthorExtraManager()
 
@@ -947,6 +1085,7 @@ class DocumentAuthorExtra(models.Model):
         self.image = image_path
         self.image_alt = image_alt
         self.properties = metadata["properties"]
+        self.version += 1
         if save:
             self.save()
 
@@ -970,6 +1109,105 @@ class DocumentAuthorExtra(models.Model):
         return result
 
 
+class AuthorMetadataCache:
+    """Process-wide cache of `DocumentPersonalAuthor.metadata` results.
+
+    Every author (and its `DocumentAuthorExtra`) is loaded in a single query
+    on first use, and then the metadata is built only once per author id,
+    extra version and `minimal` flag. The returned dicts are shared and must
+    not be modified.
+
+    Everything is reloaded after `clear` is called (the
+    `backfill_author_metadata` command does so) or when the extras changed in
+    the DB, which is checked at most once every `check_interval` seconds so
+    other processes eventually see the changes as well.
+
+    """
+
+    check_interval = 60
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.clear()
+
+    def clear(self):
+        self._authors = None
+        self._ranks = None
+        self._entries = {}
+        self._token = None
+        self._checked_at = None
+
+    def _current_token(self):
+        result = DocumentAuthorExtra.objects.aggregate(
+            count=Count("id"), versions=Sum("version")
+        )
+        return result["count"], result["versions"]
+
+    def _load(self, author_ids):
+        now = time.monotonic()
+        if (
+            self._checked_at is None
+            or now - self._checked_at >= self.check_interval
+        ):
+            token = self._current_token()
+            self._checked_at = now
+            if token != self._token:
+                self._authors = {
+                    author.id: author
+                    for author in DocumentPersonalAuthor.objects.select_related(
+                        "extra"
+                    )
+                }
+                self._ranks = None
+                self._entries = {}
+                self._token = token
+
+        # Authors added after the cache was loaded, if any
+        missing = set(author_ids) - self._authors.keys()
+        if missing:
+            self._authors.update(
+                (author.id, author)
+                for author in DocumentPersonalAuthor.objects.filter(
+                    id__in=missing
+                ).select_related("extra")
+            )
+
+    def get_many(self, author_ids, minimal=False):
+        """Return the metadata for the authors in `author_ids`, in order.
+
+        Unknown author ids are skipped.
+
+        """
+        author_ids = list(author_ids)
+        result = []
+        with self._lock:
+            self._load(author_ids)
+            for author_id in author_ids:
+                author = self._authors.get(author_id)
+                if author is None:
+                    continue
+                try:
+                    version = author.extra.version
+                except DocumentAuthorExtra.DoesNotExist:
+                    version = None
+                key = (author_id, version, minimal)
+                if key not in self._entries:
+                    if version is None and not minimal and self._ranks is None:
+                        self._ranks = dict(
+                            PersonalAuthorPropertyRank.objects.values_list(
+                                "name", "rank"
+                            )
+                        )
+                    self._entries[key] = author.metadata(
+                        minimal=minimal, ranks=self._ranks
+                    )
+                result.append(self._entries[key])
+        return result
+
+
+author_metadata_cache = AuthorMetadataCache()
+
+
 class DocumentCase(models.Model):
     id = models.AutoField(primary_key=True, db_column="CaseID")
     name = models.CharField(max_length=100, db_column="Case")
@@ -1500,6 +1738,37 @@ class DocumentExhibitCode(models.Model):
 
 
 class DocumentTextQuerySet(models.QuerySet):
+    def with_text(self):
+        """Load the (possibly very long) text, deferred by default."""
+        return self.defer(None)
+
+    def with_linked_documents(self, *related):
+        """Resolve the ranked `documents` of every text in bulk.
+
+        The result is available as `linked_documents` (and `document`) on each
+        instance, without any further queries. Extra `related` lookups are
+        prefetched for each of the linked documents, for instance
+        `with_linked_documents("dates")`. It needs the `DocumentTextLink`
+        table to be built, otherwise each instance falls back to calling
+        `documents` on access.
+
+        """
+        if not DocumentTextLink.is_built():
+            return self
+        links = (
+            DocumentTextLink.objects.filter(document_rank__isnull=False)
+            .select_related("document")
+            .prefetch_related(*(f"document__{lookup}" for lookup in related))
+            .order_by("document_rank")
+        )
+        return self.prefetch_related(
+            models.Prefetch(
+                "document_links",
+                queryset=links,
+                to_attr="ranked_document_links",
+            )
+        )
+
     def no_matching_document(self):
         evidence_codes = (
             DocumentEvidenceCode.objects.select_related(
@@ -1529,6 +1798,12 @@ class DocumentTextQuerySet(models.QuerySet):
         return result
 
 
+class DocumentTextManager(models.Manager.from_queryset(DocumentTextQuerySet)):
+    def get_queryset(self):
+        # Most code paths only need the metadata, see `with_text`
+        return super().get_queryset().defer("text")
+
+
 class DocumentText(models.Model):
     id = models.AutoField(db_column="RecordID", primary_key=True)
     title = models.CharField(db_column="Title", max_length=1000)
@@ -1550,7 +1825,7 @@ class DocumentText(models.Model):
     text = models.TextField(db_column="DocText", blank=True, null=True)
     language = models.CharField(db_column="Language", max_length=100)
 
-    objects = DocumentTextQuerySet.as_manager()
+    objects = DocumentTextManager()
 
     class Meta:
         managed = False
@@ -1592,27 +1867,76 @@ class DocumentText(models.Model):
     def source_name(self):
         return self.source_citation
 
+    @cached_property
+    def stored_pages(self):
+        """The `DocumentTextExtra` for this text, if it's up to date."""
+        try:
+            extra = self.extra
+        except DocumentTextExtra.DoesNotExist:
+            return None
+        if extra.load_timestamp != self.load_timestamp:
+            return None
+        return extra
+
     @cached_property
     def total_pages(self):
-        if not self.text:
-            return 0
+        if self.stored_pages is not None:
+            return self.stored_pages.total_pages
+        return self.count_pages()
 
-        # For NEW full texts without evidence codes, we can't count page separators
-        if not self.evidence_code_tag:
-            return 0
+    @cached_property
+    def page_offsets(self):
+        if self.stored_pages is not None:
+            return self.stored_pages.page_offsets
+        return self.find_page_offsets()
 
+    def page_tags(self):
         # Some texts have both `680—PS` and `680-PS` as apparent page separator
         secondary_tag = self.evidence_code_tag.replace("-", "—")
-        return (
-            self.text.count(self.evidence_code_tag)
-            + self.text.count(secondary_tag)
-            + 1
-        )
+        return [self.evidence_code_tag, secondary_tag]
+
+    def count_pages(self):
+        """Count the pages of the text, as split by `find_page_offsets`."""
+        return len(self.find_page_offsets())
+
+    def find_page_offsets(self):
+        """Return the offsets in the text where each page starts.
+
+        The page separators found are kept at the start of their page, and a
+        separator at the very start of the text does not start a new page.
+        For NEW full texts without evidence codes there are no page separators
+        to look for, so their pages are unknown.
+
+        """
+        if not self.text or not self.evidence_code_tag:
+            return []
+        separators = "|".join(re.escape(tag) for tag in set(self.page_tags()))
+        return [0] + [
+            m.start() for m in re.finditer(separators, self.text) if m.start()
+        ]
+
+    def page_text(self, page_number):
+        """Return the text of the given (1-based) page, if any."""
+        offsets = self.page_offsets
+        if not 1 <= page_number <= len(offsets):
+            return ""
+        end = offsets[page_number] if page_number < len(offsets) else None
+        return self.text[offsets[page_number - 1] : end]
 
     @cached_property
     def document(self):
+        if hasattr(self, "ranked_document_links"):
+            return next(iter(self.linked_documents), None)
         return self.documents().first()
 
+    @cached_property
+    def linked_documents(self):
+        """The `documents` of this instance, as resolved by
+        `with_linked_documents` if that was used to fetch it."""
+        if hasattr(self, "ranked_document_links"):
+            return [link.document for link in self.ranked_document_links]
+        return list(self.documents())
+
     def documents(self):
         """Fetch the most relevant Document for this DocumentText.
 
@@ -1652,6 +1976,20 @@ class DocumentText(models.Model):
             NMT 5
             NMT 2
 
+        """
+        if DocumentTextLink.is_built():
+            return Document.objects.filter(
+                full_text_links__text=self,
+                full_text_links__document_rank__isnull=False,
+            ).order_by("full_text_links__document_rank")
+        return self._derive_documents()
+
+    def _derive_documents(self):
+        """Compute the `documents` result for this instance from scratch.
+
+        This is used when the `DocumentTextLink` table was not built yet, and
+        to build that table in the `build_document_text_links` command.
+
         """
         # NEW method: Try direct HLSLDocID linking first
         if self.hlsl_doc_id:
@@ -1729,3 +2067,107 @@ class DocumentText(models.Model):
         # there is no way of knowing the full-text doc's lang.
         # A future dump of this table will include that piece of information.
         return matches
+
+
+class DocumentTextExtraManager(models.Manager):
+    def bulk_create_from_text_qs(self, text_qs, batch_size=500):
+        return self.bulk_create(
+            (self.model.from_text(text) for text in text_qs.iterator()),
+            batch_size=batch_size,
+        )
+
+
+class DocumentTextExtra(models.Model):
+    """Page information for a `DocumentText`, computed once from its text.
+
+    Built by the `backfill_document_text_pages` management command, so the
+    (sometimes hundreds of KB long) text does not need to be scanned every
+    time the number of pages is needed. An entry is ignored if the text was
+    reloaded after it was computed (see `DocumentText.stored_pages`).
+
+    """
+
+    text = models.OneToOneField(
+        DocumentText,
+        related_name="extra",
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+    )
+    load_timestamp = models.DateTimeField()
+    total_pages = models.PositiveIntegerField()
+    # Offset in the text where each page starts
+    page_offsets = models.JSONField(default=list)
+
+    objects = DocumentTextExtraManager()
+
+    def __str__(self):
+        return f"{self.text_id}: {self.total_pages} page(s)"
+
+    @classmethod
+    def from_text(cls, text):
+        return cls(
+            text_id=text.id,
+            load_timestamp=text.load_timestamp,
+            total_pages=text.count_pages(),
+            page_offsets=text.find_page_offsets(),
+        )
+
+
+class DocumentTextLink(models.Model):
+    """Precomputed link between a `DocumentText` and a `Document`.
+
+    The rows are built by the `build_document_text_links` management command
+    so `Document.full_texts` and `DocumentText.documents` become a single
+    indexed lookup instead of the evidence code matching and trial/source
+    scoring done by `_derive_full_texts` and `_derive_documents`.
+
+    The relation is not symmetric: a text with a direct HLSLDocID link only
+    lists that document, but it is still a full text of any document sharing
+    its evidence code. So each direction keeps its own rank, which is `None`
+    when the pair does not belong to that direction.
+
+    Both tables are replaced wholesale when loading a new dump, hence no DB
+    constraints are used and the table needs to be rebuilt after a load.
+
+    """
+
+    text = models.ForeignKey(
+        DocumentText,
+        related_name="document_links",
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+    )
+    document = models.ForeignKey(
+        Document,
+        related_name="full_text_links",
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+    )
+    # Position of `text` in `document.full_texts()`
+    text_rank = models.PositiveIntegerField(null=True, blank=True)
+    # Position of `document` in `text.documents()`
+    document_rank = models.PositiveIntegerField(null=True, blank=True)
+
+    # Set once the table is known to have rows, see `is_built`
+    built = False
+
+    class Meta:
+        unique_together = ("text", "document")
+        indexes = [
+            models.Index(fields=["document", "text_rank"]),
+            models.Index(fields=["text", "document_rank"]),
+        ]
+
+    @classmethod
+    def is_built(cls):
+        """Whether the table was built, probed until it has rows and then
+        remembered for the life of the process."""
+        if not cls.built:
+            cls.built = cls.objects.exists()
+        return cls.built
+
+    def __str__(self):
+        return (
+            f"{self.text_id} <-> {self.document_id} "
+            f"(ranks: {self.text_rank}, {self.document_rank})"
+        )
@@ -1,7 +1,18 @@
 import json
 
+from django.utils.safestring import mark_safe
 from haystack import indexes
-from nuremberg.documents.models import Document, DocumentText
+from nuremberg.documents.models import (
+    Document,
+    DocumentText,
+    author_metadata_cache,
+)
+from nuremberg.search.lib.index_text import (
+    END_OF_TEXT,
+    PreviewField,
+    TextBuilderMixin,
+    TextField,
+)
 
 
 class JsonField(indexes.CharField):
@@ -15,8 +26,9 @@ class JsonField(indexes.CharField):
         return value
 
 
-class DocumentIndex(indexes.SearchIndex, indexes.Indexable):
-    text = indexes.CharField(document=True, use_template=True)
+class DocumentIndex(TextBuilderMixin, indexes.SearchIndex, indexes.Indexable):
+    text = TextField(document=True, use_template=True)
+    preview = PreviewField()
     highlight = indexes.CharField(null=True)
     material_type = indexes.CharField(default='Document Image', faceted=True)
     grouping_key = indexes.FacetCharField(
@@ -33,6 +45,8 @@ class DocumentIndex(indexes.SearchIndex, indexes.Indexable):
     )
     date = indexes.CharField(faceted=True, null=True)
     date_year = indexes.CharField(faceted=True, null=True)
+    # for the numeric year facet and range filters
+    date_year_number = indexes.IntegerField(null=True, stored=False)
     date_sort = indexes.DateTimeField(null=True)
 
     language = indexes.CharField(
@@ -76,9 +90,27 @@ class DocumentIndex(indexes.SearchIndex, indexes.Indexable):
                 'group_authors',
                 'defendants',
             )
-            .all()
+            .with_full_texts()
         )
 
+    def build_text(self, document, prepared):
+        """Build the same text as the `document_text.txt` template."""
+        date = document.primary_date
+        return [
+            document.title,
+            document.literal_title or '',
+            document.description,
+            date.text if date else 'Date Unknown',
+            prepared['language'] or '',
+            document.source.name if document.source_id else '',
+            *prepared['case_names'],
+            *prepared['defendants'],
+            *prepared['authors'],
+            *prepared['trial_activities'],
+            *document.evidence_codes.all(),
+            *prepared['exhibit_codes'],
+        ]
+
     def prepare_grouping_key(self, document):
         # This is a hack to group transcripts but not documents in a single query.
         # Transcripts get a group key, documents get a unique key.
@@ -97,7 +129,9 @@ class DocumentIndex(indexes.SearchIndex, indexes.Indexable):
     def prepare_authors_properties(self, document):
         result = {
             'group': [a.metadata() for a in document.group_authors.all()],
-            'person': document.personal_authors.all().metadata(minimal=True),
+            'person': author_metadata_cache.get_many(
+                (a.id for a in document.personal_authors.all()), minimal=True
+            ),
         }
         # json modifiers for the most compact json representation
         return json.dumps(result, indent=None, separators=(',', ':'))
@@ -106,25 +140,28 @@ class DocumentIndex(indexes.SearchIndex, indexes.Indexable):
         return [activity.short_name for activity in document.activities.all()]
 
     def prepare_date(self, document):
-        date = document.date()
+        date = document.primary_date
         if date:
-            return date.as_str_flexible()
+            return date.text
 
     def prepare_date_year(self, document):
-        date = document.date()
+        date = document.primary_date
         if date:
             return date.year
 
+    def prepare_date_year_number(self, document):
+        return self.prepare_date_year(document)
+
     def prepare_date_sort(self, document):
         """Convert document date to a valid datetime for SOLR sorting.
 
         Returns None if the date components are invalid, which is acceptable
         since the field is marked as null=True.
         """
-        date_obj = document.date()
-        if date_obj:
-            # Use the as_date() method which safely parses year/month/day
-            return date_obj.as_date()
+        date = document.primary_date
+        if date:
+            # Parsed safely from year/month/day, see `DocumentDate.as_date`
+            return date.sort
         return None
 
     def prepare_defendants(self, document):
@@ -165,11 +202,14 @@ class DocumentIndex(indexes.SearchIndex, indexes.Indexable):
         return document.pk
 
     def prepare_related_document_ids(self, document):
-        return [t.id for t in document.full_texts()]
+        return [t.id for t in document.linked_full_texts]
 
 
-class DocumentTextIndex(indexes.SearchIndex, indexes.Indexable):
-    text = indexes.CharField(document=True, use_template=True)
+class DocumentTextIndex(
+    TextBuilderMixin, indexes.SearchIndex, indexes.Indexable
+):
+    text = TextField(document=True, use_template=True)
+    preview = PreviewField()
     highlight = indexes.CharField(model_attr='text')
     material_type = indexes.CharField(
         default='Document Full Text', faceted=True
@@ -190,6 +230,8 @@ class DocumentTextIndex(indexes.SearchIndex, indexes.Indexable):
 
     date = indexes.CharField(faceted=True, null=True)
     date_year = indexes.CharField(faceted=True, null=True)
+    # for the numeric year facet and range filters
+    date_year_number = indexes.IntegerField(null=True, stored=False)
     date_sort = indexes.DateTimeField(null=True)
 
     source = indexes.CharField(model_attr='source_citation')
@@ -207,7 +249,24 @@ class DocumentTextIndex(indexes.SearchIndex, indexes.Indexable):
         return 'load_timestamp'
 
     def index_queryset(self, using=None):
-        return DocumentText.objects.all()
+        return (
+            DocumentText.objects.with_text()
+            .select_related('extra')
+            .with_linked_documents(
+                'dates', 'group_authors', 'personal_authors'
+            )
+        )
+
+    def build_text(self, obj, prepared):
+        """Build the same text as the `documenttext_text.txt` template."""
+        return [
+            mark_safe(prepared['highlight']),
+            mark_safe(END_OF_TEXT),
+            prepared['literal_title'],
+            prepared['title'] if obj.document else '',
+            prepared['source'],
+            obj.evidence_code,
+        ]
 
     def prepare_grouping_key(self, obj):
         # This is a hack to group transcripts but not other objects.
@@ -239,38 +298,41 @@ class DocumentTextIndex(indexes.SearchIndex, indexes.Indexable):
         else:
             result = {
                 'group': [a.metadata() for a in document.group_authors.all()],
-                'person': document.personal_authors.all().metadata(
-                    minimal=True
+                'person': author_metadata_cache.get_many(
+                    (a.id for a in document.personal_authors.all()),
+                    minimal=True,
                 ),
             }
         # json modifiers for the most compact json representation
         return json.dumps(result, indent=None, separators=(',', ':'))
 
     def prepare_date(self, obj):
-        date = obj.document and obj.document.date()
+        date = obj.document and obj.document.primary_date
         if date:
-            return date.as_str_flexible()
+            return date.text
 
     def prepare_date_year(self, obj):
-        date = obj.document and obj.document.date()
+        date = obj.document and obj.document.primary_date
         if date:
             return date.year
 
+    def prepare_date_year_number(self, obj):
+        return self.prepare_date_year(obj)
+
     def prepare_date_sort(self, obj):
         """Convert document date to a valid datetime for SOLR sorting.
 
         Returns None if the date components are invalid, which is acceptable
         since the field is marked as null=True.
         """
-        if obj.document:
-            date_obj = obj.document.date()
-            if date_obj:
-                # Use the as_date() method which safely parses year/month/day
-                return date_obj.as_date()
+        date = obj.document and obj.document.primary_date
+        if date:
+            # Parsed safely from year/month/day, see `DocumentDate.as_date`
+            return date.sort
         return None
 
     def prepare_evidence_codes(self, obj):
         return [obj.evidence_code]
 
     def prepare_related_document_ids(self, obj):
-        return [i.id for i in obj.documents()]
+        return [i.id for i in obj.linked_documents]
@@ -3,12 +3,14 @@ import os
 from io import BytesIO
 
 import pytest
+import requests
 
 from nuremberg.documents.helpers import (
     build_image_path,
     do_request,
     download_and_store_image,
     parse_date,
+    read_image_header,
 )
 from .helpers import DummyMemDictStorage, make_random_text
 
@@ -168,3 +170,62 @@ def test_document_date_invalid_date(day, month, year):
 def test_document_date_valid_as_date(day, month, year):
     d = parse_date(day=day, month=month, year=year)
     assert d == datetime.date(year, month, day)
+
+
+def make_jpeg(width, height):
+    from PIL import Image
+
+    content = BytesIO()
+    Image.new('RGB', (width, height)).save(content, 'JPEG')
+    return content.getvalue()
+
+
+def test_read_image_header_partial_content(requests_mock):
+    url = 'https://example.com/image.jpg'
+    content = make_jpeg(123, 456)
+    requests_mock.get(
+        url,
+        content=content[:1024],
+        status_code=206,
+        headers={'Content-Range': f'bytes 0-1023/{len(content)}'},
+    )
+
+    result = read_image_header(url, max_bytes=1024)
+
+    assert result == (123, 456, len(content))
+    assert requests_mock.last_request.headers['Range'] == 'bytes=0-1023'
+
+
+def test_read_image_header_full_content(requests_mock):
+    url = 'https://example.com/image.jpg'
+    content = make_jpeg(50, 60)
+    requests_mock.get(
+        url, content=content, headers={'Content-Length': str(len(content))}
+    )
+
+    assert read_image_header(url) == (50, 60, len(content))
+
+
+def test_read_image_header_not_an_image(requests_mock):
+    url = 'https://example.com/image.jpg'
+    requests_mock.get(
+        url, content=b'not an image', headers={'Content-Length': '12'}
+    )
+
+    assert read_image_header(url) == (None, None, 12)
+
+
+def test_read_image_header_not_ok(requests_mock):
+    url = 'https://example.com/image.jpg'
+    requests_mock.get(url, status_code=404)
+
+    assert read_image_header(url) == (None, None, None)
+
+
+def test_read_image_header_timeout(requests_mock, caplog):
+    url = 'https://example.com/image.jpg'
+    requests_mock.get(url, exc=requests.exceptions.ConnectTimeout)
+
+    assert read_image_header(url) == (None, None, None)
+    assert [r.levelname for r in caplog.records] == ['ERROR']
+    assert url in caplog.records[0].getMessage()
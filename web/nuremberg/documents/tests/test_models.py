@@ -1,7 +1,10 @@
 import datetime
+from io import StringIO
+from unittest import mock
 
 import pytest
 from model_bakery import baker
+from django.core.management import call_command
 from django.urls import reverse
 from django.utils.text import slugify
 
@@ -9,9 +12,12 @@ from nuremberg.documents.models import (
     Document,
     DocumentCase,
     DocumentDate,
+    DocumentImage,
     DocumentPersonalAuthor,
     DocumentText,
+    DocumentTextLink,
     PersonalAuthorProperty,
+    author_metadata_cache,
 )
 from .helpers import (
     make_author,
@@ -55,6 +61,26 @@ def test_document_date_as_str_flexible():
     assert d.as_str_flexible() is None
 
 
+def test_document_primary_date(django_assert_num_queries):
+    document = make_document()
+    first = baker.make(
+        'DocumentDate', document=document, day=2, month=3, year=1946
+    )
+    baker.make('DocumentDate', document=document, day=1, month=1, year=1945)
+
+    document = Document.objects.prefetch_related('dates').get(id=document.id)
+    with django_assert_num_queries(0):
+        result = document.primary_date
+        assert document.primary_date is result
+
+    assert result.date == first == document.date()
+    assert result.text == '02 March 1946'
+    assert result.year == 1946
+    assert result.sort == datetime.date(1946, 3, 2)
+
+    assert make_document().primary_date is None
+
+
 def test_document_total_pages():
     doc = baker.make('Document')
 
@@ -1161,6 +1187,38 @@ def test_author_extra_as_dict_minimal():
     }
 
 
+def test_author_metadata_cache(django_assert_num_queries):
+    author = make_author()
+    other = baker.make('DocumentPersonalAuthor', id=author.id + 1)
+    extra = baker.make('DocumentAuthorExtra', author=author, properties=[])
+    expected = [other.metadata(minimal=True), author.metadata(minimal=True)]
+
+    # one query for the version token, one loading all the authors and one
+    # building the metadata of the author without extra
+    with django_assert_num_queries(3):
+        result = author_metadata_cache.get_many(
+            [other.id, author.id, -1], minimal=True
+        )
+    assert result == expected
+
+    with django_assert_num_queries(0):
+        assert author_metadata_cache.get_many([author.id]) == [
+            author.metadata()
+        ]
+
+    extra.update_from_metadata(
+        {
+            'author': {'name': extra.name, 'description': 'Updated'},
+            'image': None,
+            'properties': [],
+        }
+    )
+    assert extra.version == 2
+    author_metadata_cache.clear()
+    (metadata,) = author_metadata_cache.get_many([author.id], minimal=True)
+    assert metadata['author']['description'] == 'Updated'
+
+
 def test_document_exhibit_code_book_code_none():
     exhibit = baker.make('DocumentExhibitCode')
 
@@ -1325,6 +1383,93 @@ def test_document_text_total_pages():
     assert doc_text.total_pages == 5
 
 
+def test_document_text_page_text():
+    doc_text = baker.make(
+        'DocumentText',
+        evidence_code_tag='123-AZ',
+        text='First page. 123-AZ Second page. 123—AZ Third page.',
+    )
+
+    assert doc_text.page_offsets == [0, 12, 32]
+    assert doc_text.page_text(1) == 'First page. '
+    assert doc_text.page_text(2) == '123-AZ Second page. '
+    assert doc_text.page_text(3) == '123—AZ Third page.'
+    assert doc_text.page_text(0) == doc_text.page_text(4) == ''
+
+
+@pytest.mark.parametrize(
+    'evidence_code_tag, text',
+    [
+        ('123-AZ', None),
+        ('123-AZ', ''),
+        ('', 'No evidence code tag. 123-AZ'),
+        ('123-AZ', 'No separator.'),
+        ('123-AZ', '123-AZ Starts with a separator. 123—AZ Next page.'),
+        ('123AZ', 'A tag without dash. 123AZ Next page.'),
+        ('123-AZ', 'Adjacent separators. 123-AZ123—AZ123-AZ Last page.'),
+    ],
+)
+def test_document_text_count_pages_matches_page_offsets(
+    evidence_code_tag, text
+):
+    doc_text = baker.make(
+        'DocumentText', evidence_code_tag=evidence_code_tag, text=text
+    )
+
+    assert doc_text.count_pages() == len(doc_text.find_page_offsets())
+    if doc_text.total_pages:
+        pages = range(1, doc_text.total_pages + 1)
+        assert ''.join(doc_text.page_text(n) for n in pages) == text
+
+
+def test_document_text_pages_stored(django_assert_num_queries):
+    doc_text = make_document_text(
+        evidence_code_tag='123-AZ', text='First page. 123-AZ Second page.'
+    )
+    other = make_document_text(evidence_code_tag='123-AZ', text='')
+    stdout = StringIO()
+
+    call_command(
+        'backfill_document_text_pages',
+        '--ids',
+        str(doc_text.id),
+        str(other.id),
+        stdout=stdout,
+    )
+
+    assert 'Created 2 and updated 0' in stdout.getvalue()
+    with django_assert_num_queries(1):
+        doc_text = (
+            DocumentText.objects.select_related('extra')
+            .defer('text')
+            .get(id=doc_text.id)
+        )
+        assert doc_text.total_pages == 2
+        assert doc_text.page_offsets == [0, 12]
+
+    # a reloaded text is not using the stored pages until backfilled again
+    DocumentText.objects.filter(id=doc_text.id).update(
+        text='No pages', load_timestamp=datetime.datetime(2000, 1, 1)
+    )
+    doc_text = DocumentText.objects.get(id=doc_text.id)
+    assert doc_text.stored_pages is None
+    assert doc_text.total_pages == 1
+
+    stdout = StringIO()
+    call_command(
+        'backfill_document_text_pages',
+        '--ids',
+        str(doc_text.id),
+        str(other.id),
+        stdout=stdout,
+    )
+
+    assert 'Created 0 and updated 1' in stdout.getvalue()
+    assert DocumentText.objects.get(
+        id=doc_text.id
+    ).stored_pages.page_offsets == [0]
+
+
 def test_document_text_retrieve_documents_empty():
     doc_text = baker.make(
         'DocumentText', evidence_code_series='FF', evidence_code_num='123'
@@ -1471,3 +1616,236 @@ def test_document_text_no_matching_documents(django_assert_num_queries):
     assert result.count() == len(expected)
     with django_assert_num_queries(1):
         assert list(result) == expected
+
+
+def test_document_text_links_match_derived_results(django_assert_num_queries):
+    document = make_document(evidence_codes=['FF-123'])
+    other = make_document(evidence_codes=['FF-123', 'Z-1'])
+    legacy_text = make_document_text(evidence_code='FF-123')
+    direct_text = make_document_text(
+        evidence_code='FF-123', hlsl_doc_id=other.id
+    )
+
+    call_command('build_document_text_links', stdout=StringIO())
+
+    assert DocumentTextLink.objects.filter(document=other).count() == 2
+    # the table is probed once, then each lookup is a single query
+    assert DocumentTextLink.is_built()
+    for doc in (document, other):
+        with django_assert_num_queries(1):
+            result = list(doc.full_texts())
+        assert result == list(doc._derive_full_texts())
+    for text in (legacy_text, direct_text):
+        with django_assert_num_queries(1):
+            result = list(text.documents())
+        assert result == list(text._derive_documents())
+
+    # Direct HLSLDocID links win, but only in the text -> document direction
+    assert list(other.full_texts()) == [direct_text]
+    assert list(document.full_texts()) == [legacy_text, direct_text]
+    assert list(direct_text.documents()) == [other]
+    assert set(legacy_text.documents()) == {document, other}
+
+
+def test_document_text_links_dry_run():
+    make_document_text(evidence_code='FF-123')
+    make_document(evidence_codes=['FF-123'])
+    stdout = StringIO()
+
+    call_command('build_document_text_links', '--dry-run', stdout=stdout)
+
+    assert 'Would have deleted 0 and created' in stdout.getvalue()
+    assert not DocumentTextLink.objects.exists()
+
+
+def test_document_with_full_texts(django_assert_num_queries):
+    documents = [
+        make_document(evidence_codes=['FF-123']),
+        make_document(evidence_codes=['FF-123', 'Z-1']),
+        make_document(evidence_codes=['Z-2']),
+    ]
+    texts = [
+        make_document_text(evidence_code='FF-123'),
+        make_document_text(evidence_code='Z-1', hlsl_doc_id=documents[1].id),
+    ]
+    call_command('build_document_text_links', stdout=StringIO())
+    qs = Document.objects.filter(id__in=[d.id for d in documents])
+
+    # links table check, documents, links with their texts
+    with django_assert_num_queries(3):
+        result = {d: d.linked_full_texts for d in qs.with_full_texts()}
+
+    assert result == {
+        documents[0]: [texts[0]],
+        documents[1]: [texts[1]],
+        documents[2]: [],
+    }
+    with django_assert_num_queries(0):
+        assert [d.full_text for d in result] == [texts[0], texts[1], None]
+    # the (possibly very long) text is not loaded
+    assert all('text' in t.get_deferred_fields() for t in result[documents[1]])
+
+
+def test_document_text_with_linked_documents(django_assert_num_queries):
+    documents = [
+        make_document(evidence_codes=['FF-123']),
+        make_document(evidence_codes=['Z-1']),
+    ]
+    texts = [
+        make_document_text(evidence_code='FF-123'),
+        make_document_text(evidence_code='Z-1', hlsl_doc_id=documents[0].id),
+        make_document_text(evidence_code='Z-2'),
+    ]
+    call_command('build_document_text_links', stdout=StringIO())
+    qs = DocumentText.objects.filter(id__in=[t.id for t in texts])
+
+    # links table check, texts, links with their documents, documents' dates
+    with django_assert_num_queries(4):
+        result = {
+            t: t.linked_documents for t in qs.with_linked_documents('dates')
+        }
+
+    assert result == {
+        texts[0]: [documents[0]],
+        texts[1]: [documents[0]],
+        texts[2]: [],
+    }
+    with django_assert_num_queries(0):
+        linked = [t.document for t in result]
+        assert linked == [documents[0], documents[0], None]
+        assert list(linked[0].dates.all()) == []
+
+
+def test_document_with_full_texts_links_not_built(django_assert_num_queries):
+    document = make_document(evidence_codes=['FF-123'])
+    text = make_document_text(evidence_code='FF-123')
+
+    result = Document.objects.filter(id=document.id).with_full_texts().get()
+
+    assert result.linked_full_texts == [text]
+    assert result.full_text == text
+
+
+def test_document_image_index(django_assert_num_queries):
+    document = make_document()
+    for page_number in (1, 2, 3):
+        for scale in ('t', 's', 'f'):
+            baker.make(
+                'DocumentImage',
+                document=document,
+                page_number=page_number,
+                scale=scale,
+                image=f'{page_number}-{scale}.jpg',
+            )
+    document = Document.objects.get(id=document.id)
+
+    with django_assert_num_queries(1):
+        screen = document.images_screen()
+        assert [i.page_number for i in screen] == [1, 2, 3]
+        assert len(document.image_index) == 9
+        for image in screen:
+            assert image.thumb_url().endswith(f'{image.page_number}-t.jpg')
+            assert image.full_url().endswith(f'{image.page_number}-f.jpg')
+            assert image.find_url('d') is None
+
+
+def test_document_images_screen_no_images():
+    document = make_document()
+
+    assert document.images_screen() == 'no images'
+
+
+def test_document_image_dimensions_stored(requests_mock):
+    image = baker.make(
+        'DocumentImage',
+        image='foo.jpg',
+        image_width=123,
+        image_height=456,
+        image_size=789,
+    )
+
+    assert (image.width, image.height) == (123, 456)
+    assert requests_mock.call_count == 0
+
+
+def test_document_image_dimensions_missing_uses_defaults(requests_mock):
+    image = baker.make('DocumentImage', image='foo.jpg')
+
+    assert (image.width, image.height) == (700, 1000)
+    assert requests_mock.call_count == 0
+
+
+def test_document_image_dimensions_fill_on_miss(settings):
+    settings.DOCUMENT_IMAGE_DIMENSIONS_ON_MISS = True
+    image = baker.make('DocumentImage', image='foo.jpg')
+    with mock.patch(
+        'nuremberg.documents.models.read_image_header',
+        return_value=(123, 456, 789),
+    ):
+        assert (image.width, image.height) == (123, 456)
+
+    image.refresh_from_db()
+    assert (image.image_width, image.image_height, image.image_size) == (
+        123,
+        456,
+        789,
+    )
+
+
+def test_document_image_dimensions_read_once_on_miss(settings):
+    settings.DOCUMENT_IMAGE_DIMENSIONS_ON_MISS = True
+    image = baker.make('DocumentImage', image='foo.jpg')
+    with mock.patch(
+        'nuremberg.documents.models.read_image_header',
+        return_value=(None, None, None),
+    ) as read_image_header:
+        assert (image.width, image.height) == (
+            DocumentImage.DEFAULT_WIDTH,
+            DocumentImage.DEFAULT_HEIGHT,
+        )
+
+    # the failed read is not attempted again for the height
+    assert read_image_header.call_count == 1
+
+
+def test_backfill_image_dimensions(requests_mock):
+    document = make_document()
+    images = [
+        baker.make(
+            'DocumentImage', document=document, page_number=i, image=f'{i}.jpg'
+        )
+        for i in range(3)
+    ]
+    with mock.patch(
+        'nuremberg.documents.models.read_image_header',
+        side_effect=[(10, 20, 30), (None, None, None), (40, 50, 60)],
+    ):
+        call_command(
+            'backfill_image_dimensions',
+            '--ids',
+            str(document.id),
+            '--workers',
+            '1',
+            stdout=StringIO(),
+            stderr=StringIO(),
+        )
+
+    result = [
+        (i.image_width, i.image_height, i.image_size)
+        for i in DocumentImage.objects.filter(
+            id__in=[i.id for i in images]
+        ).order_by('id')
+    ]
+    assert result == [(10, 20, 30), (None, None, None), (40, 50, 60)]
+
+
+def test_document_text_defers_text(django_assert_num_queries):
+    doc_text = make_document_text(text='Some long text')
+
+    with django_assert_num_queries(1):
+        result = DocumentText.objects.get(id=doc_text.id)
+        assert result.get_deferred_fields() == {'text'}
+    with django_assert_num_queries(1):
+        result = DocumentText.objects.with_text().get(id=doc_text.id)
+        assert result.get_deferred_fields() == set()
+        assert result.text == 'Some long text'
@@ -1,6 +1,8 @@
+from io import StringIO
 from urllib.parse import urlencode
 
 import pytest
+from django.core.management import call_command
 from django.urls import reverse
 from model_bakery import baker
 
@@ -10,6 +12,7 @@ from nuremberg.documents.models import (
     DocumentPersonalAuthor,
     DocumentText,
 )
+from nuremberg.documents.views import Show
 from .helpers import (
     DummyMemDictStorage,
     make_author,
@@ -582,3 +585,54 @@ def test_document_details_mode_text_term_higlighting_exact_phrase():
         'ghettos',
     ]
     assert actual_highligths == expected
+
+
+def test_document_citations_link_transcript_seq(django_assert_num_queries):
+    transcript = baker.make('Transcript')
+    volume = baker.make('TranscriptVolume', transcript=transcript)
+    for seq_number, page_number in [(1, None), (2, 41), (3, 42), (4, 42)]:
+        baker.make(
+            'TranscriptPage',
+            transcript=transcript,
+            volume=volume,
+            seq_number=seq_number,
+            volume_seq_number=seq_number,
+            page_number=page_number,
+        )
+    doc = baker.make('Document')
+    for case, page_number in [
+        (transcript.case, 42),
+        (transcript.case, 41),
+        (transcript.case, 0),
+        (baker.make('DocumentCase'), 42),
+    ]:
+        baker.make(
+            'DocumentCitation',
+            document=doc,
+            case=case,
+            transcript_page_number=page_number,
+        )
+    doc = Document.objects.prefetch_related('citations').get(id=doc.id)
+
+    # the transcripts, then the pages of each transcript once per process
+    with django_assert_num_queries(2):
+        citations = Show().get_citations(doc)
+    with django_assert_num_queries(1):
+        assert Show().get_citations(doc) == citations
+
+    url = reverse('transcripts:show', args=(transcript.id,))
+    assert sorted(c.transcript_link for c in citations) == [
+        url + '?seq=2',
+        url + '?seq=3',
+    ]
+
+
+def test_document_transcript_references(django_assert_num_queries):
+    doc = make_document(evidence_codes=['NO-416'])
+    call_command('build_transcript_code_references', stdout=StringIO())
+
+    with django_assert_num_queries(1):
+        references = Show().get_transcript_references(doc.id)
+    # the transcript page citing the evidence code
+    assert [(r.transcript_id, r.seq_number) for r in references] == [(1, 136)]
+    assert references[0].transcript.case.tag_name
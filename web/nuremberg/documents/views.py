@@ -1,7 +1,11 @@
+from urllib.parse import urlencode
+
 from django.http import JsonResponse
 from django.shortcuts import get_object_or_404, render
+from django.urls import reverse
 from django.views.generic import View
 from nuremberg.core.highlighter import NurembergHighlighter
+from nuremberg.transcripts.models import Transcript, TranscriptCodeReference
 
 from .models import Document, DocumentPersonalAuthor, DocumentText
 
@@ -12,6 +16,42 @@ class Show(View):
     def highlight_query(self, text, query):
         return NurembergHighlighter(query).highlight(text)
 
+    def get_citations(self, document):
+        """Return the citations of `document` with a transcript page, each
+        `transcript_link` pointing to the seq of the cited page.
+
+        The seq numbers of every citation are resolved at once, see
+        `Transcript.get_seqs_from_page_numbers`.
+
+        """
+        citations = [
+            c for c in document.citations.all() if c.transcript_page_number
+        ]
+        seqs = Transcript.get_seqs_from_page_numbers(
+            (c.case_id, c.transcript_page_number) for c in citations
+        )
+        result = []
+        for citation in citations:
+            seq = seqs.get((citation.case_id, citation.transcript_page_number))
+            if seq is None:
+                continue
+            transcript_id, seq_number = seq
+            citation.transcript_link = (
+                reverse('transcripts:show', args=(transcript_id,))
+                + '?'
+                + urlencode({'seq': seq_number})
+            )
+            result.append(citation)
+        return result
+
+    def get_transcript_references(self, document_id):
+        """Return the references of the transcript pages citing a code of
+        the document, one per page, see `TranscriptCodeReference`."""
+        references = TranscriptCodeReference.objects.citing(
+            document_id
+        ).select_related('transcript__case')
+        return list({r.page_id: r for r in references}.values())
+
     def get(self, request, document_id, *args, **kwargs):
         mode = request.GET.get('mode', 'image')
         query = request.GET.get('q')
@@ -23,7 +63,9 @@ class Show(View):
         all_exhibit_codes_empty = True
 
         if mode == 'text':
-            full_text = get_object_or_404(DocumentText, id=document_id)
+            full_text = get_object_or_404(
+                DocumentText.objects.with_text(), id=document_id
+            )
             document = full_text.documents().first()
             evidence_codes = [full_text.evidence_code]
             exhibit_codes = cases = None
@@ -39,6 +81,7 @@ class Show(View):
                     'activities',
                     'cases',
                     'citations',
+                    'citations__case',
                     'evidence_codes',
                     'evidence_codes__prefix',
                     'exhibit_codes',
@@ -46,7 +89,7 @@ class Show(View):
                 ).select_related('language', 'source'),
                 id=document_id,
             )
-            full_text = document.full_texts().first()
+            full_text = document.full_texts().with_text().first()
             evidence_codes = document.evidence_codes.all()
             hlsl_item_id = document_id
             cases = document.cases.all()
@@ -60,12 +103,16 @@ class Show(View):
 
         citations = []
         try:
-            for c in document.citations.all():
-                if c.transcript_link:
-                    citations.append(c)
+            citations = self.get_citations(document)
         except Exception as e:
             print(e)
             print("Could not process citations for document")
+
+        transcript_references = []
+        if hlsl_item_id is not None:
+            transcript_references = self.get_transcript_references(
+                hlsl_item_id
+            )
         return render(
             request,
             self.template_name,
@@ -79,6 +126,7 @@ class Show(View):
                 'all_exhibit_codes_empty': all_exhibit_codes_empty,
                 'cases': cases,
                 'citations': citations,
+                'transcript_references': transcript_references,
                 'query': query,
             },
         )
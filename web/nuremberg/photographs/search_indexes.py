@@ -1,9 +1,15 @@
 from haystack import indexes
 from nuremberg.photographs.models import Photograph
+from nuremberg.search.lib.index_text import (
+    PreviewField,
+    TextBuilderMixin,
+    TextField,
+)
 
 
-class PhotographId(indexes.SearchIndex, indexes.Indexable):
-    text = indexes.CharField(document=True, use_template=True)
+class PhotographId(TextBuilderMixin, indexes.SearchIndex, indexes.Indexable):
+    text = TextField(document=True, use_template=True)
+    preview = PreviewField()
     highlight = indexes.CharField(model_attr='description')
     material_type = indexes.CharField(default='Photograph', faceted=True)
     grouping_key = indexes.FacetCharField(
@@ -23,6 +29,10 @@ class PhotographId(indexes.SearchIndex, indexes.Indexable):
     date_year = indexes.CharField(
         model_attr='date_year', faceted=True, null=True
     )
+    # for the numeric year facet and range filters
+    date_year_number = indexes.IntegerField(
+        model_attr='date_year', null=True, stored=False
+    )
     source = indexes.CharField(
         default='Photographic Archive', faceted=True, null=True
     )
@@ -32,6 +42,10 @@ class PhotographId(indexes.SearchIndex, indexes.Indexable):
     def get_model(self):
         return Photograph
 
+    def build_text(self, photo, prepared):
+        """Build the same text as the `photograph_text.txt` template."""
+        return [photo.inscription, prepared['date']]
+
     def prepare_grouping_key(self, photo):
         # This is a hack to group transcripts but not documents in a single query.
         # Transcripts get a group key, documents get a unique key.
@@ -70,13 +70,12 @@ class EmptyFacetsSearchForm(SearchForm):
             if field == 'date_year' and '-' in value:
                 self.date_range = value.split('-', 1)
                 sqs = sqs.narrow(
-                    u'date_year_exact:[%s TO %s]'
-                    % (
-                        sqs.query.clean(self.date_range[0]),
-                        sqs.query.clean(self.date_range[1]),
-                    )
+                    u'date_year_number:[%s TO %s]'
+                    % tuple(map(self.clean_year, self.date_range))
                 )
                 # sqs = sqs.filter(date_year__range=self.date_range)
+            elif field == 'date_year' and value.isdigit():
+                sqs = sqs.narrow(u'date_year_number:%s' % value)
             else:
                 if value == 'None':
                     sqs = sqs.narrow(u'-%s_exact:[* TO *]' % (field))
@@ -87,6 +86,12 @@ class EmptyFacetsSearchForm(SearchForm):
 
         return sqs
 
+    @staticmethod
+    def clean_year(year):
+        """Return a year range bound for the numeric year field."""
+        year = year.strip()
+        return year if year.isdigit() else '*'
+
 
 class FieldedSearchForm(SearchForm):
     """Natural fielded search form.
@@ -0,0 +1,86 @@
+"""Build the catch-all text of the search indexes without templates.
+
+By default, haystack renders the `document=True` field of every index from
+its template under `search/templates/search/indexes/`, which walks again
+every relation the `prepare_*` methods already evaluated. When
+`settings.SEARCH_INDEX_TEXT_BUILDERS` is set, indexes using `TextBuilderMixin`
+assemble the same text in Python, mostly from the already prepared values.
+
+"""
+
+from django.conf import settings
+from django.utils.formats import localize
+from django.utils.html import conditional_escape
+from haystack import indexes
+
+# This is a sentinel value used to hide the following terms from highlighting
+# snippets, it must match the one in the index templates.
+END_OF_TEXT = '<end of text>'
+
+# Length of the start of the catch-all text stored in `PreviewField`s
+PREVIEW_LENGTH = 300
+
+
+def use_text_builders():
+    return getattr(settings, 'SEARCH_INDEX_TEXT_BUILDERS', False)
+
+
+def render_value(value):
+    """Render `value` as `{{ value }}` does in an autoescaped template."""
+    return conditional_escape(localize(value))
+
+
+class TextField(indexes.CharField):
+    """The catch-all field of an index using `TextBuilderMixin`.
+
+    It is rendered from its template as usual, unless text builders are
+    enabled, in which case the index fills it in once every other field was
+    prepared.
+
+    """
+
+    def prepare(self, obj):
+        if use_text_builders():
+            return None
+        return super().prepare(obj)
+
+
+class PreviewField(indexes.CharField):
+    """The start of the catch-all text of an index using `TextBuilderMixin`.
+
+    Search results show it when they have no highlight snippets, so they can
+    be fetched without the whole text.
+
+    """
+
+    def __init__(self, **kwargs):
+        kwargs.setdefault('indexed', False)
+        kwargs.setdefault('null', True)
+        super().__init__(**kwargs)
+
+
+class TextBuilderMixin:
+    """Fill the content field from `build_text` instead of its template.
+
+    Subclasses implement `build_text(obj, prepared)`, getting the prepared
+    data of every other field and returning the chunks of text in the same
+    order as the template. Chunks are rendered as template variables would
+    be, so use `mark_safe` for those the template marks as `safe`.
+
+    Any `PreviewField` gets the first `PREVIEW_LENGTH` characters of the
+    content field, however it was filled in.
+
+    """
+
+    def prepare(self, obj):
+        prepared = super().prepare(obj)
+        content_field = self.fields[self.get_content_field()]
+        if use_text_builders():
+            prepared[content_field.index_fieldname] = '\n\n'.join(
+                render_value(chunk) for chunk in self.build_text(obj, prepared)
+            )
+        text = prepared.get(content_field.index_fieldname) or ''
+        for field in self.fields.values():
+            if isinstance(field, PreviewField):
+                prepared[field.index_fieldname] = text[:PREVIEW_LENGTH]
+        return prepared
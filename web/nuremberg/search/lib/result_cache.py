@@ -0,0 +1,206 @@
+"""Cache the processed results of Solr searches.
+
+The indexed corpus only changes when it is reindexed, yet paging through
+results and clicking facets sends the same heavy grouped and faceted searches
+to Solr again and again. `GroupedSolrSearchBackend.search` keeps the results
+it builds (the groups, facets and counts) in the "search" cache, keyed by a
+canonical form of the Solr request: the query string with its whitespace
+collapsed, and every parameter (filters, year range, sort, page offsets,
+highlighting...) with unordered values sorted.
+
+Every key includes the index generation, a token replaced whenever the index
+is written (see `bump_generation`), so a reindex invalidates every entry.
+Entries older than `settings.SEARCH_RESULT_CACHE_FRESH` seconds are still
+served, while a background thread searches again and replaces them.
+
+Identical searches missing the cache at once (when a link sends many users
+to the same search) are coalesced: the threads of a process wait for the
+results of the first one, and other processes wait up to
+`settings.SEARCH_SINGLE_FLIGHT_WAIT` seconds for them to be cached while the
+search holds a lock in the cache.
+
+"""
+
+import hashlib
+import json
+import logging
+import threading
+import time
+import uuid
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.core.cache import caches
+
+CACHE_ALIAS = 'search'
+GENERATION_KEY = 'search-results:generation'
+# How long a search or refresh of an entry blocks others from starting
+LOCK_TIMEOUT = 60
+# Interval between checks for the results of a search in another process
+POLL_INTERVAL = 0.05
+
+logger = logging.getLogger(__name__)
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def get_generation():
+    cache = get_cache()
+    generation = cache.get(GENERATION_KEY)
+    if generation is None:
+        cache.add(GENERATION_KEY, uuid.uuid4().hex, timeout=None)
+        generation = cache.get(GENERATION_KEY)
+    return generation
+
+
+def bump_generation():
+    """Invalidate every cached result, to be called after writing the index."""
+    get_cache().set(GENERATION_KEY, uuid.uuid4().hex, timeout=None)
+
+
+def canonical_value(value):
+    if isinstance(value, str):
+        return ' '.join(value.split())
+    if isinstance(value, dict):
+        return {str(k): canonical_value(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [canonical_value(v) for v in value]
+    if isinstance(value, (set, frozenset)):
+        return sorted(map(canonical_value, value), key=json.dumps)
+    if isinstance(value, type):
+        return f'{value.__module__}.{value.__qualname__}'
+    if value is None or isinstance(value, (bool, int, float)):
+        return value
+    return str(value)
+
+
+def cache_key(query_string, search_kwargs):
+    """Return the key of a search, in the current index generation."""
+    canonical = json.dumps(
+        canonical_value({'q': query_string, **search_kwargs}), sort_keys=True
+    )
+    digest = hashlib.sha256(canonical.encode()).hexdigest()
+    return f'search-results:{get_generation()}:{digest}'
+
+
+def store(key, results):
+    get_cache().set(key, (time.time(), results))
+
+
+def refresh(key, search):
+    try:
+        results, cacheable = search()
+        if cacheable:
+            store(key, results)
+    except Exception:
+        logger.exception('Failed to refresh cached search results')
+    finally:
+        get_cache().delete(f'{key}:refreshing')
+
+
+def refresh_in_background(key, search):
+    """Search again in a thread, unless another refresh is running."""
+    if not get_cache().add(f'{key}:refreshing', True, LOCK_TIMEOUT):
+        return None
+    thread = threading.Thread(target=refresh, args=(key, search), daemon=True)
+    thread.start()
+    return thread
+
+
+class SingleFlight:
+    """Run a function once for the concurrent calls with the same key.
+
+    The threads calling `do` while the first call for a key is running get
+    its result (or exception) instead of calling the function again.
+
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func):
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = Future()
+        if not leader:
+            return call.result()
+
+        try:
+            result = func()
+        except BaseException as e:
+            call.set_exception(e)
+            raise
+        else:
+            call.set_result(result)
+            return result
+        finally:
+            with self._lock:
+                del self._calls[key]
+
+
+in_flight = SingleFlight()
+
+
+def get_entry_results(key):
+    entry = get_cache().get(key)
+    return None if entry is None else entry[1]
+
+
+def wait_for_results(key, lock_key):
+    """Return the results another process is searching for once cached, or
+    None if it did not store them in time."""
+    cache = get_cache()
+    deadline = time.monotonic() + settings.SEARCH_SINGLE_FLIGHT_WAIT
+    while time.monotonic() < deadline and cache.get(lock_key) is not None:
+        time.sleep(POLL_INTERVAL)
+        results = get_entry_results(key)
+        if results is not None:
+            return results
+    return get_entry_results(key)
+
+
+def search_and_store(key, search):
+    # an identical search of another thread may have just been stored
+    results = get_entry_results(key)
+    if results is not None:
+        return results
+
+    cache = get_cache()
+    lock_key = f'{key}:searching'
+    locked = cache.add(lock_key, True, LOCK_TIMEOUT)
+    if not locked and settings.SEARCH_SINGLE_FLIGHT_WAIT:
+        results = wait_for_results(key, lock_key)
+        if results is not None:
+            return results
+
+    try:
+        results, cacheable = search()
+        if cacheable:
+            store(key, results)
+    finally:
+        if locked:
+            cache.delete(lock_key)
+    return results
+
+
+def get_or_search(query_string, search_kwargs, search):
+    """Return the cached results of a search, or run it with `search`.
+
+    `search` returns the results and whether they may be cached (results
+    of a failed search, returned empty when failing silently, may not).
+
+    """
+    key = cache_key(query_string, search_kwargs)
+    entry = get_cache().get(key)
+    if entry is not None:
+        stored_at, results = entry
+        if time.time() - stored_at > settings.SEARCH_RESULT_CACHE_FRESH:
+            refresh_in_background(key, search)
+        return results
+
+    return in_flight.do(key, lambda: search_and_store(key, search))
@@ -4,10 +4,13 @@
 # See http://wiki.apache.org/solr/FieldCollapsing for the Solr feature documentation
 from __future__ import absolute_import
 
+import json
 import logging
 
 from django.apps import apps
-from haystack.backends import EmptyResults
+from django.conf import settings
+from haystack import connections
+from haystack.backends import EmptyResults, log_query
 from haystack.backends.solr_backend import (
     SolrEngine,
     SolrSearchBackend,
@@ -16,28 +19,49 @@ from haystack.backends.solr_backend import (
 from haystack.constants import DJANGO_CT, DJANGO_ID, ID
 from haystack.models import SearchResult
 from haystack.query import SearchQuerySet
+from pysolr import SolrError
+
+from nuremberg.search.lib import result_cache
 
 # Since there's no chance of this being portable (yet!) we'll import explicitly
 # rather than using the generic imports:
 
+# The values of `settings.SEARCH_GROUPING_MODE`: Solr result grouping, or the
+# collapse query parser with the expand component (see
+# `GroupedSolrSearchBackend.build_collapse_kwargs`)
+GROUP = 'group'
+COLLAPSE = 'collapse'
+
 
 class GroupedSearchQuery(SolrSearchQuery):
     def __init__(self, *args, **kwargs):
         super(GroupedSearchQuery, self).__init__(*args, **kwargs)
         self.grouping_field = None
         self.grouping_params = {}
+        self.json_facets = {}
         self._total_document_count = None
 
     def _clone(self, **kwargs):
         clone = super(GroupedSearchQuery, self)._clone(**kwargs)
         clone.grouping_field = self.grouping_field
         clone.grouping_params = self.grouping_params
+        clone.fields = self.fields[:]
+        clone.json_facets = self.json_facets.copy()
         return clone
 
+    def set_stored_fields(self, field_names):
+        # The fields needed to build every SearchResult are always returned
+        self.fields = list(
+            dict.fromkeys((ID, DJANGO_CT, DJANGO_ID, 'score', *field_names))
+        )
+
     def add_group_by(self, field_name, params={}):
         self.grouping_field = field_name
         self.grouping_params = params
 
+    def add_json_facet(self, name, field, options):
+        self.json_facets[name] = dict(options, field=field)
+
     def post_process_facets(self, results):
         # FIXME: remove this hack once https://github.com/toastdriven/django-haystack/issues/750 lands
         # Update 2023: This was updated in this PR that was not merged in 2014 so I doubt it ever will be
@@ -68,6 +92,8 @@ class GroupedSearchQuery(SolrSearchQuery):
     def build_params(self, *args, **kwargs):
         res = super(GroupedSearchQuery, self).build_params(*args, **kwargs)
         res.update({'q.op': 'AND'})
+        if self.json_facets:
+            res['json_facets'] = self.json_facets
         if self.grouping_field is not None:
             res.update(
                 {
@@ -78,6 +104,7 @@ class GroupedSearchQuery(SolrSearchQuery):
                     'group.sort': 'date desc',
                     'group.facet': 'true',
                     'result_class': GroupedSearchResult,
+                    'grouping_mode': settings.SEARCH_GROUPING_MODE,
                 }
             )
             res.update(self.grouping_params)
@@ -173,6 +200,33 @@ class GroupedSearchQuerySet(SearchQuerySet):
         clone.query.add_group_by(field_name, params)
         return clone
 
+    def stored_fields(self, *field_names):
+        """Have Solr return only the provided stored fields of each result
+
+        By default every stored field is returned, including the whole text
+        of documents and transcript pages; highlight snippets are not affected.
+        """
+        clone = self._clone()
+        clone.query.set_stored_fields(field_names)
+        return clone
+
+    def json_facet(self, name, field=None, **options):
+        """Have Solr count the values of a field with the JSON Facet API
+
+        Every facet is sent in a single `json.facet` request, as a terms facet
+        on `field` (by default the facet field of `name`) with the `limit`,
+        `mincount`, `sort` ('count' or 'index') and `missing` options. The
+        counts are returned by `facet_counts()` under `name` like those of
+        `facet`, followed by the count of results missing the field (as None)
+        when `missing` and not zero.
+        """
+        clone = self._clone()
+        if field is None:
+            unified_index = connections[self.query._using].get_unified_index()
+            field = unified_index.get_facet_fieldname(name)
+        clone.query.add_json_facet(name, field, options)
+        return clone
+
     def post_process_results(self, results):
         # Override the default model-specific processing
         return results
@@ -212,7 +266,65 @@ class GroupedSolrSearchBackend(SolrSearchBackend):
         "/",
     )
 
+    def update(self, index, iterable, commit=True):
+        super().update(index, iterable, commit=commit)
+        result_cache.bump_generation()
+
+    def remove(self, obj_or_string, commit=True):
+        super().remove(obj_or_string, commit=commit)
+        result_cache.bump_generation()
+
+    def clear(self, models=None, commit=True):
+        super().clear(models=models, commit=commit)
+        result_cache.bump_generation()
+
+    @log_query
+    def search(self, query_string, **kwargs):
+        """Search like `SolrSearchBackend.search`, through the result cache
+        (see `nuremberg.search.lib.result_cache`)."""
+        if len(query_string) == 0:
+            return {'results': [], 'hits': 0}
+
+        return result_cache.get_or_search(
+            query_string,
+            kwargs,
+            lambda: self.run_search(query_string, **kwargs),
+        )
+
+    def run_search(self, query_string, **kwargs):
+        """Return the processed results of a search in Solr, and whether it
+        succeeded (the results of a silently failed search are empty)."""
+        search_kwargs = self.build_search_kwargs(query_string, **kwargs)
+        succeeded = True
+        try:
+            raw_results = self.conn.search(query_string, **search_kwargs)
+        except (IOError, SolrError) as e:
+            if not self.silently_fail:
+                raise
+
+            self.log.error(
+                "Failed to query Solr using '%s': %s",
+                query_string,
+                e,
+                exc_info=True,
+            )
+            raw_results = EmptyResults()
+            succeeded = False
+
+        results = self._process_results(
+            raw_results,
+            highlight=kwargs.get('highlight'),
+            result_class=kwargs.get('result_class', SearchResult),
+            distance_point=kwargs.get('distance_point'),
+            grouping_mode=kwargs.get('grouping_mode'),
+            grouping_field=kwargs.get('group.field'),
+        )
+        self.process_json_facets(raw_results, results)
+        return results, succeeded
+
     def build_search_kwargs(self, *args, **kwargs):
+        grouping_mode = kwargs.pop('grouping_mode', GROUP)
+        json_facets = kwargs.pop('json_facets', None)
         group_kwargs = [
             (i, kwargs[i]) for i in kwargs.keys() if i.startswith("group")
         ]
@@ -223,13 +335,146 @@ class GroupedSolrSearchBackend(SolrSearchBackend):
             *args, **kwargs
         )
 
-        res.update(group_kwargs)
+        if grouping_mode == COLLAPSE and group_kwargs:
+            res.update(self.build_collapse_kwargs(dict(group_kwargs), res))
+        else:
+            res.update(group_kwargs)
+        if json_facets:
+            grouping_field = None
+            if grouping_mode != COLLAPSE:
+                # collapsed results are already one document per group
+                grouping_field = dict(group_kwargs).get('group.field')
+            res['json.facet'] = self.build_json_facet(
+                json_facets, grouping_field
+            )
         if group_kwargs and 'sort' not in kwargs:
             res['sort'] = 'score desc'
 
         return res
 
-    def _process_results(self, raw_results, result_class=None, **kwargs):
+    def build_collapse_kwargs(self, group_kwargs, search_kwargs):
+        """Translate grouping parameters to the collapse query parser, which
+        keeps the first document of each group (by `group.sort`), and the
+        expand component, which returns the next ones.
+
+        This avoids counting the groups (`group.ngroups`) and faceting them
+        (`group.facet`): the hits are the number of collapsed documents and
+        facets count the first document of each group only. Only the first
+        documents are highlighted.
+        """
+        field = group_kwargs['group.field']
+        sort = group_kwargs.get('group.sort')
+        collapse = f'{{!collapse field={field}'
+        if sort:
+            collapse += f" sort='{sort}'"
+        kwargs = {
+            'fq': [*search_kwargs.get('fq', []), collapse + '}'],
+            'expand': 'true',
+            'expand.rows': max(int(group_kwargs.get('group.limit', 1)) - 1, 0),
+        }
+        if sort:
+            kwargs['expand.sort'] = sort
+        if '*' not in search_kwargs['fl'].split():
+            # needed to match the expanded documents with the first ones
+            kwargs['fl'] = f"{search_kwargs['fl']} {field}"
+        return kwargs
+
+    def build_json_facet(self, json_facets, grouping_field=None):
+        """Return the `json.facet` request of the terms facets.
+
+        Like with `group.facet`, the buckets of grouped searches count the
+        groups (unique values of `grouping_field`) rather than documents.
+        """
+        request = {}
+        for name, options in json_facets.items():
+            count = f'unique({grouping_field})' if grouping_field else None
+            sort = options.get('sort', 'count')
+            facet = {
+                'type': 'terms',
+                'field': options['field'],
+                'limit': options.get('limit', 100),
+                'mincount': options.get('mincount', 1),
+                'missing': options.get('missing', False),
+                'sort': (
+                    'index asc'
+                    if sort == 'index'
+                    else f"{'groups' if count else 'count'} desc"
+                ),
+            }
+            if count:
+                facet['facet'] = {'groups': count}
+            request[name] = facet
+        return json.dumps(request, sort_keys=True)
+
+    def process_json_facets(self, raw_results, results):
+        """Add the (value, count) of the JSON facet buckets to the facet
+        fields of the results."""
+        raw_response = getattr(raw_results, 'raw_response', {})
+        json_facets = raw_response.get('facets') or {}
+        fields = {}
+        for name, facet in json_facets.items():
+            if not isinstance(facet, dict) or 'buckets' not in facet:
+                # the total count
+                continue
+            counts = fields[name] = [
+                (bucket['val'], bucket.get('groups', bucket['count']))
+                for bucket in facet['buckets']
+            ]
+            missing = facet.get('missing', {})
+            if missing.get('count'):
+                counts.append((None, missing.get('groups', missing['count'])))
+        if fields:
+            results.setdefault('facets', {}).setdefault('fields', {})
+            results['facets']['fields'].update(fields)
+
+    def _process_collapsed_results(
+        self, raw_results, result_class, field_name, **kwargs
+    ):
+        """Build `GroupedSearchResult`s from collapsed and expanded docs."""
+        docs, raw_results.docs = raw_results.docs, []
+        try:
+            res = super(GroupedSolrSearchBackend, self)._process_results(
+                raw_results, result_class=result_class, **kwargs
+            )
+        finally:
+            raw_results.docs = docs
+
+        # the documents of every group are not counted
+        res['matches'] = res['hits']
+        res['results'] = results = []
+        raw_response = getattr(raw_results, 'raw_response', {})
+        expanded = raw_response.get('expanded', {})
+        for doc in docs:
+            more = expanded.get(doc[field_name], {'numFound': 0, 'docs': []})
+            group = {
+                'groupValue': doc[field_name],
+                'doclist': {
+                    'numFound': more['numFound'] + 1,
+                    'docs': [doc, *more['docs']],
+                },
+            }
+            results.append(
+                result_class(field_name, group, raw_results=raw_results)
+            )
+        return res
+
+    def _process_results(
+        self,
+        raw_results,
+        result_class=None,
+        grouping_mode=None,
+        grouping_field=None,
+        **kwargs,
+    ):
+        if (
+            grouping_mode == COLLAPSE
+            and result_class
+            and issubclass(result_class, GroupedSearchResult)
+        ):
+            return self._process_collapsed_results(
+                raw_results, result_class, grouping_field, **kwargs
+            )
+
         res = super(GroupedSolrSearchBackend, self)._process_results(
             raw_results, result_class=result_class, **kwargs
         )
@@ -0,0 +1,172 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from django.core.management import call_command
+from model_bakery import baker
+from nuremberg.core.management.commands.solr_bulk_index import map_bounded
+from nuremberg.documents.search_indexes import (
+    DocumentIndex,
+    DocumentTextIndex,
+)
+from nuremberg.documents.tests.helpers import (
+    make_author,
+    make_document,
+    make_document_text,
+)
+from nuremberg.photographs.search_indexes import PhotographId
+from nuremberg.transcripts.search_indexes import TranscriptPageIndex
+
+pytestmark = pytest.mark.django_db
+
+
+def build_texts(settings, index, obj):
+    settings.SEARCH_INDEX_TEXT_BUILDERS = False
+    rendered = index.prepare(obj)['text']
+    settings.SEARCH_INDEX_TEXT_BUILDERS = True
+    built = index.prepare(obj)['text']
+    # whitespace is not relevant for the indexed text
+    return ' '.join(built.split()), ' '.join(rendered.split())
+
+
+def test_document_index_text_builder(settings):
+    document = make_document(
+        evidence_codes=['PS-1234'],
+        title='Report on <Dachau> & "Natzweiler"',
+        literal_title='',
+    )
+    baker.make('DocumentDate', document=document, day=2, month=3, year=1946)
+    document.personal_authors.add(make_author(first_name="O'Hara"))
+    document.cases.add(baker.make('DocumentCase', name='NMT 01. Medical'))
+    index = DocumentIndex()
+    document = index.index_queryset().get(id=document.id)
+
+    built, rendered = build_texts(settings, index, document)
+
+    assert built == rendered
+    assert 'Report on &lt;Dachau&gt; &amp; &quot;Natzweiler&quot;' in built
+    assert '02 March 1946' in built
+    assert 'PS-1234' in built
+
+
+def test_document_index_text_builder_no_language(settings):
+    document = make_document(title='Report')
+    index = DocumentIndex()
+    document = index.index_queryset().get(id=document.id)
+    # languages without a name are found in the dump
+    document.language.name = None
+
+    built, rendered = build_texts(settings, index, document)
+
+    assert built == rendered
+    assert 'None' not in built
+
+
+def test_document_text_index_text_builder(settings):
+    document = make_document(title='Tom & Jerry')
+    text = make_document_text(
+        hlsl_doc_id=document.id,
+        title='Translation <of> document',
+        text='<p>Some & text</p>',
+    )
+    index = DocumentTextIndex()
+    text = index.index_queryset().get(id=text.id)
+
+    built, rendered = build_texts(settings, index, text)
+
+    assert built == rendered
+    assert built.startswith('<p>Some & text</p> <end of text>')
+    assert 'Translation &lt;of&gt; document' in built
+
+
+def test_transcript_page_index_text_builder(settings):
+    index = TranscriptPageIndex()
+    page = index.index_queryset().get(
+        transcript_id=1, volume_id=1, volume_seq_number=136
+    )
+
+    built, rendered = build_texts(settings, index, page)
+
+    assert built == rendered
+    assert 'NO-416 NO-417 Prosecution 22' in built
+
+
+def test_photograph_index_text_builder(settings):
+    photo = baker.make(
+        'Photograph', inscription='Caption: <Court> & Jury', year_taken='1946'
+    )
+
+    built, rendered = build_texts(settings, PhotographId(), photo)
+
+    assert built == rendered == 'Caption: &lt;Court&gt; &amp; Jury 1946'
+
+
+def test_solr_bulk_index_dump_and_load(settings, tmp_path, requests_mock):
+    url = settings.HAYSTACK_CONNECTIONS['default']['URL']
+    update = requests_mock.post(f'{url}/update')
+    photos = baker.make(
+        'Photograph', inscription='Inscription', year_taken='1946', _quantity=3
+    )
+    dump = tmp_path / 'dump.jsonl'
+
+    call_command(
+        'solr_bulk_index',
+        'photographs.photograph',
+        dump=str(dump),
+        workers=0,
+        chunk_size=2,
+    )
+
+    assert not update.called
+    docs = [json.loads(line) for line in dump.read_text().splitlines()]
+    expected = {f'photographs.photograph.{photo.id}' for photo in photos}
+    assert expected <= {doc['id'] for doc in docs}
+    assert all(doc['django_ct'] == 'photographs.photograph' for doc in docs)
+
+    call_command('solr_bulk_index', load=str(dump), chunk_size=2, clear=True)
+
+    requests = update.request_history
+    assert requests[0].json() == {'delete': {'query': '*:*'}}
+    assert requests[-1].json() == {'commit': {}}
+    assert [doc for r in requests[1:-1] for doc in r.json()] == docs
+    assert all(len(r.json()) <= 2 for r in requests[1:-1])
+
+
+def test_solr_bulk_index_posts_documents(settings, requests_mock):
+    url = settings.HAYSTACK_CONNECTIONS['default']['URL']
+    update = requests_mock.post(f'{url}/update')
+    document = make_document()
+    baker.make('DocumentDate', document=document, day=2, month=3, year=1946)
+
+    call_command('solr_bulk_index', 'documents.document', workers=0)
+
+    *posts, commit = update.request_history
+    assert commit.json() == {'commit': {}}
+    (doc,) = [
+        doc
+        for r in posts
+        for doc in r.json()
+        if doc['id'] == f'documents.document.{document.id}'
+    ]
+    assert doc['date_sort'] == '1946-03-02T00:00:00Z'
+    assert doc['date'] == '02 March 1946'
+
+
+def test_solr_bulk_index_map_bounded():
+    submitted = []
+
+    class Executor(ThreadPoolExecutor):
+        def submit(self, func, *args):
+            submitted.append(args)
+            return super().submit(func, *args)
+
+    tasks = [(i, i) for i in range(10)]
+    with Executor(max_workers=2) as executor:
+        results = map_bounded(executor, lambda a, b: a + b, tasks, 3)
+        assert next(results) == 0
+        # the first result is yielded before a 4th task is submitted
+        assert len(submitted) == 3
+        assert next(results) == 2
+        assert len(submitted) == 4
+        assert list(results) == [i * 2 for i in range(2, 10)]
+    assert submitted == tasks
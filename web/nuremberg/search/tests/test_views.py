@@ -1,19 +1,30 @@
 import json
 import re
+import threading
+from io import StringIO
 from urllib import parse
 
 import pytest
+from django.core.management import call_command
 from django.http import QueryDict
+from django.template.loader import get_template
 from django.urls import reverse
 from nuremberg.core.tests.acceptance_helpers import (
     client,
     follow_link,
     go_to,
 )
-from nuremberg.search.forms import AdvancedDocumentSearchForm
+from nuremberg.core.management.commands.solr_bulk_index import prepare_range
+from nuremberg.search.forms import (
+    AdvancedDocumentSearchForm,
+    DocumentSearchForm,
+)
+from nuremberg.search.lib import result_cache
+from nuremberg.search.lib.solr_grouping_backend import GroupedSearchQuerySet
 from nuremberg.search.templatetags.search_url import search_url
-from nuremberg.search.views import ADVANCED_SEARCH_FORM_ERRORS
+from nuremberg.search.views import ADVANCED_SEARCH_FORM_ERRORS, Search
 from nuremberg.transcripts.models import Transcript
+from nuremberg.transcripts.views import Search as TranscriptSearch
 
 SEARCH_SUMMARY_SELECTOR = '[data-test="search-result-pages-summary"]'
 pytestmark = pytest.mark.django_db
@@ -511,3 +522,416 @@ def test_advanced_search_post_with_errors():
         ("author", invalid_choice),
     ]
     assert actual == expected
+
+
+def template_fields(template_name):
+    """Return the stored fields of the results read by a results template."""
+    source = get_template(template_name).template.source
+    fields = set(re.findall(r'\b(?:result|document)\.(\w+)', source))
+    fields.update(re.findall(r"group_merge group\.documents '(\w+)'", source))
+    # not stored in Solr
+    return fields - {'highlighted', 'mode', 'model_name', 'pk'}
+
+
+def solr_params(request):
+    """Return the parameters of a Solr request, sent by pysolr in the body
+    of long requests."""
+    return parse.parse_qs(request.text or parse.urlsplit(request.url).query)
+
+
+def fake_grouped_solr(requests_mock, settings, docs, json_facets=None):
+    """Answer Solr searches with groups of `docs`, keeping only the stored
+    fields requested in `fl` as Solr does, and return the response sizes.
+
+    Collapsed searches get the first doc of each group, and the next ones as
+    expanded docs. Searches with a `json.facet` get the `json_facets`.
+    """
+    url = settings.HAYSTACK_CONNECTIONS['default']['URL']
+    sizes = []
+
+    def select(request, context):
+        params = solr_params(request)
+        fl = params.get('fl', ['* score'])[0].replace(',', ' ').split()
+        groups = []
+        for i in range(15):
+            group_docs = [
+                {
+                    key: value
+                    for key, value in dict(
+                        doc, grouping_key=f'group-{i}', score=1.0
+                    ).items()
+                    if '*' in fl or key in fl
+                }
+                for doc in docs
+            ]
+            groups.append(
+                {
+                    'groupValue': f'group-{i}',
+                    'doclist': {'numFound': 3, 'docs': group_docs},
+                }
+            )
+        response = {
+            'responseHeader': {'status': 0},
+            'highlighting': {
+                doc['id']: {'highlight': ['<mark>Brandt</mark>']}
+                for doc in docs
+            },
+        }
+        if 'json.facet' in params and json_facets is not None:
+            response['facets'] = json_facets
+        if 'expand' in params:
+            rows = int(params['expand.rows'][0])
+            response['response'] = {
+                'numFound': 15,
+                'start': 0,
+                'docs': [group['doclist']['docs'][0] for group in groups],
+            }
+            response['expanded'] = {
+                group['groupValue']: {
+                    'numFound': 2,
+                    'docs': group['doclist']['docs'][1 : rows + 1],
+                }
+                for group in groups
+            }
+        else:
+            response['grouped'] = {
+                'grouping_key': {
+                    'matches': 45,
+                    'ngroups': 15,
+                    'groups': groups,
+                }
+            }
+        body = json.dumps(response)
+        sizes.append(len(body))
+        return body
+
+    requests_mock.get(re.compile(re.escape(f'{url}/select')), text=select)
+    requests_mock.post(re.compile(re.escape(f'{url}/select')), text=select)
+    return sizes
+
+
+def test_search_result_fields(settings, requests_mock):
+    settings.SEARCH_INDEX_TEXT_BUILDERS = True
+    page = Transcript.objects.get(id=1).pages.get(seq_number=136)
+    # a typical group of transcript pages
+    docs = [
+        dict(
+            json.loads(line),
+            id=f'transcripts.transcriptpage.{i}',
+            evidence_codes=['NO-865'],
+            exhibit_codes=['Prosecution 1'],
+        )
+        for i, line in enumerate(
+            prepare_range(
+                'default', 'transcripts.transcriptpage', page.id, page.id
+            )
+            * 3
+        )
+    ]
+    sizes = fake_grouped_solr(requests_mock, settings, docs)
+
+    def search(queryset):
+        form = DocumentSearchForm(
+            {'q': 'Brandt'},
+            searchqueryset=queryset,
+            selected_facets=[],
+            facet_to_label=Search.facet_to_label,
+        )
+        return list(form.search()[:15])
+
+    full = search(GroupedSearchQuerySet())
+    results = search(
+        GroupedSearchQuerySet().stored_fields(*Search.result_fields)
+    )
+
+    full_size, size = sizes
+    # under 1 KB per result, a few times less than with the page texts
+    assert size < 15 * len(docs) * 1024
+    assert size * 5 < full_size
+    fl = solr_params(requests_mock.last_request)
+    assert 'text' not in fl['fl'][0].split()
+    assert 'highlight' not in fl['fl'][0].split()
+
+    assert len(results) == len(full) == 15
+    result, full_result = results[0].documents[0], full[0].documents[0]
+    assert result.highlighted == {'highlight': ['<mark>Brandt</mark>']}
+    assert result.preview == full_result.text[:300]
+    assert result.text is None
+
+    # every field the result templates read is fetched
+    fields = template_fields('search/document-row.html')
+    assert fields <= set(Search.result_fields)
+    assert template_fields('transcripts/search.html') <= set(
+        TranscriptSearch.result_fields
+    )
+    assert {'evidence_codes', 'exhibit_codes', 'preview'} <= fields
+    for result, full_result in zip(results[0].documents, full[0].documents):
+        for field in fields:
+            assert getattr(result, field) == getattr(full_result, field)
+
+
+def test_search_result_cache(settings, requests_mock, monkeypatch):
+    settings.CACHES = {
+        'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+        'search': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'test-search-results',
+        },
+    }
+    page = Transcript.objects.get(id=1).pages.get(seq_number=136)
+    docs = [
+        json.loads(line)
+        for line in prepare_range(
+            'default', 'transcripts.transcriptpage', page.id, page.id
+        )
+    ]
+    solr_requests = fake_grouped_solr(requests_mock, settings, docs)
+    threads = []
+    refresh_in_background = result_cache.refresh_in_background
+    monkeypatch.setattr(
+        result_cache,
+        'refresh_in_background',
+        lambda *args: threads.append(refresh_in_background(*args)),
+    )
+
+    def search(q, selected_facets, start=0):
+        form = DocumentSearchForm(
+            {'q': q},
+            searchqueryset=GroupedSearchQuerySet(),
+            selected_facets=selected_facets,
+            facet_to_label=Search.facet_to_label,
+        )
+        sqs = form.search().facet('language', missing=True)
+        return list(sqs[start : start + 15]), sqs.facet_counts()
+
+    facets = ['language:English', 'date_year:1946']
+    results, facet_counts = search('Brandt  trial', facets)
+    assert len(solr_requests) == 1
+    # same canonical search
+    cached, cached_facet_counts = search(' Brandt trial', facets[::-1])
+    assert len(solr_requests) == 1
+    assert [r.key for r in cached] == [r.key for r in results]
+    assert cached[0].documents[0].pk == results[0].documents[0].pk
+    assert cached_facet_counts == facet_counts
+    # another page
+    search('Brandt trial', facets, start=15)
+    assert len(solr_requests) == 2
+
+    # stale results are served while they are searched again
+    settings.SEARCH_RESULT_CACHE_FRESH = 0
+    stale, _ = search('Brandt trial', facets)
+    assert [r.key for r in stale] == [r.key for r in results]
+    assert len(threads) == 1
+    threads[0].join()
+    assert len(solr_requests) == 3
+    settings.SEARCH_RESULT_CACHE_FRESH = 60
+    search('Brandt trial', facets)
+    assert len(solr_requests) == 3
+
+    # writing the index invalidates every result
+    result_cache.bump_generation()
+    search('Brandt trial', facets)
+    assert len(solr_requests) == 4
+
+
+def test_search_single_flight(settings):
+    settings.CACHES = {
+        'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+        'search': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'test-search-single-flight',
+        },
+    }
+    searching = threading.Event()
+    release = threading.Event()
+    calls = []
+
+    def search():
+        calls.append(1)
+        searching.set()
+        release.wait(5)
+        return {'results': ['result'], 'hits': 1}, True
+
+    # identical searches of other threads wait for the first one
+    results = []
+
+    def run():
+        results.append(
+            result_cache.get_or_search('Brandt', {'start_offset': 0}, search)
+        )
+
+    threads = [threading.Thread(target=run) for i in range(5)]
+    for thread in threads:
+        thread.start()
+    searching.wait(5)
+    release.set()
+    for thread in threads:
+        thread.join()
+    assert len(calls) == 1
+    assert results == [{'results': ['result'], 'hits': 1}] * 5
+
+    # and those of other processes wait for the results to be cached
+    settings.SEARCH_SINGLE_FLIGHT_WAIT = 5
+    cache = result_cache.get_cache()
+    key = result_cache.cache_key('Brandt', {'start_offset': 15})
+    cache.add(f'{key}:searching', True)
+    stored = threading.Timer(
+        0.1, result_cache.store, (key, {'results': [], 'hits': 1})
+    )
+    stored.start()
+    assert result_cache.get_or_search(
+        'Brandt', {'start_offset': 15}, search
+    ) == {'results': [], 'hits': 1}
+    stored.join()
+    assert len(calls) == 1
+
+
+def test_search_collapse_grouping(settings, requests_mock):
+    page = Transcript.objects.get(id=1).pages.get(seq_number=136)
+    docs = [
+        dict(json.loads(line), id=f'transcripts.transcriptpage.{i}')
+        for i, line in enumerate(
+            prepare_range(
+                'default', 'transcripts.transcriptpage', page.id, page.id
+            )
+            * 3
+        )
+    ]
+    fake_grouped_solr(requests_mock, settings, docs)
+
+    def search():
+        form = DocumentSearchForm(
+            {'q': 'Brandt'},
+            searchqueryset=GroupedSearchQuerySet().stored_fields(
+                *Search.result_fields
+            ),
+            selected_facets=[],
+            facet_to_label=Search.facet_to_label,
+        )
+        sqs = form.search()
+        results = sqs[:15]
+        assert sqs.count() == 15
+        params = solr_params(requests_mock.last_request)
+        return results, params
+
+    grouped, group_params = search()
+    settings.SEARCH_GROUPING_MODE = 'collapse'
+    collapsed, collapse_params = search()
+
+    assert group_params['group.ngroups'] == ['true']
+    assert not any(name.startswith('group') for name in collapse_params)
+    assert (
+        "{!collapse field=grouping_key sort='score desc, seq_number asc'}"
+        in collapse_params['fq']
+    )
+    assert collapse_params['expand'] == ['true']
+    assert collapse_params['expand.rows'] == ['2']
+    assert collapse_params['expand.sort'] == ['score desc, seq_number asc']
+    assert 'grouping_key' in collapse_params['fl'][0].split()
+
+    # same results
+    assert len(collapsed) == len(grouped) == 15
+    for collapsed_group, group in zip(collapsed, grouped):
+        assert collapsed_group.key == group.key
+        assert collapsed_group.hits == group.hits == 3
+        assert [r.pk for r in collapsed_group.documents] == [
+            r.pk for r in group.documents
+        ]
+        assert collapsed_group.documents[0].highlighted == (
+            group.documents[0].highlighted
+        )
+
+
+def test_benchmark_search_grouping(settings, requests_mock):
+    page = Transcript.objects.get(id=1).pages.get(seq_number=136)
+    docs = [
+        json.loads(line)
+        for line in prepare_range(
+            'default', 'transcripts.transcriptpage', page.id, page.id
+        )
+    ]
+    sizes = fake_grouped_solr(requests_mock, settings, docs)
+    stdout = StringIO()
+    call_command(
+        'benchmark_search_grouping',
+        queries=['Brandt'],
+        repeat=2,
+        stdout=stdout,
+    )
+    lines = stdout.getvalue().splitlines()
+    assert lines[1].startswith("'Brandt' group: 15 hits, median ")
+    assert lines[2].startswith("'Brandt' collapse: 15 hits, median ")
+    # warm-up and timed runs, not cached
+    assert len(sizes) == 6
+
+
+def test_search_json_facets(settings, requests_mock):
+    page = Transcript.objects.get(id=1).pages.get(seq_number=136)
+    docs = [
+        json.loads(line)
+        for line in prepare_range(
+            'default', 'transcripts.transcriptpage', page.id, page.id
+        )
+    ]
+    fake_grouped_solr(
+        requests_mock,
+        settings,
+        docs,
+        json_facets={
+            'count': 45,
+            'date_year': {
+                'buckets': [
+                    {'val': 1945, 'count': 30, 'groups': 10},
+                    {'val': 1940, 'count': 5, 'groups': 5},
+                ],
+                'missing': {'count': 2, 'groups': 1},
+            },
+            'language': {
+                'buckets': [{'val': 'English', 'count': 45, 'groups': 15}],
+                'missing': {'count': 0},
+            },
+        },
+    )
+
+    def search():
+        form = DocumentSearchForm(
+            {'q': 'Brandt'},
+            searchqueryset=Search().get_queryset(),
+            selected_facets=['date_year:1940-1945', 'date_year:1945'],
+            facet_to_label=Search.facet_to_label,
+        )
+        sqs = form.search()
+        facet_counts = sqs.facet_counts()
+        params = solr_params(requests_mock.last_request)
+        return facet_counts, params
+
+    facet_counts, params = search()
+    assert 'facet.field' not in params
+    assert 'date_year_number:[1940 TO 1945]' in params['fq']
+    assert 'date_year_number:1945' in params['fq']
+    json_facet = json.loads(params['json.facet'][0])
+    assert list(json_facet) == sorted(Search.facet_fields)
+    assert json_facet['date_year'] == {
+        'type': 'terms',
+        'field': 'date_year_number',
+        'limit': -1,
+        'mincount': 1,
+        'missing': True,
+        'sort': 'groups desc',
+        'facet': {'groups': 'unique(grouping_key)'},
+    }
+    assert json_facet['authors']['field'] == 'authors_exact'
+    assert json_facet['authors']['limit'] == 100
+
+    # group counts, with missing counts only when not zero
+    assert facet_counts['fields'] == {
+        'date_year': [(1945, 10), (1940, 5), (None, 1)],
+        'language': [('English', 15)],
+    }
+
+    # collapsed results are counted as documents
+    settings.SEARCH_GROUPING_MODE = 'collapse'
+    _, params = search()
+    json_facet = json.loads(params['json.facet'][0])
+    assert json_facet['date_year']['sort'] == 'count desc'
+    assert 'facet' not in json_facet['date_year']
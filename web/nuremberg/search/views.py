@@ -10,7 +10,7 @@ from haystack.generic_views import (
     FacetedSearchMixin,
     FacetedSearchView,
 )
-from nuremberg.documents.models import DocumentPersonalAuthor
+from nuremberg.documents.models import author_metadata_cache
 from nuremberg.search.forms import (
     AdvancedDocumentSearchForm,
     DocumentSearchForm,
@@ -60,6 +60,38 @@ class Search(FacetedSearchView):
     )
     facet_to_label = {field: label for (label, field) in facet_labels}
     facet_fields = [label[1] for label in facet_labels]
+    # Every facet is counted in a single JSON Facet API request, on its
+    # `_exact` field unless set here, listing at most `facet_limit` values
+    # unless set in `facet_limits` (-1 for all)
+    facet_solr_fields = {"date_year": "date_year_number"}
+    facet_limit = 100
+    facet_limits = {"date_year": -1}
+
+    # The stored fields rendered for each result (see `document-row.html`),
+    # so Solr doesn't send back the whole text of every document or page
+    result_fields = (
+        "material_type",
+        "slug",
+        "title",
+        "literal_title",
+        "preview",
+        "date",
+        "total_pages",
+        "language",
+        "source",
+        "hlsl",
+        "authors",
+        "authors_properties",
+        "defendants",
+        "case_tags",
+        "trial_activities",
+        "evidence_codes",
+        "exhibit_codes",
+        "transcript_id",
+        "seq_number",
+        "page_label",
+        "thumb_url",
+    )
 
     def get(self, *args, **kwargs):
         # Redirect if missing cookie
@@ -100,9 +132,16 @@ class Search(FacetedSearchView):
     def get_queryset(self):
         # override FacetedSearchMixin
         qs = super(FacetedSearchMixin, self).get_queryset()
+        qs = qs.stored_fields(*self.result_fields)
         for field in self.facet_fields:
-            sort = "count"
-            qs = qs.facet(field, missing=True, sort=sort, mincount=1)
+            qs = qs.json_facet(
+                field,
+                self.facet_solr_fields.get(field),
+                missing=True,
+                sort="count",
+                mincount=1,
+                limit=self.facet_limits.get(field, self.facet_limit),
+            )
         return qs
 
     def get_context_data(self, **kwargs):
@@ -111,20 +150,16 @@ class Search(FacetedSearchView):
         # pull the query out of form so it is pre-processed
         context["query"] = context["form"].data.get("q") or ""
         if context["facets"]:
-            labeled_facets = []
-            for label, field in self.facet_labels:
-                counts = context["facets"]["fields"].get(field, [])
-                # missing ignores mincount and sorting
-                if (None, 0) in counts:
-                    counts.remove((None, 0))
-                else:
-                    pass
-                    # sort missing into the other facet values
-                    # counts.sort(key=lambda field: field[1], reverse=True)
-                labeled_facets.append(
-                    {"field": field, "label": label, "counts": counts}
-                )
-            context.update({"labeled_facets": labeled_facets})
+            # the missing counts are only listed when not zero
+            fields = context["facets"].get("fields", {})
+            context["labeled_facets"] = [
+                {
+                    "field": field,
+                    "label": label,
+                    "counts": fields.get(field, []),
+                }
+                for label, field in self.facet_labels
+            ]
 
         form = context["form"]
         if form:
@@ -158,9 +193,7 @@ class Search(FacetedSearchView):
 
         context["personal_authors_metadata"] = {
             metadata["author"]["id"]: metadata
-            for metadata in DocumentPersonalAuthor.objects.filter(
-                id__in=author_ids
-            ).metadata()
+            for metadata in author_metadata_cache.get_many(author_ids)
         }
 
         return context
@@ -91,6 +91,35 @@ DATABASES = {
 }
 DEFAULT_AUTO_FIELD = "django.db.models.AutoField"
 
+# The joined HTML of transcript pages is cached per page range (see
+# `nuremberg.transcripts.joins`) in a store that survives restarts, filled
+# ahead of time with the `warm_transcript_joins` command.
+TRANSCRIPTS_CACHE_DIR = env(
+    "TRANSCRIPTS_CACHE_DIR", default=str(BASE_DIR / "transcripts_cache")
+)
+
+# The processed results of Solr searches (see
+# `nuremberg.search.lib.result_cache`), shared by every process of the host.
+SEARCH_CACHE_DIR = env(
+    "SEARCH_CACHE_DIR", default=str(BASE_DIR / "search_cache")
+)
+
+CACHES = {
+    "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+    "transcripts": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": TRANSCRIPTS_CACHE_DIR,
+        "TIMEOUT": None,
+        "OPTIONS": {"MAX_ENTRIES": 100000},
+    },
+    "search": {
+        "BACKEND": "django.core.cache.backends.filebased.FileBasedCache",
+        "LOCATION": SEARCH_CACHE_DIR,
+        "TIMEOUT": 60 * 60 * 24 * 7,
+        "OPTIONS": {"MAX_ENTRIES": 20000},
+    },
+}
+
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -202,6 +231,33 @@ TRANSCRIPTS_BUCKET = env(
 
 AWS_QUERYSTRING_AUTH = False
 
+# Document image dimensions are stored in the DB (see the
+# `backfill_image_dimensions` command). When this is set, images missing them
+# will read their header from the bucket when first rendered.
+DOCUMENT_IMAGE_DIMENSIONS_ON_MISS = env.bool(
+    "DOCUMENT_IMAGE_DIMENSIONS_ON_MISS", default=False
+)
+
+# Build the catch-all text of the search indexes in Python instead of
+# rendering the `search/indexes/` templates (see `nuremberg.search.lib`).
+SEARCH_INDEX_TEXT_BUILDERS = env.bool(
+    "SEARCH_INDEX_TEXT_BUILDERS", default=False
+)
+
+# Cached search results older than this many seconds are still served, while
+# they are searched again in the background.
+SEARCH_RESULT_CACHE_FRESH = env.int("SEARCH_RESULT_CACHE_FRESH", default=60 * 60)
+
+# A search identical to one running in another process waits up to this many
+# seconds for its results to be cached (0 to search right away).
+SEARCH_SINGLE_FLIGHT_WAIT = env.float("SEARCH_SINGLE_FLIGHT_WAIT", default=5)
+
+# How search results are grouped by document or transcript: "group" (Solr
+# result grouping) or "collapse" (the cheaper collapse query parser and expand
+# component, see `nuremberg.search.lib.solr_grouping_backend`). Compare them
+# with the `benchmark_search_grouping` command.
+SEARCH_GROUPING_MODE = env("SEARCH_GROUPING_MODE", default="group")
+
 if not LOCAL_DEVELOPMENT:
     DEFAULT_FILE_STORAGE = "storages.backends.s3boto3.S3Boto3Storage"
     # AWS_S3_ACCESS_KEY_ID = env('AWS_S3_ACCESS_KEY_ID')
@@ -230,7 +286,11 @@ if LOCAL_DEVELOPMENT:
     COMPRESS_ENABLED = True
     COMPRESS_FORCE = False
 
-    CACHES = {"default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"}}
+    CACHES = {
+        "default": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+        "transcripts": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+        "search": {"BACKEND": "django.core.cache.backends.dummy.DummyCache"},
+    }
 
     STATIC_PRECOMPILER_COMPILERS = (
         (
@@ -15,7 +15,11 @@ PASSWORD_HASHERS = ["django.contrib.auth.hashers.MD5PasswordHasher"]
 
 # disable cache during tests
 CACHES = {
-    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'}
+    'default': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
+    'transcripts': {
+        'BACKEND': 'django.core.cache.backends.dummy.DummyCache'
+    },
+    'search': {'BACKEND': 'django.core.cache.backends.dummy.DummyCache'},
 }
 
 DEFAULT_FILE_STORAGE = 'django.core.files.storage.FileSystemStorage'
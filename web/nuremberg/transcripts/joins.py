@@ -0,0 +1,109 @@
+"""Cache the joined HTML of transcript page ranges.
+
+Joining pages with `TranscriptPageJoiner` needs their XML and is the slowest
+part of showing a transcript. `Show` aligns the ranges it requests to strides
+of `Show.page_alignment` pages, so the joiner output of these ranges is cached
+in the persistent "transcripts" cache, keyed by the transcript `updated_at`
+so a re-ingested transcript is joined again. Search terms are highlighted on
+the cached HTML, page by page.
+
+"""
+
+from django.core.cache import caches
+
+from nuremberg.core.highlighter import NurembergHighlighter
+
+from .xml import TranscriptPageJoiner
+
+CACHE_ALIAS = 'transcripts'
+
+# The page attributes used by the `transcripts/joined_pages.html` template
+PAGE_FIELDS = ('seq_number', 'page_number', 'page_label', 'date', 'image_url')
+
+
+def get_cache():
+    return caches[CACHE_ALIAS]
+
+
+def cache_key(transcript, from_seq, to_seq):
+    return (
+        f'transcript-joins:{transcript.id}:'
+        f'{transcript.updated_at:%Y%m%d%H%M%S%f}:{from_seq}:{to_seq}'
+    )
+
+
+def build_joined_pages(transcript, from_seq, to_seq):
+    """Join the pages of `transcript` between `from_seq` and `to_seq`.
+
+    Return a dict with the joiner's `from_seq` and `to_seq`, and its
+    `pages` as rows of `page` (the `PAGE_FIELDS` of the page) and `html`.
+
+    """
+    include_first = from_seq == 1
+    include_last = to_seq == transcript.total_pages
+    # with their joins stored, the pages only used to complete the joins at
+    # either end of the range are not needed
+    pages = list(
+        transcript.pages.filter(
+            seq_number__gte=from_seq if include_first else from_seq + 1,
+            seq_number__lte=to_seq if include_last else to_seq - 1,
+        )
+        .order_by('seq_number')
+        .with_xml()
+    )
+    if (
+        pages
+        and pages[0].joins_previous is not None
+        and pages[-1].joins_previous is not None
+    ):
+        joiner = TranscriptPageJoiner(pages, stored_joins=True)
+    else:
+        pages = transcript.pages.filter(
+            seq_number__gte=from_seq, seq_number__lte=to_seq
+        ).with_xml()
+        joiner = TranscriptPageJoiner(
+            pages, include_first=include_first, include_last=include_last
+        )
+    joiner.build_html()
+    return {
+        'pages': [
+            {
+                'page': {
+                    field: getattr(row['page'], field) for field in PAGE_FIELDS
+                },
+                'html': row['html'],
+            }
+            for row in joiner.html_pages
+        ],
+        'from_seq': joiner.from_seq,
+        'to_seq': joiner.to_seq,
+    }
+
+
+def get_joined_pages(transcript, from_seq, to_seq, cache=True):
+    """Return `build_joined_pages` for the range, from the cache if possible.
+
+    Ranges not aligned to the strides should not be cached (with `cache` set
+    to False), so arbitrary ranges do not fill the cache.
+
+    """
+    if not cache:
+        return build_joined_pages(transcript, from_seq, to_seq)
+    joins_cache = get_cache()
+    key = cache_key(transcript, from_seq, to_seq)
+    joined = joins_cache.get(key)
+    if joined is None:
+        joined = build_joined_pages(transcript, from_seq, to_seq)
+        joins_cache.set(key, joined)
+    return joined
+
+
+def highlight_pages(pages, query):
+    """Highlight `query` in the HTML of the joined `pages`."""
+    if not query:
+        return pages
+    highlighter = NurembergHighlighter(query)
+    return [
+        {'page': row['page'], 'html': highlighter.highlight(row['html'])}
+        for row in pages
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:18
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transcripts', '0010_alter_transcriptvolume_volume_number'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transcriptpage',
+            name='evidence_codes',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='transcriptpage',
+            name='exhibit_codes',
+            field=models.JSONField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='transcriptpage',
+            name='extracted_text',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='transcriptpage',
+            name='speakers',
+            field=models.JSONField(blank=True, null=True),
+        ),
+    ]
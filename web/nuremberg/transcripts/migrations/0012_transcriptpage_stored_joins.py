@@ -0,0 +1,23 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:41
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transcripts', '0011_transcriptpage_extracted_fields'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transcriptpage',
+            name='carry_out_html',
+            field=models.TextField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='transcriptpage',
+            name='joins_previous',
+            field=models.BooleanField(null=True),
+        ),
+    ]
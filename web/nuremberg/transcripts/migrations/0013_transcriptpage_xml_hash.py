@@ -0,0 +1,42 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:44
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def hash_page_xml(apps, schema_editor):
+    """Store the hash of every page XML, so the next ingest can skip them."""
+    TranscriptPage = apps.get_model('transcripts', 'TranscriptPage')
+    db_alias = schema_editor.connection.alias
+    batch = []
+    for page in (
+        TranscriptPage.objects.using(db_alias)
+        .only('id', 'xml')
+        .order_by('id')
+        .iterator(1000)
+    ):
+        page.xml_hash = hashlib.sha256(page.xml.encode('utf8')).hexdigest()
+        batch.append(page)
+        if len(batch) >= 1000:
+            TranscriptPage.objects.using(db_alias).bulk_update(
+                batch, ['xml_hash']
+            )
+            batch = []
+    TranscriptPage.objects.using(db_alias).bulk_update(batch, ['xml_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('transcripts', '0012_transcriptpage_stored_joins'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transcriptpage',
+            name='xml_hash',
+            field=models.CharField(blank=True, max_length=64, null=True),
+        ),
+        migrations.RunPython(hash_page_xml, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.1.7 on 2026-10-18 18:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('documents', '0027_documentauthorextra_version'),
+        ('transcripts', '0013_transcriptpage_xml_hash'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TranscriptCodeReference',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('evidence', 'Evidence code'), ('exhibit', 'Exhibit code')], max_length=10)),
+                ('code', models.CharField(max_length=255)),
+                ('seq_number', models.BigIntegerField(blank=True, null=True)),
+                ('document', models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.DO_NOTHING, related_name='transcript_code_references', to='documents.document')),
+                ('page', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='code_references', to='transcripts.transcriptpage')),
+                ('transcript', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='code_references', to='transcripts.transcript')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='transcriptcodereference',
+            index=models.Index(fields=['kind', 'code'], name='transcripts_kind_20825a_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transcriptcodereference',
+            index=models.Index(fields=['document', 'kind', 'code'], name='transcripts_documen_8e1eb0_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='transcriptcodereference',
+            index=models.Index(fields=['page', 'kind', 'code'], name='transcripts_page_id_b601fd_idx'),
+        ),
+    ]
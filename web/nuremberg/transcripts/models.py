@@ -1,14 +1,17 @@
+import hashlib
 import logging
 import re
 from datetime import datetime
 
 from django.db import models
+from django.db.models import Q
 from django.utils.functional import cached_property
 from django.utils.text import slugify
 from lxml import etree
 from nuremberg.core.storages import TranscriptStorage
-from nuremberg.documents.models import DocumentActivity, DocumentCase
+from nuremberg.documents.models import Document, DocumentActivity, DocumentCase
 
+from .navigation import get_navigation
 from .xml import TranscriptPageJoiner
 
 logger = logging.getLogger(__name__)
@@ -34,46 +37,55 @@ class Transcript(models.Model):
         return min(max(seq, 1), self.total_pages)
 
     @cached_property
+    def navigation(self):
+        """The page, date and seq index of the transcript, see `navigation`."""
+        return get_navigation(self)
+
+    @property
     def total_pages(self):
-        return self.pages.count()
+        return self.navigation.total_pages
 
     def dates(self):
-        return self.pages.order_by().values_list("date", flat=True).distinct()
+        return self.navigation.dates
 
     def get_seq_from_page_date(self, page_date, seq_number):
         # find the seq number for provided date
         # assume dates are valid since they come from selection
-        page_date = datetime.strptime(page_date, "%Y-%m-%d")
-        page = self.pages.filter(date=page_date).order_by("seq_number").first()
-        if page:
-            return page.seq_number
-        return seq_number
+        page_date = datetime.strptime(page_date, "%Y-%m-%d").date()
+        return self.navigation.seq_from_date(page_date, seq_number)
 
     def get_seq_from_page_number(self, page_number, seq_number):
         # find the seq number for provided page number
-        # we have to be a bit tricky because page numbers can repeat
-        page = (
-            self.pages.filter(page_number=page_number)
-            .extra(
-                select={"distance": "ABS(seq_number - %s)"},
-                select_params=(seq_number,),
-                order_by=("distance",),
+        # page numbers can repeat, so the nearest to seq_number is used
+        return self.navigation.seq_from_page_number(page_number, seq_number)
+
+    @classmethod
+    def get_seqs_from_page_numbers(cls, case_page_numbers):
+        """Map (case id, page number) pairs to the (transcript id, seq number)
+        of the page, for the cases with a transcript.
+
+        The transcripts are fetched in one query and the pages are found in
+        their `navigation`, however many pairs are resolved.
+
+        """
+        case_page_numbers = set(case_page_numbers)
+        transcripts = {
+            transcript.case_id: transcript
+            for transcript in cls.objects.filter(
+                case_id__in={case_id for case_id, _ in case_page_numbers}
             )
-            .first()
-        )
-        if page:
-            return page.seq_number
-        else:
-            # guesstimate
-            page = (
-                self.pages.filter(page_number__lte=page_number)
-                .order_by("-page_number")
-                .first()
+        }
+        seqs = {}
+        for case_id, page_number in case_page_numbers:
+            transcript = transcripts.get(case_id)
+            if transcript is None or not transcript.total_pages:
+                continue
+            seq_number = transcript.get_seq_from_page_number(page_number, 1)
+            seqs[case_id, page_number] = (
+                transcript.id,
+                transcript.clamp_seq(seq_number),
             )
-            if page:
-                return page.seq_number + (page_number - page.page_number)
-
-        return seq_number
+        return seqs
 
 
 class TranscriptVolume(models.Model):
@@ -88,15 +100,20 @@ class TranscriptVolume(models.Model):
         return "Transcript volume {}".format(self.volume_number)
 
 
-# class TranscriptPageQuerySet(models.QuerySet):
-#     use_for_related_fields = True
-#     def joined_text(self):
-#         joiner = TranscriptPageJoiner(self.all())
-#         return joiner.html()
+class TranscriptPageQuerySet(models.QuerySet):
+    def with_xml(self):
+        """Load the page XML, deferred by default."""
+        return self.defer(None)
+
+
+class TranscriptPageManager(models.Manager.from_queryset(TranscriptPageQuerySet)):
+    def get_queryset(self):
+        # Only joining, indexing and ingesting need the XML, see `with_xml`
+        return super().get_queryset().defer("xml")
 
 
 class TranscriptPage(models.Model):
-    # objects = TranscriptPageQuerySet.as_manager()
+    objects = TranscriptPageManager()
 
     transcript = models.ForeignKey(
         Transcript, related_name="pages", on_delete=models.PROTECT
@@ -114,8 +131,27 @@ class TranscriptPage(models.Model):
     page_label = models.CharField(max_length=10, blank=True, null=True)
 
     xml = models.TextField()
+    # SHA-256 of the XML, so re-ingesting skips unchanged pages
+    xml_hash = models.CharField(max_length=64, blank=True, null=True)
     image = models.ImageField(null=True, blank=True, storage=TranscriptStorage())
 
+    # Extracted from the XML by `populate_from_xml`. These are None until the
+    # page is (re)ingested or the `backfill_transcript_extraction` command runs.
+    extracted_text = models.TextField(blank=True, null=True)
+    evidence_codes = models.JSONField(blank=True, null=True)
+    exhibit_codes = models.JSONField(blank=True, null=True)
+    speakers = models.JSONField(blank=True, null=True)
+
+    EXTRACTED_FIELDS = ("extracted_text", "evidence_codes", "exhibit_codes", "speakers")
+
+    # Set by the `backfill_transcript_joins` command from a full join of the
+    # transcript (see `TranscriptPageJoiner.measure_joins`), so any range can be
+    # joined from its own pages. None until measured, or after re-ingesting.
+    joins_previous = models.BooleanField(null=True)
+    carry_out_html = models.TextField(blank=True, null=True)
+
+    JOIN_FIELDS = ("joins_previous", "carry_out_html")
+
     class Meta:
         unique_together = (
             ("transcript", "seq_number"),
@@ -141,38 +177,30 @@ class TranscriptPage(models.Model):
         return etree.fromstring(self.xml.encode("utf8"))
 
     def populate_from_xml(self):
-        for event, element in etree.iterwalk(self.xml_tree()):
-            if event != "end":
-                continue
-            if element.tag == "seqNo":
-                self.seq_number = int(element.text)
-            elif element.tag == "sessionDate":
-                try:
-                    self.date = datetime.strptime(element.get("n"), "%Y-%m-%d")
-                except:
-                    self.date = None
-            elif element.tag == "pageNum":
-                self.page_label = element.get("n")
-                page_int = re.sub(r"[^\d]", "", self.page_label)
-                if page_int:
-                    page_number_value = int(page_int)
-                    # BigIntegerField max is 2^63-1
-                    BIGINT_MAX = 9223372036854775807
-                    if page_number_value > BIGINT_MAX:
-                        self.page_number = -1
-                        logger.warning(
-                            f"Page number {page_number_value} exceeds BigIntegerField max. "
-                            f"Set to -1. page_label={self.page_label}"
-                        )
-                    else:
-                        self.page_number = page_number_value
-                else:
-                    self.page_number = None
+        """Set every field derived from the XML, which is parsed only once.
 
-    def text(self):
+        Besides the seq number, date and page number, this stores the plain
+        text, evidence codes, exhibit codes and speakers of the page (see
+        `EXTRACTED_FIELDS`), so indexing does not need the XML at all.
+
+        """
+        for name, value in self.parse_xml().items():
+            setattr(self, name, value)
+        self.xml_hash = self.hash_xml(self.xml)
+
+    @staticmethod
+    def hash_xml(xml):
+        return hashlib.sha256(xml.encode("utf8")).hexdigest()
+
+    def parse_xml(self):
+        """Walk the XML once and return the values of the XML derived fields."""
+        result = {}
         # TODO: this blob won't allow exact phrase matches across transcript pages.
         # It might be extended a few words into either adjacent page to allow that.
-        text = ""
+        text = []
+        evidence_codes = []
+        exhibit_codes = []
+        speakers = []
         for event, element in etree.iterwalk(self.xml_tree(), events=("start", "end")):
             if element.tag == "p":
                 if len(element) and element[0].tag == "runningHead":
@@ -183,42 +211,176 @@ class TranscriptPage(models.Model):
                             element.text
                         ) < 20 and TranscriptPageJoiner.ignore_p.match(element.text):
                             continue
-                        text += element.text
+                        text.append(element.text)
                 else:
-                    text += "\n\n"
-            elif event == "end" and element.tag == "spkr":
+                    text.append("\n\n")
+            elif event != "end":
+                continue
+            elif element.tag == "spkr":
                 if element.text:
-                    text += '<span class="speaker">{}</span> '.format(element.text)
+                    speakers.append(element.text)
+                    text.append('<span class="speaker">{}</span> '.format(element.text))
                 if element.tail:
-                    text += element.tail
-            elif event == "end" and element.tag in (
-                "evidenceFileDoc",
-                "exhibitDocDef",
-                "exhibitDocPros",
-            ):
+                    text.append(element.tail)
+            elif element.tag in ("evidenceFileDoc", "exhibitDocDef", "exhibitDocPros"):
+                if element.tag == "evidenceFileDoc":
+                    evidence_codes.append(element.get("n"))
+                elif element.tag == "exhibitDocPros":
+                    exhibit_codes.append("Prosecution {}".format(element.get("n")))
+                else:
+                    exhibit_codes.append(
+                        "{} {}".format(
+                            element.get("def") or "Unknown Defendant",
+                            element.get("n"),
+                        )
+                    )
                 if element.text:
-                    text += element.text
+                    text.append(element.text)
                 if element.tail:
-                    text += element.tail
-        return text
+                    text.append(element.tail)
+            elif element.tag == "seqNo":
+                result["seq_number"] = int(element.text)
+            elif element.tag == "sessionDate":
+                try:
+                    result["date"] = datetime.strptime(element.get("n"), "%Y-%m-%d")
+                except:
+                    result["date"] = None
+            elif element.tag == "pageNum":
+                result["page_label"] = page_label = element.get("n")
+                page_int = re.sub(r"[^\d]", "", page_label)
+                if page_int:
+                    page_number_value = int(page_int)
+                    # BigIntegerField max is 2^63-1
+                    BIGINT_MAX = 9223372036854775807
+                    if page_number_value > BIGINT_MAX:
+                        result["page_number"] = -1
+                        logger.warning(
+                            f"Page number {page_number_value} exceeds BigIntegerField max. "
+                            f"Set to -1. page_label={page_label}"
+                        )
+                    else:
+                        result["page_number"] = page_number_value
+                else:
+                    result["page_number"] = None
+
+        result["extracted_text"] = "".join(text)
+        result["evidence_codes"] = evidence_codes
+        result["exhibit_codes"] = exhibit_codes
+        result["speakers"] = list(dict.fromkeys(speakers))
+        return result
+
+    def extracted(self, name):
+        """Return the stored `name` field, or extract it if it was not stored."""
+        value = getattr(self, name)
+        if value is None:
+            value = self.parse_xml()[name]
+        return value
+
+    def text(self):
+        return self.extracted("extracted_text")
 
     def extract_evidence_codes(self):
-        codes = []
-        for event, element in etree.iterwalk(self.xml_tree()):
-            if element.tag == "evidenceFileDoc":
-                codes.append(element.get("n"))
-        return codes
+        return self.extracted("evidence_codes")
 
     def extract_exhibit_codes(self):
-        codes = []
-        for event, element in etree.iterwalk(self.xml_tree()):
-            if element.tag == "exhibitDocPros":
-                codes.append("Prosecution {}".format(element.get("n")))
-            elif element.tag == "exhibitDocDef":
-                codes.append(
-                    "{} {}".format(
-                        element.get("def") or "Unknown Defendant",
-                        element.get("n"),
-                    )
-                )
-        return codes
+        return self.extracted("exhibit_codes")
+
+    def extract_speakers(self):
+        return self.extracted("speakers")
+
+
+class TranscriptCodeReferenceQuerySet(models.QuerySet):
+    def with_codes_of(self, **lookup):
+        """The references with a (kind, code) pair of the references matching
+        `lookup`, in one uncorrelated subquery per kind so the (kind, code)
+        index drives the search."""
+        query = Q()
+        for kind, _ in self.model.KIND_CHOICES:
+            codes = self.filter(kind=kind, **lookup).values("code")
+            query |= Q(kind=kind, code__in=codes)
+        return self.filter(query)
+
+    def citing(self, document_id):
+        """The references of transcript pages citing a code of the document."""
+        return (
+            self.with_codes_of(document_id=document_id)
+            .filter(page__isnull=False)
+            .order_by("transcript_id", "seq_number")
+        )
+
+    def cited_by(self, page_id):
+        """The references of documents carrying a code cited by the page."""
+        return (
+            self.with_codes_of(page_id=page_id)
+            .filter(document__isnull=False)
+            .order_by("document_id")
+        )
+
+
+class TranscriptCodeReference(models.Model):
+    """An evidence or exhibit code cited by a transcript page or carried by a
+    document.
+
+    The rows are built by the `build_transcript_code_references` management
+    command in one pass over the codes extracted from the transcript pages and
+    the `DocumentEvidenceCode`s and `DocumentExhibitCode`s of documents, so a
+    document can list the transcript pages citing it (see `citing`) without a
+    search. Codes are stored as `normalize_code` returns them.
+
+    The document tables are replaced wholesale when loading a new dump, hence
+    no DB constraint is used for documents, and the table needs to be rebuilt
+    after a load or an ingest.
+
+    """
+
+    objects = TranscriptCodeReferenceQuerySet.as_manager()
+
+    EVIDENCE = "evidence"
+    EXHIBIT = "exhibit"
+    KIND_CHOICES = ((EVIDENCE, "Evidence code"), (EXHIBIT, "Exhibit code"))
+
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES)
+    code = models.CharField(max_length=255)
+
+    # Either a page, with its transcript and seq number to link to it...
+    page = models.ForeignKey(
+        TranscriptPage,
+        related_name="code_references",
+        on_delete=models.CASCADE,
+        blank=True,
+        null=True,
+    )
+    transcript = models.ForeignKey(
+        Transcript,
+        related_name="code_references",
+        on_delete=models.CASCADE,
+        blank=True,
+        null=True,
+    )
+    seq_number = models.BigIntegerField(blank=True, null=True)
+    # ...or a document
+    document = models.ForeignKey(
+        Document,
+        related_name="transcript_code_references",
+        on_delete=models.DO_NOTHING,
+        db_constraint=False,
+        blank=True,
+        null=True,
+    )
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["kind", "code"]),
+            models.Index(fields=["document", "kind", "code"]),
+            models.Index(fields=["page", "kind", "code"]),
+        ]
+
+    def __str__(self):
+        if self.document_id is not None:
+            return f"{self.code} | {self.document}"
+        return f"{self.code} | transcript {self.transcript_id} seq {self.seq_number}"
+
+    @staticmethod
+    def normalize_code(code):
+        """Return `code` with its whitespace collapsed, case insensitive."""
+        return " ".join(code.split()).upper()
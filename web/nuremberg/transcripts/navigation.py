@@ -0,0 +1,95 @@
+"""Navigate transcripts without querying their pages.
+
+Jumping to a page number or a date, and listing the dates of a transcript,
+used to query its pages on every request. A `TranscriptNavigation` holds the
+seq numbers, page numbers, dates and volumes of every page of a transcript in
+sorted lists, searched with `bisect`. It is loaded once per process and
+transcript `updated_at`, which ingesting transcript XML bumps, so every
+process loads it again after an ingest.
+
+"""
+
+from bisect import bisect_left, bisect_right
+
+_navigations = {}
+
+
+class TranscriptNavigation:
+    def __init__(self, updated_at, rows):
+        """`rows` are the (seq number, page number, date, volume number) of
+        every page, ordered by seq number."""
+        self.updated_at = updated_at
+        self.seq_numbers = []
+        # (page number, seq number) of the numbered pages
+        self.page_numbers = []
+        # the first seq number of each date
+        self.date_seqs = {}
+        # (first seq number, volume number) of each volume
+        self.volume_seqs = []
+        for seq_number, page_number, date, volume_number in rows:
+            self.seq_numbers.append(seq_number)
+            if page_number is not None:
+                self.page_numbers.append((page_number, seq_number))
+            if date is not None:
+                self.date_seqs.setdefault(date.date(), (date, seq_number))
+            if (
+                not self.volume_seqs
+                or self.volume_seqs[-1][1] != volume_number
+            ):
+                self.volume_seqs.append((seq_number, volume_number))
+        self.page_numbers.sort()
+        self.dates = sorted(date for date, _ in self.date_seqs.values())
+
+    @classmethod
+    def load(cls, transcript):
+        return cls(
+            transcript.updated_at,
+            transcript.pages.order_by('seq_number').values_list(
+                'seq_number', 'page_number', 'date', 'volume__volume_number'
+            ),
+        )
+
+    @property
+    def total_pages(self):
+        return len(self.seq_numbers)
+
+    def seq_from_page_number(self, page_number, seq_number):
+        """Return the seq number of the page numbered `page_number` nearest
+        to `seq_number` (page numbers can repeat), or guess it from the
+        closest lower page number."""
+        start = bisect_left(self.page_numbers, (page_number,))
+        end = bisect_right(self.page_numbers, (page_number, float('inf')))
+        if start < end:
+            seqs = [seq for _, seq in self.page_numbers[start:end]]
+            i = bisect_left(seqs, seq_number)
+            candidates = seqs[max(i - 1, 0) : i + 1]
+            return min(candidates, key=lambda seq: abs(seq - seq_number))
+        if start:
+            # guesstimate
+            lower_number, lower_seq = self.page_numbers[start - 1]
+            return lower_seq + (page_number - lower_number)
+        return seq_number
+
+    def seq_from_date(self, date, seq_number):
+        """Return the first seq number on `date`, else `seq_number`."""
+        _, seq = self.date_seqs.get(date, (None, seq_number))
+        return seq
+
+    def volume_number(self, seq_number):
+        """Return the number of the volume holding `seq_number`."""
+        i = bisect_right(self.volume_seqs, (seq_number, float('inf')))
+        return self.volume_seqs[max(i - 1, 0)][1] if self.volume_seqs else None
+
+
+def get_navigation(transcript):
+    """Return the `TranscriptNavigation` of `transcript`, loading it if new
+    to this process or older than the transcript."""
+    navigation = _navigations.get(transcript.id)
+    if navigation is None or navigation.updated_at != transcript.updated_at:
+        navigation = TranscriptNavigation.load(transcript)
+        _navigations[transcript.id] = navigation
+    return navigation
+
+
+def clear_navigations():
+    _navigations.clear()
@@ -1,9 +1,20 @@
+from django.utils.html import format_html
+from django.utils.safestring import mark_safe
 from haystack import indexes
-from nuremberg.transcripts.models import TranscriptPage
-
-
-class TranscriptPageIndex(indexes.SearchIndex, indexes.Indexable):
-    text = indexes.CharField(document=True, use_template=True)
+from nuremberg.search.lib.index_text import (
+    END_OF_TEXT,
+    PreviewField,
+    TextBuilderMixin,
+    TextField,
+)
+from nuremberg.transcripts.models import Transcript, TranscriptPage
+
+
+class TranscriptPageIndex(
+    TextBuilderMixin, indexes.SearchIndex, indexes.Indexable
+):
+    text = TextField(document=True, use_template=True)
+    preview = PreviewField()
     highlight = indexes.CharField(model_attr='text')
     material_type = indexes.CharField(
         default='Transcript Full Text', faceted=True
@@ -29,6 +40,8 @@ class TranscriptPageIndex(indexes.SearchIndex, indexes.Indexable):
 
     date = indexes.CharField(faceted=True, null=True)
     date_year = indexes.CharField(faceted=True, null=True)
+    # for the numeric year facet and range filters
+    date_year_number = indexes.IntegerField(null=True, stored=False)
     date_sort = indexes.DateTimeField(model_attr='date', null=True)
 
     authors = indexes.MultiValueField(faceted=True, null=True)
@@ -45,17 +58,75 @@ class TranscriptPageIndex(indexes.SearchIndex, indexes.Indexable):
 
     trial_activities = indexes.MultiValueField(faceted=True, null=True)
 
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._transcripts = {}
+
     def get_model(self):
         return TranscriptPage
 
     def get_updated_field(self):
         return 'updated_at'
 
+    def index_queryset(self, using=None):
+        # Transcripts may have changed since the last indexing
+        self._transcripts = {}
+        # The XML is not needed, see `TranscriptPage.populate_from_xml`
+        return TranscriptPage.objects.select_related('volume')
+
+    def transcript_context(self, page):
+        """Return the values shared by every page of the page's transcript.
+
+        These are computed once per transcript and reused for all its pages,
+        until `index_queryset` is called again.
+
+        """
+        context = self._transcripts.get(page.transcript_id)
+        if context is None:
+            transcript = (
+                Transcript.objects.select_related('case')
+                .prefetch_related('case__defendants', 'case__activities')
+                .get(id=page.transcript_id)
+            )
+            case = transcript.case
+            context = self._transcripts[page.transcript_id] = {
+                'transcript': transcript,
+                'defendants': [
+                    defendant.full_name()
+                    for defendant in case.defendants.all()
+                ],
+                'trial_activities': [
+                    activity.short_name for activity in case.activities.all()
+                ],
+            }
+        return context
+
+    def prepare(self, page):
+        # Share a single Transcript instance among the pages of a transcript,
+        # so its cached `total_pages` and case are not queried again per page
+        page.transcript = self.transcript_context(page)['transcript']
+        return super().prepare(page)
+
+    def build_text(self, page, prepared):
+        """Build the same text as the `transcriptpage_text.txt` template."""
+        return [
+            # `highlight` holds the page text, which is costly to extract
+            mark_safe(prepared['highlight']),
+            mark_safe(END_OF_TEXT),
+            *prepared['case_names'],
+            format_html('Page {}', prepared['page_label']),
+            prepared['date'] if page.date else 'Date Unknown',
+            'English',
+            'Trial Transcripts',
+            *prepared['evidence_codes'],
+            *prepared['exhibit_codes'],
+        ]
+
     def prepare_grouping_key(self, page):
         # This is a hack to group transcripts but not pages in a single query.
         # Transcripts get a group key, pages get a unique key.
         # This can be changed to make grouping work on volume or something else.
-        return 'Transcript_{}'.format(page.transcript.id)
+        return 'Transcript_{}'.format(page.transcript_id)
 
     def prepare_date(self, page):
         if page.date:
@@ -65,11 +136,11 @@ class TranscriptPageIndex(indexes.SearchIndex, indexes.Indexable):
         if page.date:
             return page.date.year
 
+    def prepare_date_year_number(self, page):
+        return self.prepare_date_year(page)
+
     def prepare_defendants(self, page):
-        return [
-            defendant.full_name()
-            for defendant in page.transcript.case.defendants.all()
-        ]
+        return list(self.transcript_context(page)['defendants'])
 
     def prepare_authors(self, page):
         # TODO
@@ -82,7 +153,4 @@ class TranscriptPageIndex(indexes.SearchIndex, indexes.Indexable):
         return page.extract_exhibit_codes()
 
     def prepare_trial_activities(self, page):
-        return [
-            activity.short_name
-            for activity in page.transcript.case.activities.all()
-        ]
+        return list(self.transcript_context(page)['trial_activities'])
@@ -1,17 +1,31 @@
 import os
 import re
-from datetime import datetime
+from datetime import datetime, timezone
+from io import StringIO
 
 import pytest
 from django.core.management import call_command
 from django.urls import reverse
+from model_bakery import baker
 
 from nuremberg.core.tests.acceptance_helpers import (
     follow_link,
     go_to,
 )
 from nuremberg.search.templatetags.search_url import url_with_query
-from nuremberg.transcripts.models import Transcript, TranscriptPage
+from nuremberg.transcripts.joins import (
+    build_joined_pages,
+    cache_key,
+    get_cache,
+)
+from nuremberg.transcripts.models import (
+    Transcript,
+    TranscriptCodeReference,
+    TranscriptPage,
+)
+from nuremberg.transcripts.search_indexes import TranscriptPageIndex
+from nuremberg.transcripts.views import Show
+from nuremberg.transcripts.xml import TranscriptPageJoiner
 
 
 pytestmark = pytest.mark.django_db
@@ -291,6 +305,42 @@ def test_xml_import():
     assert transcript_page.extract_exhibit_codes() == ['Prosecution 22']
 
 
+def test_xml_import_skips_unchanged(tmp_path):
+    abspath = os.path.dirname(os.path.abspath(__file__))
+    file_path = os.path.join(abspath, 'good/NRMB-NMT01-01_00136_0.xml')
+    call_command('ingest_transcript_xml', file_path, stdout=StringIO())
+    page = TranscriptPage.objects.get(
+        transcript_id=1, volume_id=1, volume_seq_number=136
+    )
+    assert page.xml_hash == TranscriptPage.hash_xml(
+        TranscriptPage.objects.with_xml().get(id=page.id).xml
+    )
+
+    stdout = StringIO()
+    changed_ids = tmp_path / 'changed_ids'
+    call_command(
+        'ingest_transcript_xml',
+        file_path,
+        changed_ids=str(changed_ids),
+        stdout=stdout,
+    )
+    assert 'Added 0, changed 0 and skipped 1 unchanged page(s).' in stdout.getvalue()
+    assert TranscriptPage.objects.get(id=page.id).updated_at == page.updated_at
+    assert changed_ids.read_text() == ''
+
+    stdout = StringIO()
+    call_command(
+        'ingest_transcript_xml',
+        file_path,
+        force=True,
+        changed_ids=str(changed_ids),
+        stdout=stdout,
+    )
+    assert 'Added 0, changed 1 and skipped 0 unchanged page(s).' in stdout.getvalue()
+    assert TranscriptPage.objects.get(id=page.id).updated_at > page.updated_at
+    assert changed_ids.read_text() == f'{page.id}\n'
+
+
 def test_page_number_overflow():
     """Test that extremely large page numbers are handled gracefully."""
     abspath = os.path.dirname(os.path.abspath(__file__))
@@ -309,3 +359,387 @@ def test_page_number_overflow():
     assert transcript_page.page_number == -1
     # page_label should preserve original value
     assert transcript_page.page_label == "99999999999999999999"
+
+
+def test_transcript_page_defers_xml(django_assert_num_queries):
+    with django_assert_num_queries(1):
+        page = TranscriptPage.objects.filter(transcript_id=1).first()
+        assert page.get_deferred_fields() == {'xml'}
+    with django_assert_num_queries(1):
+        page = TranscriptPage.objects.with_xml().get(id=page.id)
+        assert page.get_deferred_fields() == set()
+        assert page.xml_tree() is not None
+
+
+def test_xml_import_stores_extraction():
+    # as in a DB only migrated, with the extraction not backfilled
+    TranscriptPage.objects.filter(transcript_id=1).update(
+        extracted_text=None,
+        evidence_codes=None,
+        exhibit_codes=None,
+        speakers=None,
+    )
+    abspath = os.path.dirname(os.path.abspath(__file__))
+    call_command(
+        'ingest_transcript_xml',
+        os.path.join(abspath, 'good/NRMB-NMT01-01_00136_0.xml'),
+        force=True,
+        stdout=StringIO(),
+    )
+
+    transcript_page = TranscriptPage.objects.get(
+        transcript_id=1, volume_id=1, volume_seq_number=136
+    )
+
+    assert transcript_page.evidence_codes == ['NO-416', 'NO-417']
+    assert transcript_page.exhibit_codes == ['Prosecution 22']
+    assert transcript_page.speakers
+    assert (
+        transcript_page.extracted_text
+        == transcript_page.parse_xml()['extracted_text']
+    )
+    assert (
+        'The defendants Karl Brandt, Genzken, Gebhardt, Rudolf Brandt'
+        in transcript_page.extracted_text
+    )
+
+
+def test_backfill_transcript_extraction(django_assert_num_queries):
+    TranscriptPage.objects.filter(transcript_id=1).update(
+        extracted_text=None,
+        evidence_codes=None,
+        exhibit_codes=None,
+        speakers=None,
+    )
+    transcript_page = TranscriptPage.objects.get(
+        transcript_id=1, volume_id=1, volume_seq_number=136
+    )
+    # not stored, extracted from the (deferred) XML on demand
+    with django_assert_num_queries(1):
+        assert transcript_page.extract_evidence_codes() == ['NO-416', 'NO-417']
+
+    call_command('backfill_transcript_extraction', ids=[1])
+
+    transcript_page = TranscriptPage.objects.get(id=transcript_page.id)
+    with django_assert_num_queries(0):
+        assert transcript_page.extract_evidence_codes() == ['NO-416', 'NO-417']
+        assert transcript_page.extract_exhibit_codes() == ['Prosecution 22']
+        assert 'Karl Brandt' in transcript_page.text()
+
+
+def test_transcript_page_index_reuses_transcript(django_assert_num_queries):
+    baker.make(
+        'TranscriptPage',
+        transcript_id=1,
+        volume_id=1,
+        seq_number=99998,
+        volume_seq_number=99998,
+        page_label='42',
+        extracted_text='Some text',
+        evidence_codes=[],
+        exhibit_codes=[],
+        speakers=[],
+    )
+    index = TranscriptPageIndex()
+    first, second = index.index_queryset().filter(transcript_id=1)[:2]
+
+    first_data = dict(index.prepare(first))
+    with django_assert_num_queries(0):
+        second_data = index.prepare(second)
+
+    assert first_data['total_pages'] == second_data['total_pages'] >= 2
+    assert first_data['case_names'] == second_data['case_names']
+    assert first_data['defendants'] == second_data['defendants']
+
+
+@pytest.mark.parametrize(
+    'chunks',
+    [
+        [],
+        [' \n '],
+        ['<p>\n', 'Some text'],
+        ['<p>\n', 'It was signed by Dr.', '\n</p>\n', ' '],
+        ['<p>\n', 'A long paragraph ' * 100, 'ends here."', '  \n'],
+        ['<span class="heading">TITLE</span>', '\n'],
+        ['x', '.', ')', ' ', '\n', ''],
+    ],
+)
+def test_joiner_sentence_end_tail(chunks):
+    joiner = TranscriptPageJoiner([])
+    joiner.page_chunks = chunks
+    page_html = ''.join(chunks)
+
+    end = joiner.find_sentence_end()
+    expected = TranscriptPageJoiner.sentence_end.search(page_html)
+
+    assert (end and end.group(0)) == (expected and expected.group(0))
+    assert joiner.page_tail(25) == page_html[-25:]
+
+
+@pytest.fixture
+def joined_transcript():
+    xml = TranscriptPage.objects.with_xml().get(transcript_id=1).xml
+    transcript = baker.make(
+        'Transcript', title='Joined transcript', case__tag_name='NMT 2'
+    )
+    volume = baker.make('TranscriptVolume', transcript=transcript)
+    for seq_number in range(1, 26):
+        baker.make(
+            'TranscriptPage',
+            transcript=transcript,
+            volume=volume,
+            seq_number=seq_number,
+            volume_seq_number=seq_number,
+            page_number=seq_number,
+            xml=xml,
+        )
+    return transcript
+
+
+def test_warm_transcript_joins(
+    client, settings, django_assert_num_queries, joined_transcript
+):
+    transcript = joined_transcript
+    url = reverse('transcripts:show', args=(transcript.id, transcript.slug()))
+    params = {'seq': 12, 'q': 'Brandt', 'partial': 1}
+    uncached = client.get(url, params).json()
+
+    settings.CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.dummy.DummyCache'
+        },
+        'transcripts': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'test-transcript-joins',
+        },
+    }
+    stdout = StringIO()
+    call_command('warm_transcript_joins', ids=[transcript.id], stdout=stdout)
+    ranges = list(Show.cacheable_seq_ranges(transcript))
+    assert ranges == [(1, 11), (1, 21), (10, 21), (10, 25), (20, 25)]
+    assert 'Cached 5 page range(s).' in stdout.getvalue()
+
+    # only the transcript, its navigation is loaded once per process
+    with django_assert_num_queries(1):
+        cached = client.get(url, params).json()
+    assert cached == uncached
+    assert cached['from_seq'] == 1 and cached['to_seq'] == 20
+    assert '<mark class="highlighted">Brandt</mark>' in cached['html']
+
+    stdout = StringIO()
+    call_command('warm_transcript_joins', ids=[transcript.id], stdout=stdout)
+    assert 'Cached 0 page range(s).' in stdout.getvalue()
+
+    # ranges not aligned to the strides are joined but not cached
+    params = {'from_seq': 3, 'to_seq': 17, 'partial': 1}
+    response = client.get(url, params).json()
+    # the first and last pages only complete the joins of the others
+    assert (response['from_seq'], response['to_seq']) == (4, 16)
+    assert not get_cache().has_key(cache_key(transcript, 3, 17))
+
+
+def test_show_is_cacheable_seq_range(joined_transcript):
+    transcript = joined_transcript
+    cacheable = set(Show.cacheable_seq_ranges(transcript))
+    for from_seq in range(1, transcript.total_pages + 1):
+        for to_seq in range(from_seq, transcript.total_pages + 1):
+            assert Show.is_cacheable_seq_range(
+                transcript, from_seq, to_seq
+            ) == ((from_seq, to_seq) in cacheable)
+
+
+def test_transcript_navigation(
+    client, django_assert_num_queries, joined_transcript
+):
+    transcript = joined_transcript
+    first_volume = transcript.volumes.get()
+    volume = baker.make(
+        'TranscriptVolume',
+        transcript=transcript,
+        volume_number=first_volume.volume_number + 1,
+    )
+    transcript.pages.filter(seq_number__gt=20).update(volume=volume)
+    transcript.pages.filter(seq_number__in=[3, 18]).update(page_number=100)
+    transcript.pages.filter(seq_number__gte=5).update(
+        date=datetime(1946, 12, 10, tzinfo=timezone.utc)
+    )
+    transcript.pages.filter(seq_number__gte=15).update(
+        date=datetime(1946, 12, 9, tzinfo=timezone.utc)
+    )
+    transcript = Transcript.objects.get(id=transcript.id)
+
+    with django_assert_num_queries(1):
+        assert transcript.total_pages == 25
+    with django_assert_num_queries(0):
+        # the repeated page number nearest to the current seq
+        assert transcript.get_seq_from_page_number(100, 1) == 3
+        assert transcript.get_seq_from_page_number(100, 15) == 18
+        # missing page numbers are guessed from the closest lower one
+        assert transcript.get_seq_from_page_number(26, 1) == 26
+        assert transcript.get_seq_from_page_number(0, 7) == 7
+        assert transcript.get_seq_from_page_date('1946-12-09', 1) == 15
+        assert transcript.get_seq_from_page_date('1946-12-11', 7) == 7
+        assert [date.day for date in transcript.dates()] == [9, 10]
+        assert (
+            transcript.navigation.volume_number(20) == first_volume.volume_number
+        )
+        assert transcript.navigation.volume_number(21) == volume.volume_number
+
+    # loaded again once the transcript is updated, e.g. by an ingest
+    transcript.pages.filter(seq_number=25).update(page_number=200)
+    transcript.save()
+    transcript = Transcript.objects.get(id=transcript.id)
+    assert transcript.get_seq_from_page_number(200, 1) == 25
+
+    url = reverse('transcripts:show', args=(transcript.id, transcript.slug()))
+    response = client.get(url, {'page': 100, 'seq': 20, 'partial': 1})
+    assert response.json()['seq'] == 18
+    # invalid page numbers are ignored
+    for page in ('abc', '12a', ''):
+        response = client.get(url, {'page': page, 'seq': 20, 'partial': 1})
+        assert response.json()['seq'] == 20
+    response = client.get(url, {'date': '1946-12-10', 'partial': 1})
+    assert response.json()['seq'] == 5
+
+
+def test_backfill_transcript_joins(joined_transcript):
+    transcript = joined_transcript
+    ranges = [(1, 11), (10, 21), (20, 25), (4, 5), (7, 9)]
+    expected = {
+        seq_range: build_joined_pages(transcript, *seq_range)
+        for seq_range in ranges
+    }
+
+    call_command(
+        'backfill_transcript_joins', ids=[transcript.id], stdout=StringIO()
+    )
+
+    pages = list(transcript.pages.order_by('seq_number'))
+    # every page ends on "The broken lines", closed by the next heading
+    assert [page.joins_previous for page in pages] == [False] + [True] * 24
+    assert {page.carry_out_html for page in pages[:-1]} == {'\n    \n</p>\n'}
+    assert pages[-1].carry_out_html is None
+
+    transcript.refresh_from_db()
+    for seq_range in ranges:
+        assert build_joined_pages(transcript, *seq_range) == expected[seq_range]
+
+    # the pages at either end of a range are no longer read
+    TranscriptPage.objects.filter(
+        transcript=transcript, seq_number__in=[10, 21]
+    ).update(xml='')
+    assert build_joined_pages(transcript, 10, 21) == expected[(10, 21)]
+
+
+def test_bulk_xml_import(tmp_path):
+    abspath = os.path.dirname(os.path.abspath(__file__))
+    with open(os.path.join(abspath, 'good/NRMB-NMT01-01_00136_0.xml')) as f:
+        xml = f.read()
+    (tmp_path / 'NRMB-NMT01-01_00136_0.xml').write_text(
+        xml.replace('<pageNum n="121">121', '<pageNum n="122">122')
+    )
+    (tmp_path / 'NRMB-NMT01-01_99990_0.xml').write_text(
+        xml.replace('<seqNo>136</seqNo>', '<seqNo>99990</seqNo>')
+    )
+    (tmp_path / 'README.txt').write_text('Not a page')
+    checkpoint = tmp_path / 'checkpoint'
+    checkpoint.write_text(str(tmp_path / 'NRMB-NMT01-01_00136_0.xml'))
+    updated_at = Transcript.objects.get(id=1).updated_at
+
+    stdout = StringIO()
+    call_command(
+        'ingest_transcript_xml',
+        str(tmp_path),
+        d=True,
+        bulk=True,
+        workers=0,
+        checkpoint=str(checkpoint),
+        stdout=stdout,
+        stderr=StringIO(),
+    )
+
+    assert 'Saved 1 pages (1 created, 0 updated).' in stdout.getvalue()
+    assert not checkpoint.exists()
+    new_page = TranscriptPage.objects.get(transcript_id=1, seq_number=99990)
+    assert new_page.volume_id == 1 and new_page.volume_seq_number == 99990
+    assert new_page.extract_evidence_codes() == ['NO-416', 'NO-417']
+    assert new_page.image.name == 'NRMB-NMT01-01_99990_0.jpg'
+    page = TranscriptPage.objects.get(transcript_id=1, seq_number=136)
+    assert page.page_number == 121
+    assert Transcript.objects.get(id=1).updated_at > updated_at
+
+    # the new page is unchanged, only the modified one is saved
+    stdout = StringIO()
+    stderr = StringIO()
+    changed_ids = tmp_path / 'changed_ids'
+    call_command(
+        'ingest_transcript_xml',
+        str(tmp_path),
+        d=True,
+        bulk=True,
+        workers=0,
+        changed_ids=str(changed_ids),
+        stdout=stdout,
+        stderr=stderr,
+    )
+
+    assert 'Saved 1 pages (0 created, 1 updated).' in stdout.getvalue()
+    assert (
+        'Added 0, changed 1 and skipped 1 unchanged page(s).' in stdout.getvalue()
+    )
+    assert changed_ids.read_text() == f'{page.id}\n'
+    assert 'Invalid filename: README.txt' in stderr.getvalue()
+    page = TranscriptPage.objects.get(id=page.id)
+    assert page.page_number == 122
+    # the joins of the transcript are measured again
+    assert page.joins_previous is False
+    assert 'Karl Brandt' in page.text()
+
+
+def test_build_transcript_code_references(django_assert_num_queries):
+    page = TranscriptPage.objects.get(transcript_id=1, seq_number=136)
+    document = baker.make('Document')
+    baker.make(
+        'DocumentEvidenceCode',
+        prefix__code='NO',
+        number=417,
+        document=document,
+    )
+    baker.make('DocumentExhibitCode', prosecution_number=22, document=document)
+    other = baker.make('Document')
+    baker.make(
+        'DocumentEvidenceCode', prefix__code='NO', number=1, document=other
+    )
+
+    stdout = StringIO()
+    call_command('build_transcript_code_references', dry_run=True, stdout=stdout)
+    assert 'Would have deleted 0 and created' in stdout.getvalue()
+    assert not TranscriptCodeReference.objects.exists()
+
+    call_command('build_transcript_code_references', stdout=StringIO())
+    assert set(
+        page.code_references.values_list('kind', 'code', 'seq_number')
+    ) == {
+        ('evidence', 'NO-416', 136),
+        ('evidence', 'NO-417', 136),
+        ('exhibit', 'PROSECUTION 22', 136),
+    }
+
+    # both codes of the document are cited by the page
+    references = TranscriptCodeReference.objects.citing(document.id)
+    assert {(r.page_id, r.code) for r in references} == {
+        (page.id, 'NO-417'),
+        (page.id, 'PROSECUTION 22'),
+    }
+    # the codes are not looked up with a correlated subquery
+    assert 'EXISTS' not in str(references.query).upper()
+    with django_assert_num_queries(0):
+        TranscriptCodeReference.objects.citing(document.id)
+    assert not TranscriptCodeReference.objects.citing(other.id).exists()
+    assert not TranscriptCodeReference.objects.citing(0).exists()
+    # filters already applied are kept
+    exhibits = TranscriptCodeReference.objects.filter(kind='exhibit')
+    assert {r.code for r in exhibits.citing(document.id)} == {'PROSECUTION 22'}
+    assert document.id in TranscriptCodeReference.objects.cited_by(
+        page.id
+    ).values_list('document_id', flat=True)
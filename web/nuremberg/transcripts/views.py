@@ -4,8 +4,8 @@ from django.shortcuts import render
 from django.views.generic import View
 
 from nuremberg.search.views import Search as GenericSearchView
+from .joins import get_joined_pages, highlight_pages
 from .models import Transcript
-from .xml import TranscriptPageJoiner
 
 
 class Search(GenericSearchView):
@@ -13,6 +13,13 @@ class Search(GenericSearchView):
 
     paginate_by = 10
     default_sort = 'page'
+    result_fields = (
+        'transcript_id',
+        'slug',
+        'seq_number',
+        'page_label',
+        'preview',
+    )
 
     def get(self, request, transcript_id, *args, **kwargs):
         self.transcript = Transcript.objects.get(id=transcript_id)
@@ -41,7 +48,15 @@ class Show(View):
 
         query = request.GET.get('q')
         seq_number = int(request.GET.get('seq', 1))
-        # Note: 'page' parameter no longer supported, only 'seq'
+        # page and date jumps are resolved by `transcript.navigation`
+        try:
+            page_number = int(request.GET.get('page', ''))
+        except ValueError:
+            page_number = None
+        if page_number is not None:
+            seq_number = transcript.clamp_seq(
+                transcript.get_seq_from_page_number(page_number, seq_number)
+            )
 
         page_date = request.GET.get('date')
         if page_date:
@@ -54,30 +69,29 @@ class Show(View):
         from_seq = transcript.clamp_seq(from_seq)
         to_seq = transcript.clamp_seq(to_seq)
 
-        pages = transcript.pages.filter(
-            seq_number__gte=from_seq, seq_number__lte=to_seq
-        ).all()
-        joiner = TranscriptPageJoiner(
-            pages,
-            query=query,
-            include_first=from_seq == 1,
-            include_last=to_seq == total_pages,
+        joined = get_joined_pages(
+            transcript,
+            from_seq,
+            to_seq,
+            cache=self.is_cacheable_seq_range(transcript, from_seq, to_seq),
         )
-        joiner.build_html()
 
         context = {
             'html': render_to_string(
                 'transcripts/joined_pages.html',
-                {'pages': joiner.html_pages},
+                {'pages': highlight_pages(joined['pages'], query)},
             ),
-            'from_seq': joiner.from_seq,
-            'to_seq': joiner.to_seq,
+            'from_seq': joined['from_seq'],
+            'to_seq': joined['to_seq'],
             'seq': seq_number,
         }
 
         if request.GET.get('partial'):
             return JsonResponse(context)
 
+        pages = transcript.pages.filter(
+            seq_number__gte=from_seq, seq_number__lte=to_seq
+        )
         current_page = next(
             page for page in pages if page.seq_number == seq_number
         )
@@ -115,3 +129,45 @@ class Show(View):
         )
 
         return (from_seq, to_seq)
+
+    @classmethod
+    def stride_seq_ranges(cls, transcript, start):
+        """Yield the (clamped) seq ranges requested around the stride at
+        `start`: the initial load, spanning from one stride before to one
+        stride after, and the scrolling load, spanning one stride (see
+        `page_alignment` and `transcripts.js`)."""
+        alignment = cls.page_alignment
+        for from_seq, to_seq in (
+            (start - alignment, start + alignment + 1),
+            (start, start + alignment + 1),
+        ):
+            yield transcript.clamp_seq(from_seq), transcript.clamp_seq(to_seq)
+
+    @classmethod
+    def cacheable_seq_ranges(cls, transcript):
+        """Yield the (clamped) seq ranges requested when viewing `transcript`,
+        see `stride_seq_ranges`."""
+        seen = set()
+        for start in range(0, transcript.total_pages + 1, cls.page_alignment):
+            for seq_range in cls.stride_seq_ranges(transcript, start):
+                if seq_range not in seen:
+                    seen.add(seq_range)
+                    yield seq_range
+
+    @classmethod
+    def is_cacheable_seq_range(cls, transcript, from_seq, to_seq):
+        """Whether `cacheable_seq_ranges` yields the range.
+
+        Other ranges (from arbitrary `from_seq` and `to_seq` parameters, or
+        jumps loading several strides at once) are joined without being
+        cached, so they cannot evict the cached strides.
+
+        """
+        alignment = cls.page_alignment
+        # the only strides that can start at `from_seq` once clamped
+        starts = {0, alignment, from_seq, from_seq + alignment}
+        return any(
+            (from_seq, to_seq) in cls.stride_seq_ranges(transcript, start)
+            for start in starts
+            if start % alignment == 0 and 0 <= start <= transcript.total_pages
+        )
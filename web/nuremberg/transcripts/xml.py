@@ -16,8 +16,9 @@ class TranscriptPageJoiner:
     headers when they can be identified.
 
     The class is mainly just a state-carrier for the complex logic of the put_page function.
-    It is fairly fast for what it is -- lxml and regexes should run in linear time. Still, it's probably
-    a good idea to cache the output when possible.
+    It is fairly fast for what it is -- lxml and regexes run in linear time, since the page HTML
+    is kept as a list of chunks and only its tail is checked for sentence ends. Still, it's
+    probably a good idea to cache the output when possible.
 
     Use it like so:
 
@@ -75,6 +76,11 @@ class TranscriptPageJoiner:
 
     (include_first and include_last kwargs indicate that those pages should be included in full)
 
+    The extra pages are not needed once `measure_joins` has stored, for every page, whether
+    it starts in a join from the previous pages and the HTML the next pages add to close a
+    join it ends in. With `stored_joins=True`, every page provided is output: the state
+    before the first page and the end of the last page come from those stored values.
+
     For convenience, the joiner sets attributes indicating the proper first and last
     seq number displayed. So in example one,
 
@@ -88,10 +94,16 @@ class TranscriptPageJoiner:
     """
 
     def __init__(
-        self, pages, query='', include_first=False, include_last=False
+        self,
+        pages,
+        query='',
+        include_first=False,
+        include_last=False,
+        stored_joins=False,
     ):
-        self.include_first = include_first
-        self.include_last = include_last
+        self.include_first = include_first or stored_joins
+        self.include_last = include_last or stored_joins
+        self.stored_joins = stored_joins
         self.pages = pages
         if query:
             self.highlighter = NurembergHighlighter(query)
@@ -140,6 +152,9 @@ class TranscriptPageJoiner:
         ),
     )
     sentence_end = re.compile(r'|'.join(sentence_ends))
+    # Matches of `sentence_end` span the trailing whitespace and at most 11
+    # more characters, so searching that tail is the same as searching it all
+    sentence_end_size = 12
 
     # blacklist for sentence ends
     reject_sentence_end = re.compile(r'(M\.D\.|D[Rr]\.|M[Rr]\.|\/\.+)$')
@@ -177,6 +192,13 @@ class TranscriptPageJoiner:
     # convenience output indicating the proper seq numbers to be used for splicing with this join
     from_seq = to_seq = None
 
+    # used by measure_joins for the rows of pages waiting for an open join to
+    # close, with the length of the page HTML when they started waiting
+    carry_starts = ()
+
+    # stands for the text of the previous pages when seeding an open join
+    join_placeholder = '<p>\n'
+
     def build_html(self):
         self.html_pages = []
         self.joins = []
@@ -187,6 +209,9 @@ class TranscriptPageJoiner:
 
             self.seq = page.seq_number
 
+            if index == 1 and self.stored_joins and page.joins_previous:
+                self.seed_join()
+
             if not (self.first_page or self.last_page):
                 self.from_seq = self.from_seq or self.seq
                 self.to_seq = self.seq
@@ -206,27 +231,96 @@ class TranscriptPageJoiner:
                     # if the first page ends with an open join, signal to drop that join from the output.
                     self.ignore_join = True
 
+        if self.stored_joins and self.joining:
+            carry_out_html = self.pages[count - 1].carry_out_html
+            if carry_out_html is not None:
+                self.put(carry_out_html)
+                self.close_page()
+
+    def seed_join(self):
+        """Start in an open join of dropped text, as after a first page."""
+        self.input_page = None
+        self.open_page()
+        self.put(self.join_placeholder)
+        self.joining = self.join_page = self.ignore_join = True
+
+    def measure_joins(self, pages):
+        """Yield the join values to store for the consecutive `pages`.
+
+        The pages are joined in full and, for each of them, this yields the
+        page, whether it starts in a join from the previous pages, and the
+        HTML the next pages add to close the join it ends in (None if it
+        does not, or if that join never closes). Rows are yielded as soon as
+        no join is open, so `pages` may be an iterator.
+
+        """
+        self.include_first = self.include_last = True
+        self.joins = []
+        self.carry_starts = []
+        rows = []
+        for page in pages:
+            self.html_pages = []
+            self.seq = page.seq_number
+            if self.joining:
+                self.carry_starts.append((rows[-1], len(self.page_chunks)))
+            rows.append([page, self.joining, None])
+
+            self.input_page = page
+            self.put_page(page)
+
+            if self.joining:
+                self.join_page = True
+            else:
+                yield from map(tuple, rows)
+                rows = []
+        yield from map(tuple, rows)
+
     def highlight(self, text):
         if self.highlighter:
             text = self.highlighter.highlight(text)
         return text
 
     def open_page(self):
-        self.page_html = ''
+        self.page_chunks = []
         self.log('<span>[opened seq {}]</span>'.format(self.seq))
         self.output_page = self.input_page
 
     def close_page(self):
+        if self.carry_starts:
+            for row, start in self.carry_starts:
+                row[2] = ''.join(self.page_chunks[start:])
+            self.carry_starts = []
         self.log('<span>[closed]</span>')
-        if self.page_html and self.output_page:
+        page_html = ''.join(self.page_chunks)
+        if page_html and self.output_page:
             # highlight search terms if available
-            self.page_html = self.highlight(self.page_html)
+            page_html = self.highlight(page_html)
             self.html_pages.append(
-                {'page': self.output_page, 'html': self.page_html}
+                {'page': self.output_page, 'html': page_html}
             )
 
     def put(self, text):
-        self.page_html += text
+        self.page_chunks.append(text)
+
+    def page_tail(self, size):
+        """Return the last `size` characters of the page HTML so far."""
+        tail = ''
+        for chunk in reversed(self.page_chunks):
+            tail = chunk + tail
+            if len(tail) >= size:
+                break
+        return tail[-size:]
+
+    def find_sentence_end(self):
+        """Search `sentence_end` in the page HTML so far, only in its tail."""
+        tail = ''
+        for chunk in reversed(self.page_chunks):
+            tail = chunk + tail
+            if len(tail.rstrip()) >= self.sentence_end_size:
+                break
+        # when `tail` is shorter, it is the whole page and `^` is its start
+        size = len(tail) - len(tail.rstrip()) + self.sentence_end_size
+        return self.sentence_end.search(tail[-size:])
 
     def open_p(self):
         self.put('<p>\n')
@@ -236,7 +330,7 @@ class TranscriptPageJoiner:
 
     def log(self, text):  # pragma: no cover
         if self.debug:
-            self.page_html += text
+            self.page_chunks.append(text)
 
     def join_text(self, joined_text):
         if joined_text:
@@ -334,7 +428,7 @@ class TranscriptPageJoiner:
                         continue
 
                     # decide whether to output a </p> tag
-                    end = self.sentence_end.search(self.page_html)
+                    end = self.find_sentence_end()
                     if not end or self.reject_sentence_end.search(
                         end.group(0)
                     ):
@@ -342,21 +436,21 @@ class TranscriptPageJoiner:
                         # BUG: No good way to tell if this is the middle of a word.
                         # It's usually not...
                         # For the future, use &mdash; to mark words that should be joined?
-                        if self.page_html[-1] != '—':
+                        if self.page_tail(1) != '—':
                             self.put(' ')
 
                         self.log('[IGNORING END]')
                         if self.audit:
                             self.joins.append(
                                 'IGNORED: ...{: >30} [x] ({})'.format(
-                                    self.page_html[-25:].replace('\n', '\\n'),
+                                    self.page_tail(25).replace('\n', '\\n'),
                                     self.seq,
                                 )
                             )
                             if end:
                                 self.joins.append(
                                     'REJECTED: ...{: >30} [x] ({})'.format(
-                                        self.page_html[-25:].replace(
+                                        self.page_tail(25).replace(
                                             '\n', '\\n'
                                         ),
                                         self.seq,
@@ -366,7 +460,7 @@ class TranscriptPageJoiner:
                         if self.audit:
                             self.joins.append(
                                 'ALLOWED: ...{: >30} [x] ({})'.format(
-                                    self.page_html[-25:].replace('\n', '\\n'),
+                                    self.page_tail(25).replace('\n', '\\n'),
                                     self.seq,
                                 )
                             )